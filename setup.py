@@ -38,6 +38,16 @@ setup(
         "pydantic2": ["pydantic>=2", "pydantic_settings>=2"],
         "nats-and-pydantic": ["nats-py>=2", "pydantic"],
         "nats-and-pydantic2": ["nats-py>=2", "pydantic>=2", "pydantic_settings>=2"],
+        "orjson": ["orjson>=3"],
+        "ujson": ["ujson>=5"],
+        "zstd": ["zstandard>=0.15"],
+    },
+    entry_points={
+        "console_scripts": [
+            "powerflex-logging-benchmark=powerflex_logging_utilities.benchmark:main",
+            "powerflex-logging-decode=powerflex_logging_utilities.binary_log_format:main",
+            "powerflex-logging-query=powerflex_logging_utilities.log_index:main",
+        ],
     },
     classifiers=[
         "Intended Audience :: Developers",
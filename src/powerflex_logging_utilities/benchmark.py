@@ -0,0 +1,750 @@
+"""Benchmark the logging hot paths of this package.
+
+Each scenario is run with single-threaded, multi-threaded and asyncio producers.
+For each run, the benchmark reports:
+
+- records_per_sec - logging calls per second, over all producers
+- p50_us, p99_us, p999_us - latency percentiles of a single logging call
+- alloc_peak_bytes_per_record - mean peak memory allocated during one call,
+  measured with tracemalloc in a separate single-threaded pass
+- retained_blocks_per_record - memory blocks still allocated after the calls,
+  divided by the number of calls. Anything above 0 hints at a leak or a buffer.
+
+Usage:
+
+    python -m powerflex_logging_utilities.benchmark --save benchmark.json
+    python -m powerflex_logging_utilities.benchmark --compare benchmark.json
+
+--compare exits with status 1 if records_per_sec dropped by more than
+--tolerance compared to the baseline.
+
+--buffered-memory also reports the memory used by 100000 records waiting in the
+queue of a BackgroundQueueHandler, with logging.LogRecord and CompactLogRecord.
+"""
+import argparse
+import asyncio
+import contextvars
+import dataclasses
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Sequence, TextIO, Tuple, Type
+
+from powerflex_logging_utilities import __version__, init_loggers
+from powerflex_logging_utilities.compact_log_record import CompactLogRecord
+from powerflex_logging_utilities.json_formatter import JsonFormatter
+from powerflex_logging_utilities.log_context import (
+    LogContext,
+    bind_log_context,
+    current_log_context,
+    reset_log_context,
+)
+from powerflex_logging_utilities.queue_handler import BackgroundQueueHandler
+from powerflex_logging_utilities.trace_logger import TRACE, TraceLogger
+
+LogCall = Callable[[int], None]
+Teardown = Callable[[], None]
+ScenarioSetup = Callable[[int], Tuple[LogCall, Teardown]]
+
+PRODUCERS = ["single", "threads", "asyncio"]
+
+DEFAULT_RECORDS = 20000
+DEFAULT_THREADS = 4
+DEFAULT_TASKS = 16
+DEFAULT_ALLOC_RECORDS = 500
+DEFAULT_TOLERANCE = 0.2
+BUFFERED_RECORDS = 100000
+
+SCENARIOS: Dict[str, ScenarioSetup] = {}
+
+
+def scenario(name: str) -> Callable[[ScenarioSetup], ScenarioSetup]:
+    """Register a scenario.
+
+    A scenario is a function taking the number of records to log and returning
+    a function logging record number i, and a function to clean up afterwards.
+    """
+
+    def register(setup: ScenarioSetup) -> ScenarioSetup:
+        SCENARIOS[name] = setup
+        return setup
+
+    return register
+
+
+def make_benchmark_logger(
+    name: str, logger_class: Type[logging.Logger] = logging.Logger
+) -> logging.Logger:
+    """Create a logger that is not attached to the logger hierarchy."""
+    logger = logger_class(f"{__name__}.{name}")
+    logger.propagate = False
+    return logger
+
+
+def open_devnull() -> TextIO:
+    return open(
+        os.devnull, "w", encoding="utf-8"
+    )  # pylint: disable=consider-using-with
+
+
+def close_handlers(logger: logging.Logger) -> None:
+    for handler in logger.handlers:
+        handler.close()
+    logger.handlers.clear()
+
+
+def _json_formatter_scenario(records: int, **kwargs: Any) -> Tuple[LogCall, Teardown]:
+    formatter = JsonFormatter(**kwargs)
+    log_records = [
+        logging.LogRecord(
+            "benchmark", logging.INFO, __file__, 1, "message %s", (i,), None
+        )
+        for i in range(records)
+    ]
+    for log_record in log_records:
+        log_record.request_id = "a7c3e5d2"
+
+    def log(i: int) -> None:
+        formatter.format(log_records[i])
+
+    return log, lambda: None
+
+
+@scenario("json_formatter")
+def json_formatter_scenario(records: int) -> Tuple[LogCall, Teardown]:
+    return _json_formatter_scenario(records)
+
+
+@scenario("json_formatter_cached_time")
+def json_formatter_cached_time_scenario(records: int) -> Tuple[LogCall, Teardown]:
+    return _json_formatter_scenario(records, time_format="cached")
+
+
+@scenario("json_formatter_constant_fields")
+def json_formatter_constant_fields_scenario(
+    records: int,
+) -> Tuple[LogCall, Teardown]:
+    return _json_formatter_scenario(
+        records,
+        constant_fields={
+            "service": "benchmark",
+            "host": platform.node(),
+            "pid": os.getpid(),
+        },
+    )
+
+
+def _trace_logger_scenario(level: int) -> Tuple[LogCall, Teardown]:
+    logger = make_benchmark_logger("trace", TraceLogger)
+    logger.setLevel(level)
+    logger.addHandler(logging.NullHandler())
+
+    def log(i: int) -> None:
+        logger.trace("message %s", i)  # type: ignore
+
+    return log, lambda: close_handlers(logger)
+
+
+@scenario("trace_logger_disabled")
+def trace_logger_disabled_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    return _trace_logger_scenario(logging.INFO)
+
+
+@scenario("trace_logger_enabled")
+def trace_logger_enabled_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    return _trace_logger_scenario(TRACE)
+
+
+def _caller_info_scenario(
+    logger_class: Type[logging.Logger], caller_info_level: int = logging.NOTSET
+) -> Tuple[LogCall, Teardown]:
+    logger = make_benchmark_logger("caller_info", logger_class)
+    if isinstance(logger, TraceLogger):
+        logger.caller_info_level = caller_info_level
+    logger.setLevel(logging.INFO)
+    # NullHandler only leaves the cost of creating the record
+    logger.addHandler(logging.NullHandler())
+
+    def log(i: int) -> None:
+        logger.info("message %s", i)
+
+    return log, lambda: close_handlers(logger)
+
+
+@scenario("caller_info_stdlib")
+def caller_info_stdlib_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    return _caller_info_scenario(logging.Logger)
+
+
+@scenario("caller_info_cached")
+def caller_info_cached_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    return _caller_info_scenario(TraceLogger)
+
+
+@scenario("caller_info_disabled")
+def caller_info_disabled_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    return _caller_info_scenario(TraceLogger, caller_info_level=logging.CRITICAL)
+
+
+def _init_loggers_scenario(
+    name: str, log_to_file: bool, **kwargs: Any
+) -> Tuple[LogCall, Teardown]:
+    logger = make_benchmark_logger(name)
+    stream = open_devnull()
+    tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+    init_loggers.init_loggers(
+        [logger],
+        log_level="INFO",
+        file_log_level="INFO" if log_to_file else None,
+        filename=os.path.join(tmpdir.name, "benchmark.log"),
+        stream=stream,
+        **kwargs,
+    )
+
+    def log(i: int) -> None:
+        logger.info("message %s", i, extra={"request_id": "a7c3e5d2"})
+
+    def teardown() -> None:
+        close_handlers(logger)
+        stream.close()
+        tmpdir.cleanup()
+
+    return log, teardown
+
+
+@scenario("init_loggers_stdout")
+def init_loggers_stdout_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    return _init_loggers_scenario("stdout", log_to_file=False)
+
+
+@scenario("init_loggers_stdout_and_file")
+def init_loggers_file_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    return _init_loggers_scenario("file", log_to_file=True)
+
+
+@scenario("init_loggers_binary_file")
+def init_loggers_binary_file_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    return _init_loggers_scenario("binary_file", log_to_file=True, file_format="binary")
+
+
+@scenario("init_loggers_queue")
+def init_loggers_queue_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    return _init_loggers_scenario("queue", log_to_file=True, use_queue=True)
+
+
+@scenario("rate_limit_filter")
+def rate_limit_filter_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    # pylint: disable=import-outside-toplevel
+    from powerflex_logging_utilities.rate_limit_filter import RateLimitFilter
+
+    # RateLimitFilter logs summaries with logging.getLogger
+    logger = logging.getLogger(f"{__name__}.rate_limit_filter")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = logging.NullHandler()
+    handler.addFilter(RateLimitFilter())
+    logger.addHandler(handler)
+
+    def log(i: int) -> None:
+        # Most of these records are suppressed
+        logger.info("message %s", i)
+
+    return log, lambda: close_handlers(logger)
+
+
+@scenario("sampling_filter")
+def sampling_filter_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    # pylint: disable=import-outside-toplevel
+    from powerflex_logging_utilities.sampling_filter import SamplingFilter
+
+    logger = make_benchmark_logger("sampling_filter", TraceLogger)
+    logger.setLevel(TRACE)
+    stream = open_devnull()
+    handler = init_loggers.make_stream_handler(TRACE, JsonFormatter, stream=stream)
+    handler.addFilter(SamplingFilter({TRACE: 0.01}))
+    logger.addHandler(handler)
+
+    def log(i: int) -> None:
+        logger.trace("message %s", i)  # type: ignore
+
+    def teardown() -> None:
+        close_handlers(logger)
+        stream.close()
+
+    return log, teardown
+
+
+@scenario("flight_recorder")
+def flight_recorder_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    logger = make_benchmark_logger("flight_recorder", TraceLogger)
+    stream = open_devnull()
+    init_loggers.init_logger(
+        "INFO", None, None, logger, stream=stream, flight_recorder_level=TRACE
+    )
+
+    def log(i: int) -> None:
+        # Kept in memory without being formatted
+        logger.trace("message %s", i)  # type: ignore
+
+    def teardown() -> None:
+        close_handlers(logger)
+        stream.close()
+
+    return log, teardown
+
+
+# Small enough for frequent rotations
+ROTATION_MAX_BYTES = 256 * 1024
+
+
+@scenario("file_rotation")
+def file_rotation_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    return _init_loggers_scenario(
+        "file_rotation", log_to_file=True, max_bytes=ROTATION_MAX_BYTES
+    )
+
+
+@scenario("file_rotation_background_gzip")
+def file_rotation_background_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    return _init_loggers_scenario(
+        "file_rotation_background",
+        log_to_file=True,
+        max_bytes=ROTATION_MAX_BYTES,
+        compression="gzip",
+    )
+
+
+@scenario("log_level_listener")
+def log_level_listener_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    # pylint: disable=import-outside-toplevel
+    from powerflex_logging_utilities.log_level_listener import (
+        BaseAsyncLogLevelListener,
+        LogLevelListenerConfig,
+        LogLevelRequestMessage,
+    )
+
+    logger = make_benchmark_logger("log_level_listener")
+    stream = open_devnull()
+    init_loggers.init_logger("INFO", None, None, logger, stream=stream)
+    listener = BaseAsyncLogLevelListener(logger, LogLevelListenerConfig())
+    messages = [
+        json.dumps({"level": level, "duration": 0}) for level in ["DEBUG", "INFO"]
+    ]
+
+    def log(i: int) -> None:
+        request = LogLevelRequestMessage(**json.loads(messages[i % 2]))
+        listener.set_log_level(level=request.level, duration=request.duration)
+
+    def teardown() -> None:
+        close_handlers(logger)
+        stream.close()
+
+    return log, teardown
+
+
+CONTEXT_FIELDS = {"request_id": "a7c3e5d2", "site_id": 42, "user": "benchmark"}
+
+
+def _context_scenario(name: str, use_log_context: bool) -> Tuple[LogCall, Teardown]:
+    logger = make_benchmark_logger(name)
+    stream = open_devnull()
+    init_loggers.init_logger("INFO", None, None, logger, stream=stream)
+    tokens: List["contextvars.Token[Optional[LogContext]]"] = []
+
+    def log_with_extra(i: int) -> None:
+        logger.info("message %s", i, extra=CONTEXT_FIELDS)
+
+    def log_in_context(i: int) -> None:
+        # Bound once in each producer thread or task, like a request handler would
+        if current_log_context() is None:
+            tokens.append(bind_log_context(**CONTEXT_FIELDS))
+        logger.info("message %s", i)
+
+    def teardown() -> None:
+        close_handlers(logger)
+        stream.close()
+        # Only the context of the single producer outlives the run
+        for token in tokens:
+            try:
+                reset_log_context(token)
+            except ValueError:
+                pass
+
+    return (log_in_context if use_log_context else log_with_extra), teardown
+
+
+@scenario("context_extra")
+def context_extra_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    return _context_scenario("context_extra", use_log_context=False)
+
+
+@scenario("log_context")
+def log_context_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    return _context_scenario("log_context", use_log_context=True)
+
+
+@dataclasses.dataclass
+class BenchmarkPayload:
+    request_id: str
+    sizes: List[int]
+    tags: Dict[str, str]
+
+
+def _payload_scenario(name: str, lazy: bool) -> Tuple[LogCall, Teardown]:
+    logger = make_benchmark_logger(name)
+    stream = open_devnull()
+    init_loggers.init_logger("INFO", None, None, logger, stream=stream)
+    payload = BenchmarkPayload(
+        "a7c3e5d2", list(range(20)), {f"tag{i}": f"value{i}" for i in range(10)}
+    )
+
+    def log(i: int) -> None:
+        # One record in 10 is emitted
+        level = logging.INFO if i % 10 == 0 else logging.DEBUG
+        if lazy:
+            logger.log(level, "message %s", i, extra={"payload": payload})
+        else:
+            extra = {"payload": dataclasses.asdict(payload)}
+            logger.log(level, "message %s", i, extra=extra)
+
+    def teardown() -> None:
+        close_handlers(logger)
+        stream.close()
+
+    return log, teardown
+
+
+@scenario("payload_eager")
+def payload_eager_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    return _payload_scenario("payload_eager", lazy=False)
+
+
+@scenario("payload_lazy")
+def payload_lazy_scenario(_records: int) -> Tuple[LogCall, Teardown]:
+    return _payload_scenario("payload_lazy", lazy=True)
+
+
+def percentile(sorted_values: Sequence[int], fraction: float) -> int:
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def _timed_calls(log: LogCall, indexes: range, latencies: List[int]) -> None:
+    perf_counter_ns = time.perf_counter_ns
+    for i in indexes:
+        start = perf_counter_ns()
+        log(i)
+        latencies.append(perf_counter_ns() - start)
+
+
+def _split(records: int, producers: int) -> List[range]:
+    step = -(-records // producers)
+    return [
+        range(start, min(start + step, records)) for start in range(0, records, step)
+    ]
+
+
+def run_producers(log: LogCall, producer: str, records: int, workers: int) -> List[int]:
+    """Call log once for every record and return the latency of each call in nanoseconds."""
+    latencies: List[int] = []
+    if producer == "single":
+        _timed_calls(log, range(records), latencies)
+
+    elif producer == "threads":
+        ranges = _split(records, workers)
+        per_thread: List[List[int]] = [[] for _ in ranges]
+        barrier = threading.Barrier(len(ranges))
+
+        def run_thread(indexes: range, thread_latencies: List[int]) -> None:
+            barrier.wait()
+            _timed_calls(log, indexes, thread_latencies)
+
+        threads = [
+            threading.Thread(target=run_thread, args=(indexes, thread_latencies))
+            for indexes, thread_latencies in zip(ranges, per_thread)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for thread_latencies in per_thread:
+            latencies.extend(thread_latencies)
+
+    elif producer == "asyncio":
+
+        async def run_task(indexes: range) -> None:
+            for batch_start in range(indexes.start, indexes.stop, 100):
+                _timed_calls(
+                    log,
+                    range(batch_start, min(batch_start + 100, indexes.stop)),
+                    latencies,
+                )
+                # Let the other producers run
+                await asyncio.sleep(0)
+
+        async def run_tasks() -> None:
+            await asyncio.gather(
+                *(run_task(indexes) for indexes in _split(records, workers))
+            )
+
+        asyncio.run(run_tasks())
+
+    else:
+        raise ValueError(f"Unknown producer {producer!r}, use one of {PRODUCERS}")
+    return latencies
+
+
+def measure_allocations(setup: ScenarioSetup, records: int) -> Dict[str, float]:
+    """Measure the memory allocated by single-threaded calls with tracemalloc."""
+    log, teardown = setup(records)
+    try:
+        # Warm up caches so that they are not counted as allocations
+        log(0)
+        gc.collect()
+        blocks_before = sys.getallocatedblocks()
+        peak_total = 0
+        tracemalloc.start()
+        try:
+            for i in range(1, records):
+                if hasattr(tracemalloc, "reset_peak"):
+                    tracemalloc.reset_peak()
+                else:  # Python 3.8
+                    tracemalloc.stop()
+                    tracemalloc.start()
+                current, _ = tracemalloc.get_traced_memory()
+                log(i)
+                peak_total += tracemalloc.get_traced_memory()[1] - current
+        finally:
+            tracemalloc.stop()
+        gc.collect()
+        calls = max(1, records - 1)
+        return {
+            "alloc_peak_bytes_per_record": round(peak_total / calls, 1),
+            "retained_blocks_per_record": round(
+                (sys.getallocatedblocks() - blocks_before) / calls, 3
+            ),
+        }
+    finally:
+        teardown()
+
+
+class _StalledHandler(logging.Handler):
+    """Blocks the writer thread of a queue handler, so that records pile up in its queue."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.released = threading.Event()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.released.wait()
+
+
+def measure_buffered_memory(
+    record_factory: Callable[..., logging.LogRecord], records: int = BUFFERED_RECORDS
+) -> int:
+    """Return the memory used by records waiting in the queue of a BackgroundQueueHandler, in bytes."""
+    previous_factory = logging.getLogRecordFactory()
+    logging.setLogRecordFactory(record_factory)
+    logger = make_benchmark_logger("buffered")
+    stalled_handler = _StalledHandler()
+    logger.addHandler(BackgroundQueueHandler([stalled_handler], max_size=0))
+    try:
+        # The writer thread takes this record, then waits
+        logger.info("first")
+        gc.collect()
+        tracemalloc.start()
+        try:
+            for i in range(records):
+                logger.info("message %s", i, extra={"request_id": "a7c3e5d2"})
+            used, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        stalled_handler.released.set()
+        close_handlers(logger)
+        logging.setLogRecordFactory(previous_factory)
+    return used
+
+
+def run_benchmark(  # pylint: disable=too-many-locals
+    scenarios: Sequence[str],
+    producers: Sequence[str],
+    records: int = DEFAULT_RECORDS,
+    threads: int = DEFAULT_THREADS,
+    tasks: int = DEFAULT_TASKS,
+    alloc_records: int = DEFAULT_ALLOC_RECORDS,
+) -> Dict[str, Dict[str, float]]:
+    """Run scenarios with each producer and return metrics keyed by "scenario/producer"."""
+    results: Dict[str, Dict[str, float]] = {}
+    for scenario_name in scenarios:
+        setup = SCENARIOS[scenario_name]
+        allocations = measure_allocations(setup, alloc_records)
+        for producer in producers:
+            log, teardown = setup(records)
+            try:
+                start = time.perf_counter()
+                latencies = run_producers(
+                    log, producer, records, threads if producer == "threads" else tasks
+                )
+                elapsed = time.perf_counter() - start
+            finally:
+                teardown()
+            latencies.sort()
+            results[f"{scenario_name}/{producer}"] = {
+                "records_per_sec": round(len(latencies) / elapsed, 1),
+                "p50_us": percentile(latencies, 0.5) / 1000,
+                "p99_us": percentile(latencies, 0.99) / 1000,
+                "p999_us": percentile(latencies, 0.999) / 1000,
+                **allocations,
+            }
+    return results
+
+
+def compare_results(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> List[str]:
+    """Return the runs whose records_per_sec regressed by more than tolerance."""
+    regressions = []
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+        baseline_rate = baseline[name]["records_per_sec"]
+        if metrics["records_per_sec"] < baseline_rate * (1 - tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def format_results(
+    results: Dict[str, Dict[str, float]],
+    baseline: Optional[Dict[str, Dict[str, float]]] = None,
+) -> str:
+    lines = [
+        f"{'scenario/producer':<45} {'records/s':>11} {'p50 us':>8} {'p99 us':>8} "
+        f"{'p999 us':>9} {'alloc B':>8} {'retained':>8}"
+        + (f" {'vs base':>8}" if baseline else "")
+    ]
+    for name, metrics in results.items():
+        line = (
+            f"{name:<45} {metrics['records_per_sec']:>11.0f} {metrics['p50_us']:>8.2f} "
+            f"{metrics['p99_us']:>8.2f} {metrics['p999_us']:>9.2f} "
+            f"{metrics['alloc_peak_bytes_per_record']:>8.0f} "
+            f"{metrics['retained_blocks_per_record']:>8.2f}"
+        )
+        if baseline and name in baseline:
+            ratio = metrics["records_per_sec"] / baseline[name]["records_per_sec"]
+            line += f" {ratio:>7.2f}x"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="powerflex-logging-benchmark",
+        description="Benchmark the logging hot paths of powerflex_logging_utilities.",
+    )
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help=f"Comma-separated scenarios to run. Default: {','.join(SCENARIOS)}",
+    )
+    parser.add_argument(
+        "--producers",
+        default=",".join(PRODUCERS),
+        help=f"Comma-separated producers to run. Default: {','.join(PRODUCERS)}",
+    )
+    parser.add_argument("--records", type=int, default=DEFAULT_RECORDS)
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS)
+    parser.add_argument("--tasks", type=int, default=DEFAULT_TASKS)
+    parser.add_argument(
+        "--alloc-records",
+        type=int,
+        default=DEFAULT_ALLOC_RECORDS,
+        help="Number of calls measured with tracemalloc",
+    )
+    parser.add_argument(
+        "--buffered-memory",
+        action="store_true",
+        help=f"Also measure the memory used by {BUFFERED_RECORDS} queued records",
+    )
+    parser.add_argument("--save", help="Save the results to this JSON file")
+    parser.add_argument("--compare", help="Compare the results to this JSON file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Allowed relative drop of records/sec when comparing to a baseline",
+    )
+    args = parser.parse_args(argv)
+
+    scenarios = [name for name in args.scenarios.split(",") if name]
+    producers = [name for name in args.producers.split(",") if name]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name!r}")
+    for name in producers:
+        if name not in PRODUCERS:
+            parser.error(f"unknown producer {name!r}")
+
+    results = run_benchmark(
+        scenarios,
+        producers,
+        records=args.records,
+        threads=args.threads,
+        tasks=args.tasks,
+        alloc_records=args.alloc_records,
+    )
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+
+    print(format_results(results, baseline))
+
+    buffered_memory: Dict[str, int] = {}
+    if args.buffered_memory:
+        for record_factory in [logging.LogRecord, CompactLogRecord]:
+            buffered_memory[record_factory.__name__] = measure_buffered_memory(
+                record_factory
+            )
+        print(f"Memory used by {BUFFERED_RECORDS} queued records:")
+        for name, used in buffered_memory.items():
+            print(f"  {name:<20} {used / 1e6:>8.1f} MB")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as output_file:
+            json.dump(
+                {
+                    "version": __version__,
+                    "python": platform.python_implementation()
+                    + " "
+                    + platform.python_version(),
+                    "records": args.records,
+                    "results": results,
+                    **({"buffered_memory": buffered_memory} if buffered_memory else {}),
+                },
+                output_file,
+                indent=2,
+            )
+
+    if baseline is not None:
+        regressions = compare_results(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions compared to {args.compare}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,515 @@
+"""A compact binary log file format, and a command to convert it back to JSON lines.
+
+JSON logs repeat the same keys, such as "severity", "filename" and "funcName",
+and often the same values, in every line. The binary format writes each of
+these strings once per segment and refers to it by index afterwards.
+
+File layout:
+
+- A file is a sequence of segments. A new segment starts whenever a handler
+  opens the file, so files appended to by several runs stay readable.
+- A segment starts with a 0 byte followed by SEGMENT_MAGIC.
+- Each record is the length of its body as a varint, followed by its body:
+  the dict built by JsonFormatter, encoded as a DICT value.
+- Values start with a tag byte:
+    NONE, FALSE, TRUE
+    INT - zigzag varint
+    FLOAT - 8 bytes, little endian IEEE 754 double
+    STRING - varint length, then UTF-8 bytes
+    DEFINE - like STRING, and the string is added to the segment's string table
+    REF - varint index in the segment's string table
+    LIST - varint count, then the values
+    DICT - varint count, then key and value pairs. Keys are strings.
+- Dict keys, and the values of the fields in interned_fields, are added to the
+  string table, until it has max_strings strings.
+
+Varints are unsigned LEB128, like in protobuf and WebAssembly.
+
+Usage:
+
+    powerflex-logging-decode logs/app.log logs/app.log.1.gz > app.jsonl
+"""
+import argparse
+import itertools
+import json
+import logging
+import struct
+import sys
+from typing import (
+    IO,
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
+
+from powerflex_logging_utilities.default_log_format import DEFAULT_LOG_FORMAT
+from powerflex_logging_utilities.json_formatter import JsonFormatter, Serializer
+from powerflex_logging_utilities.rotating_file_handler import (
+    BackgroundRotatingFileHandler,
+    Compression,
+    open_rotated_file,
+)
+
+SEGMENT_MAGIC = b"PFLOGB1\n"
+SEGMENT_HEADER = b"\x00" + SEGMENT_MAGIC
+
+NONE = 0
+FALSE = 1
+TRUE = 2
+INT = 3
+FLOAT = 4
+STRING = 5
+DEFINE = 6
+REF = 7
+LIST = 8
+DICT = 9
+
+# Fields whose values repeat across records
+DEFAULT_INTERNED_FIELDS = frozenset(
+    {
+        "severity",
+        "levelname",
+        "name",
+        "filename",
+        "funcName",
+        "module",
+        "pathname",
+        "processName",
+        "threadName",
+        "taskName",
+    }
+)
+DEFAULT_MAX_STRINGS = 65536
+# Deeper values are probably a default function returning its argument
+MAX_DEPTH = 100
+
+_DOUBLE = struct.Struct("<d")
+
+_JSON_CONSTANT_KEYS = {True: "true", False: "false", None: "null"}
+
+
+def encode_varint(number: int) -> bytes:
+    if number < 0x80:
+        return bytes((number,))
+    data = bytearray()
+    while number >= 0x80:
+        data.append((number & 0x7F) | 0x80)
+        number >>= 7
+    data.append(number)
+    return bytes(data)
+
+
+def _json_key(key: Any) -> str:
+    """Convert a dict key to a string like the json module does."""
+    if isinstance(key, str):
+        return key
+    if key is None or isinstance(key, bool):
+        return _JSON_CONSTANT_KEYS[key]
+    if isinstance(key, (int, float)):
+        return json.dumps(key)
+    return str(key)
+
+
+class BinaryRecordEncoder:
+    """Encode the dicts built by JsonFormatter as binary records.
+
+    default - Converts values that are not of a JSON type, like the default
+        argument of json.dumps. See JsonFormatter.json_default_function.
+
+    interned_fields - Add the values of these top-level fields to the string table.
+
+    max_strings - The maximum size of the string table of a segment.
+        Strings are written in full once it is reached.
+
+    The string table is reset by start_segment(). If encode raises, the
+    strings it added to the table are forgotten. Call forget_strings to
+    forget the strings of a record that was encoded but not written.
+    """
+
+    def __init__(
+        self,
+        default: Optional[Callable[[Any], Any]] = None,
+        interned_fields: Iterable[str] = DEFAULT_INTERNED_FIELDS,
+        max_strings: int = DEFAULT_MAX_STRINGS,
+    ) -> None:
+        self.default = default
+        self.interned_fields: FrozenSet[str] = frozenset(interned_fields)
+        self.max_strings = max_strings
+        # The encoded reference of each string in the table
+        self._references: Dict[str, bytes] = {}
+
+    def start_segment(self) -> bytes:
+        """Reset the string table and return the segment header to write."""
+        self._references = {}
+        return SEGMENT_HEADER
+
+    @property
+    def string_count(self) -> int:
+        """The number of strings in the table."""
+        return len(self._references)
+
+    def forget_strings(self, string_count: int) -> None:
+        """Forget the strings added to the table since it had string_count strings."""
+        references = self._references
+        if len(references) > string_count:
+            self._references = dict(itertools.islice(references.items(), string_count))
+
+    def encode(self, log_record: Mapping[str, Any]) -> bytes:
+        """Return the length-prefixed binary record of a log record dict."""
+        string_count = len(self._references)
+        try:
+            return self._encode(log_record)
+        except Exception:
+            self.forget_strings(string_count)
+            raise
+
+    def _encode(self, log_record: Mapping[str, Any]) -> bytes:
+        body = bytearray((DICT,))
+        body += encode_varint(len(log_record))
+        references = self._references
+        interned_fields = self.interned_fields
+        # Inlined fast paths for the strings and integers of most fields
+        for key, value in log_record.items():
+            reference = references.get(key)
+            if reference is None:
+                self._write_interned(body, _json_key(key))
+            else:
+                body += reference
+            value_type = type(value)
+            if value_type is str:
+                if key in interned_fields:
+                    reference = references.get(value)
+                    if reference is None:
+                        self._write_interned(body, value)
+                    else:
+                        body += reference
+                    continue
+                encoded = value.encode("utf-8", "surrogatepass")
+                length = len(encoded)
+                if length < 0x80:
+                    body += bytes((STRING, length))
+                else:
+                    body.append(STRING)
+                    body += encode_varint(length)
+                body += encoded
+            elif value_type is int and 0 <= value < 0x40:
+                body.append(INT)
+                body.append(value * 2)
+            else:
+                self._write_value(body, value, 1)
+        return encode_varint(len(body)) + body
+
+    def _write_interned(self, data: bytearray, string: str) -> None:
+        reference = self._references.get(string)
+        if reference is not None:
+            data += reference
+            return
+        references = self._references
+        if len(references) < self.max_strings:
+            references[string] = bytes((REF,)) + encode_varint(len(references))
+            data.append(DEFINE)
+        else:
+            data.append(STRING)
+        encoded = string.encode("utf-8", "surrogatepass")
+        data += encode_varint(len(encoded))
+        data += encoded
+
+    # pylint: disable=too-many-branches
+    def _write_value(self, data: bytearray, value: Any, depth: int) -> None:
+        if depth > MAX_DEPTH:
+            raise ValueError("Circular reference detected")
+        if isinstance(value, str):
+            encoded = value.encode("utf-8", "surrogatepass")
+            data.append(STRING)
+            data += encode_varint(len(encoded))
+            data += encoded
+        elif value is None:
+            data.append(NONE)
+        elif value is True:
+            data.append(TRUE)
+        elif value is False:
+            data.append(FALSE)
+        elif isinstance(value, int):
+            data.append(INT)
+            data += encode_varint(value * 2 if value >= 0 else -value * 2 - 1)
+        elif isinstance(value, float):
+            data.append(FLOAT)
+            data += _DOUBLE.pack(value)
+        elif isinstance(value, dict):
+            data.append(DICT)
+            data += encode_varint(len(value))
+            for key, item in value.items():
+                self._write_interned(data, _json_key(key))
+                self._write_value(data, item, depth + 1)
+        elif isinstance(value, (list, tuple)):
+            data.append(LIST)
+            data += encode_varint(len(value))
+            for item in value:
+                self._write_value(data, item, depth + 1)
+        elif self.default is not None:
+            self._write_value(data, self.default(value), depth + 1)
+        else:
+            raise TypeError(
+                f"Object of type {type(value).__name__} is not JSON serializable"
+            )
+
+
+class BinaryRecordDecoder:
+    """Decode the records of a binary log file, one segment after the other."""
+
+    def __init__(self) -> None:
+        self._strings: List[str] = []
+
+    def read_records(self, stream: IO[bytes]) -> Iterator[Dict[str, Any]]:
+        """Yield the log record dict of each record in the stream.
+
+        Raises ValueError if the stream is not a binary log file or a record is
+        truncated or invalid.
+        """
+        read = stream.read
+        started = False
+        while True:
+            length = self._read_varint(read, allow_eof=True)
+            if length is None:
+                return
+            if length == 0:
+                if read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+                    raise ValueError("Invalid binary log segment header")
+                self._strings = []
+                started = True
+                continue
+            if not started:
+                raise ValueError("Not a binary log file")
+            body = read(length)
+            if len(body) < length:
+                raise ValueError("Truncated binary log record")
+            try:
+                value, _position = self._decode_value(body, 0)
+            except (IndexError, struct.error) as error:
+                # A string index or a value past the end of the record
+                raise ValueError("Invalid binary log record") from error
+            yield cast(Dict[str, Any], value)
+
+    @staticmethod
+    def _read_varint(
+        read: Callable[[int], bytes], allow_eof: bool = False
+    ) -> Optional[int]:
+        number = 0
+        shift = 0
+        while True:
+            byte = read(1)
+            if not byte:
+                if allow_eof and shift == 0:
+                    return None
+                raise ValueError("Truncated binary log record")
+            number |= (byte[0] & 0x7F) << shift
+            if byte[0] < 0x80:
+                return number
+            shift += 7
+
+    @staticmethod
+    def _decode_varint(data: bytes, position: int) -> Tuple[int, int]:
+        number = 0
+        shift = 0
+        while True:
+            byte = data[position]
+            position += 1
+            number |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return number, position
+            shift += 7
+
+    # pylint: disable=too-many-return-statements
+    def _decode_value(self, data: bytes, position: int) -> Tuple[Any, int]:
+        tag = data[position]
+        position += 1
+        if tag in (STRING, DEFINE):
+            length, position = self._decode_varint(data, position)
+            end = position + length
+            string = data[position:end].decode("utf-8", "surrogatepass")
+            if tag == DEFINE:
+                self._strings.append(string)
+            return string, end
+        if tag == REF:
+            index, position = self._decode_varint(data, position)
+            return self._strings[index], position
+        if tag == DICT:
+            count, position = self._decode_varint(data, position)
+            result: Dict[str, Any] = {}
+            for _ in range(count):
+                key, position = self._decode_value(data, position)
+                result[key], position = self._decode_value(data, position)
+            return result, position
+        if tag == LIST:
+            count, position = self._decode_varint(data, position)
+            items = []
+            for _ in range(count):
+                item, position = self._decode_value(data, position)
+                items.append(item)
+            return items, position
+        if tag == INT:
+            number, position = self._decode_varint(data, position)
+            return (number >> 1 if not number & 1 else -((number + 1) >> 1)), position
+        if tag == FLOAT:
+            return _DOUBLE.unpack_from(data, position)[0], position + _DOUBLE.size
+        if tag == NONE:
+            return None, position
+        if tag == TRUE:
+            return True, position
+        if tag == FALSE:
+            return False, position
+        raise ValueError(f"Invalid binary log value tag {tag}")
+
+
+def read_binary_log(stream: IO[bytes]) -> Iterator[Dict[str, Any]]:
+    """Yield the log record dicts of a binary log file opened in binary mode."""
+    return BinaryRecordDecoder().read_records(stream)
+
+
+class BinaryRotatingFileHandler(BackgroundRotatingFileHandler):
+    """Log to a file in the binary format, rotating it like BackgroundRotatingFileHandler.
+
+    The formatter must be a JsonFormatter, which builds the dict of each record.
+    Defaults to a JsonFormatter with DEFAULT_LOG_FORMAT.
+    Convert the files to JSON lines with powerflex-logging-decode.
+
+    interned_fields, max_strings - See BinaryRecordEncoder.
+
+    Only one handler must write to a file at a time, since records refer to the
+    strings defined by the previous records of their segment.
+    """
+
+    terminator = b""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        filename: str,
+        max_bytes: int = 0,
+        interval_seconds: Optional[float] = None,
+        backup_count: int = 0,
+        compression: Optional[Compression] = None,
+        level: int = logging.NOTSET,
+        interned_fields: Iterable[str] = DEFAULT_INTERNED_FIELDS,
+        max_strings: int = DEFAULT_MAX_STRINGS,
+    ) -> None:
+        # Used by _open, which the base class calls
+        self.encoder = BinaryRecordEncoder(
+            interned_fields=interned_fields, max_strings=max_strings
+        )
+        self._segment_started = False
+        super().__init__(
+            filename,
+            max_bytes=max_bytes,
+            interval_seconds=interval_seconds,
+            backup_count=backup_count,
+            compression=compression,
+            level=level,
+        )
+        self.setFormatter(JsonFormatter(fmt=DEFAULT_LOG_FORMAT))
+
+    def _open(self) -> BinaryIO:
+        stream = super()._open()
+        self.encoder.start_segment()
+        self._segment_started = False
+        return stream
+
+    def log_record_dict(self, record: logging.LogRecord) -> Dict[str, Any]:
+        formatter = self.formatter
+        if isinstance(formatter, JsonFormatter):
+            self.encoder.default = formatter.json_default_function
+            return formatter.log_record_dict(record)
+        return {"message": self.format(record)}
+
+    def emit(self, record: logging.LogRecord) -> None:
+        encoder = self.encoder
+        string_count = encoder.string_count
+        try:
+            log_record = self.log_record_dict(record)
+            data = encoder.encode(log_record)
+            if self._stream is None or self.should_rollover(len(data)):
+                if self._stream is None:
+                    self._open()
+                else:
+                    self.do_rollover()
+                # The new segment has an empty string table
+                string_count = 0
+                data = encoder.encode(log_record)
+            if not self._segment_started:
+                data = SEGMENT_HEADER + data
+            stream = cast(BinaryIO, self._stream)
+            stream.write(data)
+            stream.flush()
+            self._segment_started = True
+            self._size += len(data)
+        except Exception:  # pylint: disable=broad-except
+            # The next records must not refer to the strings of this record
+            encoder.forget_strings(string_count)
+            self.handleError(record)
+
+
+def decode_files(
+    paths: Sequence[str],
+    output: IO[str],
+    formatter: Optional[JsonFormatter] = None,
+) -> None:
+    """Write the records of binary log files as JSON lines, like JsonFormatter writes them.
+
+    "-" reads the standard input.
+    """
+    if formatter is None:
+        formatter = JsonFormatter()
+    for path in paths:
+        stream: IO[bytes]
+        if path == "-":
+            stream = sys.stdin.buffer
+        else:
+            stream = open_rotated_file(path)
+        try:
+            for log_record in read_binary_log(stream):
+                output.write(formatter.serialize_log_record(log_record))
+                output.write("\n")
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="powerflex-logging-decode",
+        description="Convert binary log files to JSON lines, oldest file first.",
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        default=["-"],
+        help="Binary log files, optionally compressed. Default: the standard input",
+    )
+    parser.add_argument(
+        "--serializer",
+        default="json",
+        choices=["json", "orjson", "ujson", "auto"],
+        help="The serializer of the JsonFormatter that would have written the logs",
+    )
+    args = parser.parse_args(argv)
+
+    formatter = JsonFormatter(serializer=cast(Serializer, args.serializer))
+    try:
+        decode_files(args.paths, sys.stdout, formatter)
+    except (OSError, ValueError) as error:
+        print(f"powerflex-logging-decode: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,343 @@
+"""A LogRecord keeping its standard attributes in __slots__, to use less memory while records are queued.
+
+Install it with logging.setLogRecordFactory(CompactLogRecord), or with
+init_loggers(compact_records=True).
+
+Attributes passed with extra, and attributes added by filters, are kept in
+the instance __dict__, which is only created when there are some.
+relativeCreated and processName are computed the first time they are read.
+
+record.__dict__ is a mapping of all the attributes of the record, standard
+and extra, so formatters and handlers see the same attributes as with a
+logging.LogRecord.
+"""
+import collections.abc
+import logging
+import operator
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, MutableMapping, Optional, Tuple
+
+from powerflex_logging_utilities.log_context import RECORD_ATTRIBUTE
+
+# Standard attributes, in the order of the __dict__ of a logging.LogRecord
+STANDARD_ATTRIBUTES: Tuple[str, ...] = (
+    "name",
+    "msg",
+    "args",
+    "levelname",
+    "levelno",
+    "pathname",
+    "filename",
+    "module",
+    "exc_info",
+    "exc_text",
+    "stack_info",
+    "lineno",
+    "funcName",
+    "created",
+    "msecs",
+    "relativeCreated",
+    "thread",
+    "threadName",
+    "processName",
+    "process",
+) + (("taskName",) if sys.version_info >= (3, 12) else ())
+
+# Set by formatters, and by queue handlers keeping the log_context of the record
+_FORMATTED_ATTRIBUTES = ("message", "asctime", RECORD_ATTRIBUTE)
+
+SLOT_ATTRIBUTES = frozenset(STANDARD_ATTRIBUTES + _FORMATTED_ATTRIBUTES)
+
+
+class _NotComputed:
+    """The value of relativeCreated and processName until they are first read."""
+
+    __slots__ = ()
+
+    def __reduce__(self) -> str:
+        # Copies and unpickled records get the same sentinel
+        return "_NOT_COMPUTED"
+
+    def __repr__(self) -> str:
+        return "<not computed>"
+
+
+_NOT_COMPUTED: Any = _NotComputed()
+
+# The slots that a change to the record would change, read without computing
+# relativeCreated and processName. message and asctime are set by formatters.
+_STATE_SLOTS = tuple(
+    {"relativeCreated": "_relative_created", "processName": "_process_name"}.get(
+        name, name
+    )
+    for name in STANDARD_ATTRIBUTES
+)
+_get_state_slots = operator.attrgetter(*_STATE_SLOTS)
+
+# The real instance dict, which CompactLogRecord.__dict__ hides
+_instance_dict = logging.LogRecord.__dict__["__dict__"].__get__
+
+# Shared values, so that records don't each keep a copy
+_MSECS = tuple(float(msecs) for msecs in range(1000))
+_MAX_CACHED_PATHNAMES = 1000
+_path_names: Dict[str, Tuple[str, str]] = {}
+_pid: Optional[int] = os.getpid() if hasattr(os, "getpid") else None
+
+
+def _reset_pid() -> None:
+    global _pid  # pylint: disable=global-statement
+    _pid = os.getpid()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pid)
+
+
+def _start_time() -> float:
+    """Return the time the logging module was imported, in seconds since the epoch."""
+    start: float = logging._startTime  # type: ignore # pylint: disable=protected-access
+    # Python 3.13 keeps nanoseconds
+    return start / 1e9 if start > 1e12 else start
+
+
+def _file_names(pathname: str) -> Tuple[str, str]:
+    """Return the filename and module of a record, like LogRecord.__init__."""
+    try:
+        return _path_names[pathname]
+    except KeyError:
+        pass
+    except TypeError:
+        return pathname, "Unknown module"
+    try:
+        filename = os.path.basename(pathname)
+        names = filename, os.path.splitext(filename)[0]
+    except (TypeError, ValueError, AttributeError):
+        return pathname, "Unknown module"
+    if len(_path_names) < _MAX_CACHED_PATHNAMES:
+        _path_names[pathname] = names
+    return names
+
+
+def _process_name() -> Optional[str]:
+    """Return the processName of a record logged now, like LogRecord.__init__."""
+    if not logging.logMultiprocessing:  # pragma: no cover
+        return None
+    multiprocessing = sys.modules.get("multiprocessing")
+    if multiprocessing is not None:
+        try:
+            name: str = multiprocessing.current_process().name
+            return name
+        except Exception:  # pylint: disable=broad-except # pragma: no cover
+            pass
+    return "MainProcess"
+
+
+def _task_name() -> Optional[str]:  # pragma: no cover
+    """Return the taskName of a record logged now, like LogRecord.__init__ in Python 3.12+."""
+    if not getattr(logging, "logAsyncioTasks", False):
+        return None
+    asyncio = sys.modules.get("asyncio")
+    if asyncio is None:
+        return None
+    try:
+        name: str = asyncio.current_task().get_name()
+        return name
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
+class RecordAttributes(MutableMapping[Any, Any]):
+    """The __dict__ of a CompactLogRecord: its slots, then the attributes in its instance dict."""
+
+    __slots__ = ("_record",)
+
+    def __init__(self, record: "CompactLogRecord") -> None:
+        self._record = record
+
+    @property
+    def overflow(self) -> Dict[Any, Any]:
+        """The attributes that are not standard, such as those passed with extra."""
+        overflow: Dict[Any, Any] = _instance_dict(self._record)
+        return overflow
+
+    def __getitem__(self, key: Any) -> Any:
+        if key in SLOT_ATTRIBUTES:
+            try:
+                return getattr(self._record, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        return self.overflow[key]
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        if key in SLOT_ATTRIBUTES:
+            return getattr(self._record, key, default)
+        return self.overflow.get(key, default)
+
+    def __contains__(self, key: Any) -> bool:
+        if key in SLOT_ATTRIBUTES:
+            return hasattr(self._record, key)
+        return key in self.overflow
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        if key in SLOT_ATTRIBUTES:
+            setattr(self._record, key, value)
+        else:
+            self.overflow[key] = value
+
+    def __delitem__(self, key: Any) -> None:
+        if key in SLOT_ATTRIBUTES:
+            try:
+                delattr(self._record, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        else:
+            del self.overflow[key]
+
+    def snapshot(self) -> Optional[Tuple[Tuple[Any, ...], Dict[Any, Any]]]:
+        """Return the slots and a copy of the overflow, or None if a slot was deleted.
+
+        Unlike dict(self), this doesn't compute relativeCreated and processName.
+        message and asctime, which formatters set, are left out.
+        """
+        try:
+            return _get_state_slots(self._record), self.overflow.copy()
+        except AttributeError:
+            return None
+
+    def __iter__(self) -> Iterator[Any]:
+        record = self._record
+        for name in STANDARD_ATTRIBUTES + _FORMATTED_ATTRIBUTES:
+            if hasattr(record, name):
+                yield name
+        yield from self.overflow
+
+    def __len__(self) -> int:
+        return sum(1 for _name in self)
+
+    def copy(self) -> Dict[Any, Any]:
+        return dict(self)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class CompactLogRecord(logging.LogRecord):
+    """A LogRecord keeping its standard attributes in __slots__.
+
+    created, msecs and relativeCreated are computed from time.time_ns, like
+    Python 3.13 does, so msecs is a whole number of milliseconds.
+    """
+
+    # pylint: disable=invalid-name
+
+    __slots__ = tuple(
+        name
+        for name in STANDARD_ATTRIBUTES + _FORMATTED_ATTRIBUTES
+        if name not in ("relativeCreated", "processName")
+    ) + ("_relative_created", "_process_name")
+
+    # pylint: disable=super-init-not-called,too-many-arguments
+    def __init__(
+        self,
+        name: str,
+        level: int,
+        pathname: str,
+        lineno: int,
+        msg: object,
+        args: Any,
+        exc_info: Any,
+        func: Optional[str] = None,
+        sinfo: Optional[str] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Set the same attributes as LogRecord.__init__, except relativeCreated and processName."""
+        ct = time.time_ns()
+        self.name = name
+        self.msg = msg
+        if (
+            args
+            and len(args) == 1
+            and isinstance(args[0], collections.abc.Mapping)
+            and args[0]
+        ):
+            args = args[0]
+        self.args = args
+        self.levelname = logging.getLevelName(level)
+        self.levelno = level
+        self.pathname = pathname
+        self.filename, self.module = _file_names(pathname)
+        self.exc_info = exc_info
+        self.exc_text = None
+        self.stack_info = sinfo
+        self.lineno = lineno
+        self.funcName = func  # type: ignore
+        self.created = ct / 1e9
+        self.msecs = _MSECS[(ct % 1_000_000_000) // 1_000_000]
+        self._relative_created = _NOT_COMPUTED
+        if logging.logThreads:
+            # The ident of the Thread object is the same int as threading.get_ident()
+            thread = threading.current_thread()
+            self.thread: Optional[int] = thread.ident
+            self.threadName: Optional[str] = thread.name
+        else:  # pragma: no cover
+            self.thread = None
+            self.threadName = None
+        self._process_name = _NOT_COMPUTED
+        if logging.logProcesses and _pid is not None:
+            self.process: Optional[int] = _pid
+        else:  # pragma: no cover
+            self.process = None
+        if sys.version_info >= (3, 12):  # pragma: no cover
+            self.taskName = _task_name()
+
+    @property  # type: ignore
+    def __dict__(self) -> RecordAttributes:  # type: ignore
+        return RecordAttributes(self)
+
+    @property  # type: ignore
+    def relativeCreated(self) -> float:  # type: ignore
+        if self._relative_created is _NOT_COMPUTED:
+            self._relative_created = (self.created - _start_time()) * 1000
+        value: float = self._relative_created
+        return value
+
+    @relativeCreated.setter
+    def relativeCreated(self, value: float) -> None:
+        self._relative_created = value
+
+    @property  # type: ignore
+    def processName(self) -> Optional[str]:  # type: ignore
+        if self._process_name is _NOT_COMPUTED:
+            self._process_name = _process_name()
+        value: Optional[str] = self._process_name
+        return value
+
+    @processName.setter
+    def processName(self, value: Optional[str]) -> None:
+        self._process_name = value
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # For copy.copy and pickle. The slots are read directly, so that
+        # relativeCreated and processName are not computed.
+        slots = {}
+        for name in CompactLogRecord.__slots__:
+            try:
+                slots[name] = getattr(self, name)
+            except AttributeError:
+                pass
+        return _restore_record, (slots, _instance_dict(self).copy())
+
+
+def _restore_record(
+    slots: Dict[str, Any], overflow: Dict[Any, Any]
+) -> CompactLogRecord:
+    """Return a record with these slots, which may be _NOT_COMPUTED, and instance dict."""
+    record = CompactLogRecord.__new__(CompactLogRecord)
+    for name, value in slots.items():
+        setattr(record, name, value)
+    if overflow:
+        _instance_dict(record).update(overflow)
+    return record
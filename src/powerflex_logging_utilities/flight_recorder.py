@@ -0,0 +1,155 @@
+"""A logging handler that keeps recent verbose records in memory and writes them when an error is logged.
+
+This gives TRACE and DEBUG context around failures without formatting and
+writing every TRACE and DEBUG record.
+"""
+import logging
+import sys
+from collections import deque
+from typing import Deque, Iterable, List, Tuple, Union
+
+from powerflex_logging_utilities.record_snapshot import (
+    CompactRecord,
+    compact_record,
+    restore_record,
+)
+
+DEFAULT_FLIGHT_RECORDER_CAPACITY = 1000
+DEFAULT_FLIGHT_RECORDER_MAX_BYTES = 1000 * 1000  # 1 megabyte
+DEFAULT_TRIGGER_LEVEL = logging.ERROR
+
+# Rough size of a recorded record without its message, arguments, exception,
+# stack and extra fields
+_RECORD_OVERHEAD_BYTES = 400
+
+
+def _size_of(compact: CompactRecord) -> int:
+    _values, message, args, exc_text, stack_info, extra = compact
+    size = _RECORD_OVERHEAD_BYTES + sys.getsizeof(message)
+    if args is not None:
+        size += sys.getsizeof(args) + sum(sys.getsizeof(arg) for arg in args)
+    if exc_text is not None:
+        size += sys.getsizeof(exc_text)
+    if stack_info is not None:
+        size += sys.getsizeof(stack_info)
+    if extra is not None:
+        size += sys.getsizeof(extra) + sum(sys.getsizeof(v) for v in extra.values())
+    return size
+
+
+class FlightRecorderHandler(logging.Handler):
+    """Write records with the given handlers, and remember the records they don't write.
+
+    handlers - The handlers that write records, such as the stdout and file handlers.
+        Records at or above a handler's level are written by that handler right away.
+        Other records are kept in memory.
+
+    capacity - The maximum number of records kept in memory.
+
+    max_bytes - The approximate maximum memory used by the records kept in memory.
+        The oldest records are forgotten first.
+
+    trigger_level - When a record at or above this level is handled, the records
+        kept in memory are written first, by the handlers that did not write them.
+        Call dump() to write them at any other time.
+
+    The level of this handler, and of the loggers using it, decides which records
+    are kept. Set it to TRACE to keep TRACE records.
+
+    Records whose message arguments can't change, such as strings, numbers and
+    Lazy values, are kept without rendering their message, so Lazy arguments
+    are only computed if the records are written. Other messages are rendered
+    when the record is kept. Values of extra fields are kept as they are,
+    without copying them.
+    Written records have an extra flight_recorder field set to True.
+    """
+
+    handlers: List[logging.Handler]
+    capacity: int
+    max_bytes: int
+    trigger_level: int
+
+    def __init__(
+        self,
+        handlers: Iterable[logging.Handler],
+        capacity: int = DEFAULT_FLIGHT_RECORDER_CAPACITY,
+        max_bytes: int = DEFAULT_FLIGHT_RECORDER_MAX_BYTES,
+        trigger_level: int = DEFAULT_TRIGGER_LEVEL,
+        level: Union[str, int] = logging.NOTSET,
+    ) -> None:
+        super().__init__(level)
+        self.handlers = list(handlers)
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.trigger_level = trigger_level
+        self._records: Deque[Tuple[CompactRecord, int]] = deque()
+        self._size = 0
+
+    @property
+    def recorded_count(self) -> int:
+        """The number of records kept in memory."""
+        return len(self._records)
+
+    @property
+    def recorded_bytes(self) -> int:
+        """The approximate memory used by the records kept in memory."""
+        return self._size
+
+    def _record(self, record: logging.LogRecord) -> None:
+        compact = compact_record(record, render=False)
+        size = _size_of(compact)
+        if size > self.max_bytes:
+            return
+
+        self._records.append((compact, size))
+        self._size += size
+        while len(self._records) > self.capacity or self._size > self.max_bytes:
+            _compact, forgotten_size = self._records.popleft()
+            self._size -= forgotten_size
+
+    def _dump(self) -> None:
+        records, self._records, self._size = self._records, deque(), 0
+        for compact, _size in records:
+            record = restore_record(compact, flight_recorder=True)
+            for handler in self.handlers:
+                if record.levelno < handler.level:
+                    handler.handle(record)
+
+    def dump(self) -> None:
+        """Write and forget the records kept in memory."""
+        self.acquire()
+        try:
+            self._dump()
+        finally:
+            self.release()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            if record.levelno >= self.trigger_level:
+                self._dump()
+            written_by_all = True
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+                else:
+                    written_by_all = False
+            if not written_by_all and self.capacity > 0:
+                self._record(record)
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+    def flush(self) -> None:
+        for handler in self.handlers:
+            handler.flush()
+
+    def close(self) -> None:
+        """Forget the records kept in memory and close the wrapped handlers."""
+        self.acquire()
+        try:
+            self._records.clear()
+            self._size = 0
+            for handler in self.handlers:
+                handler.close()
+        finally:
+            self.release()
+        super().close()
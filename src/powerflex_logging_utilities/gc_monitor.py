@@ -0,0 +1,277 @@
+"""Log garbage collection pauses and memory growth.
+
+Garbage collection pauses every thread, and memory growth slows down the
+whole process, without any single callback or request being slow.
+"""
+import gc
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from logging import Logger
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from powerflex_logging_utilities.histogram import Histogram
+
+DEFAULT_PAUSE_THRESHOLD_SEC = 0.05
+DEFAULT_GC_SUMMARY_INTERVAL_SEC = 60.0
+DEFAULT_CHECK_INTERVAL_SEC = 1.0
+DEFAULT_TOP_N = 10
+
+# Pauses above the threshold that are not logged yet, beyond which they are only counted
+MAX_PENDING_PAUSES = 100
+
+# Generation, start time, duration, collected, uncollectable
+_Pause = Tuple[int, float, float, int, int]
+
+
+def get_rss_bytes() -> Optional[int]:
+    """Return the resident set size of this process, or None if it is unknown.
+
+    This reads /proc, so it only works on Linux.
+    """
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class GcMonitor:
+    """Time each garbage collection and watch the memory used by the process.
+
+    logger - Log with this logger.
+
+    pause_threshold_sec - WARN log each collection that pauses the process for
+        longer than this many seconds, with gc_generation, gc_pause,
+        gc_collected and gc_uncollectable fields.
+
+    summary_interval_sec - INFO log a summary of the collections this often, in
+        a gc_pauses field with the count, total, mean, max, p50, p95 and p99
+        pause of each generation. The statistics are reset after each summary.
+
+    check_interval_sec - How often the background thread logs pauses and the
+        summary, and checks the memory limits.
+
+    rss_limit_bytes - WARN log when the resident set size of the process crosses
+        this many bytes. Only available on Linux.
+
+    trace_allocations - Start tracemalloc, and add the top_n allocation sites
+        to the memory limit logs, in a top_allocations field.
+        This slows down every allocation, so only use it to debug memory growth.
+
+    traced_memory_limit_bytes - WARN log when the memory traced by tracemalloc
+        crosses this many bytes.
+
+    traced_frames - How many frames tracemalloc keeps for each allocation.
+
+    Memory limit logs have rss and traced_memory fields, and are logged again
+    after the memory goes back below the limit and crosses it again.
+
+    Logging from a garbage collection callback can deadlock on the locks of
+    handlers, so pauses are logged by a background thread every check_interval_sec.
+    The gc_started_at field has the time the collection started.
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        pause_threshold_sec: float = DEFAULT_PAUSE_THRESHOLD_SEC,
+        summary_interval_sec: float = DEFAULT_GC_SUMMARY_INTERVAL_SEC,
+        check_interval_sec: float = DEFAULT_CHECK_INTERVAL_SEC,
+        rss_limit_bytes: Optional[int] = None,
+        trace_allocations: bool = False,
+        traced_memory_limit_bytes: Optional[int] = None,
+        traced_frames: int = 1,
+        top_n: int = DEFAULT_TOP_N,
+    ) -> None:
+        self.logger = logger
+        self.pause_threshold_sec = pause_threshold_sec
+        self.summary_interval_sec = summary_interval_sec
+        self.check_interval_sec = check_interval_sec
+        self.rss_limit_bytes = rss_limit_bytes
+        self.trace_allocations = trace_allocations
+        self.traced_memory_limit_bytes = traced_memory_limit_bytes
+        self.traced_frames = traced_frames
+        self.top_n = top_n
+        self.pauses = [Histogram() for _generation in range(3)]
+        self._pending: Deque[_Pause] = deque(maxlen=MAX_PENDING_PAUSES)
+        self._started_at = 0.0
+        self._over_limit = False
+        self._started_tracemalloc = False
+        self._next_summary_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start timing collections and checking memory on a background thread."""
+        if self._thread is not None:
+            return
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start(self.traced_frames)
+            self._started_tracemalloc = True
+        self._next_summary_at = time.monotonic() + self.summary_interval_sec
+        gc.callbacks.append(self._on_gc)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=type(self).__name__, daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop timing collections, and stop tracemalloc if this monitor started it."""
+        if self._thread is None:
+            return
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _on_gc(self, phase: str, info: Dict[str, int]) -> None:
+        # Keep this fast and don't log here: it runs in the middle of any allocation
+        if phase == "start":
+            self._started_at = time.perf_counter()
+            return
+        duration = time.perf_counter() - self._started_at
+        generation = info["generation"]
+        self.pauses[generation].record(duration)
+        if duration > self.pause_threshold_sec:
+            self._pending.append(
+                (
+                    generation,
+                    time.time() - duration,
+                    duration,
+                    info["collected"],
+                    info["uncollectable"],
+                )
+            )
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.check_interval_sec):
+            try:
+                self.check()
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception("Failed to check garbage collection and memory")
+
+    def check(self) -> None:
+        """Log the pauses above the threshold, the memory limits crossed, and the summary when it is due."""
+        while self._pending:
+            pause = self._pending.popleft()
+            generation, started_at, duration, collected, uncollectable = pause
+            self.logger.warning(
+                "Garbage collection of generation %s paused the process for %.3f seconds",
+                generation,
+                duration,
+                extra={
+                    "gc_generation": generation,
+                    "gc_started_at": started_at,
+                    "gc_pause": duration,
+                    "gc_collected": collected,
+                    "gc_uncollectable": uncollectable,
+                },
+            )
+        self.check_memory()
+        now = time.monotonic()
+        if now >= self._next_summary_at:
+            self._next_summary_at = now + self.summary_interval_sec
+            self.log_summary()
+
+    def check_memory(self) -> None:
+        """WARN log when the process memory crosses a limit."""
+        rss = get_rss_bytes() if self.rss_limit_bytes is not None else None
+        traced_memory = (
+            tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        )
+        over_limit = (
+            rss is not None
+            and self.rss_limit_bytes is not None
+            and rss > self.rss_limit_bytes
+        ) or (
+            traced_memory is not None
+            and self.traced_memory_limit_bytes is not None
+            and traced_memory > self.traced_memory_limit_bytes
+        )
+        if over_limit and not self._over_limit:
+            self.logger.warning(
+                "Memory limit crossed, resident set size %s bytes, traced memory %s bytes",
+                rss,
+                traced_memory,
+                extra={
+                    "rss": rss,
+                    "traced_memory": traced_memory,
+                    "top_allocations": self.top_allocations()
+                    if tracemalloc.is_tracing()
+                    else None,
+                },
+            )
+        self._over_limit = over_limit
+
+    def top_allocations(self) -> List[Dict[str, Any]]:
+        """Return the top_n lines of code with the most memory allocated and still in use."""
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        return [
+            {
+                "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size": stat.size,
+                "count": stat.count,
+            }
+            for stat in snapshot.statistics("lineno")[: self.top_n]
+        ]
+
+    def log_summary(self) -> None:
+        """Log a summary of the collections so far, and reset the statistics."""
+        # Replace the histograms instead of resetting them, as collections can
+        # happen at any time in this thread
+        pauses, self.pauses = self.pauses, [Histogram() for _generation in range(3)]
+        count = sum(histogram.count for histogram in pauses)
+        if not count:
+            return
+        total = sum(histogram.total for histogram in pauses)
+        self.logger.info(
+            "%s garbage collections paused the process for %.3f seconds",
+            count,
+            total,
+            extra={
+                "gc_count": count,
+                "gc_total_pause": total,
+                "gc_pauses": {
+                    str(generation): histogram.summary()
+                    for generation, histogram in enumerate(pauses)
+                    if histogram.count
+                },
+            },
+        )
+
+
+def monitor_gc(
+    logger: Logger,
+    pause_threshold_sec: float = DEFAULT_PAUSE_THRESHOLD_SEC,
+    summary_interval_sec: float = DEFAULT_GC_SUMMARY_INTERVAL_SEC,
+    rss_limit_bytes: Optional[int] = None,
+    trace_allocations: bool = False,
+    traced_memory_limit_bytes: Optional[int] = None,
+    top_n: int = DEFAULT_TOP_N,
+) -> GcMonitor:
+    """Start a GcMonitor. Call stop() on the returned monitor to stop it.
+
+    Use it with log_slow_callbacks and monitor_loop_lag to tell garbage
+    collection pauses apart from slow code.
+    """
+    monitor = GcMonitor(
+        logger,
+        pause_threshold_sec=pause_threshold_sec,
+        summary_interval_sec=summary_interval_sec,
+        rss_limit_bytes=rss_limit_bytes,
+        trace_allocations=trace_allocations,
+        traced_memory_limit_bytes=traced_memory_limit_bytes,
+        top_n=top_n,
+    )
+    monitor.start()
+    return monitor
@@ -0,0 +1,88 @@
+"""A small histogram with logarithmic buckets, for latency statistics that are cheap to record."""
+from typing import Dict, Optional
+
+# Each power of two is split in this many buckets, so values are rounded by at most 1/16
+_SUB_BUCKETS = 16
+_SUB_BUCKET_BITS = 4
+
+
+def _bucket_index(value: int) -> int:
+    if value < _SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - _SUB_BUCKET_BITS - 1
+    return (shift + 1) * _SUB_BUCKETS + (value >> shift) - _SUB_BUCKETS
+
+
+def _bucket_upper_bound(index: int) -> int:
+    if index < _SUB_BUCKETS:
+        return index
+    shift = index // _SUB_BUCKETS - 1
+    return ((index % _SUB_BUCKETS + _SUB_BUCKETS + 1) << shift) - 1
+
+
+class Histogram:
+    """Count values in buckets whose width grows with the value.
+
+    scale - Values are multiplied by scale and rounded to an integer before
+        being counted. The default counts seconds with a microsecond resolution.
+
+    Percentiles are accurate to about 6%. Memory only grows with the number of
+    distinct buckets used, which is small: 16 per power of two.
+    """
+
+    __slots__ = ("scale", "count", "total", "max", "_buckets")
+
+    def __init__(self, scale: float = 1e6) -> None:
+        self.scale = scale
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._buckets: Dict[int, int] = {}
+
+    def record(self, value: float) -> None:
+        """Count a value. Negative values are counted as 0."""
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        index = _bucket_index(max(0, int(value * self.scale)))
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+
+    def percentile(self, fraction: float) -> float:
+        """Return the value below which this fraction of the counted values fall, such as 0.99."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        index: Optional[int] = None
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                break
+        assert index is not None
+        return min(self.max, _bucket_upper_bound(index) / self.scale)
+
+    def merge(self, other: "Histogram") -> None:
+        """Add the values counted by another histogram with the same scale."""
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        for index, count in other._buckets.items():  # pylint: disable=protected-access
+            self._buckets[index] = self._buckets.get(index, 0) + count
+
+    def reset(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._buckets.clear()
+
+    def summary(self) -> Dict[str, float]:
+        """Return the count, total, mean, max, p50, p95 and p99 of the values."""
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
@@ -2,14 +2,49 @@ import logging
 import logging.handlers
 import os
 import sys
-from typing import Any, Collection, Dict, Optional, TextIO, Type, Union, cast
+from typing import (
+    Any,
+    Collection,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    TextIO,
+    Type,
+    Union,
+    cast,
+    get_args,
+)
 
+from powerflex_logging_utilities.binary_log_format import BinaryRotatingFileHandler
+from powerflex_logging_utilities.compact_log_record import CompactLogRecord
 from powerflex_logging_utilities.default_log_format import DEFAULT_LOG_FORMAT
+from powerflex_logging_utilities.flight_recorder import (
+    DEFAULT_FLIGHT_RECORDER_CAPACITY,
+    DEFAULT_FLIGHT_RECORDER_MAX_BYTES,
+    FlightRecorderHandler,
+)
 from powerflex_logging_utilities.json_formatter import JsonFormatter
+from powerflex_logging_utilities.log_index import IndexedRotatingFileHandler
+from powerflex_logging_utilities.log_stats import LogStatsFilter
+from powerflex_logging_utilities.queue_handler import (
+    DEFAULT_OVERFLOW_POLICY,
+    DEFAULT_QUEUE_MAX_SIZE,
+    BackgroundQueueHandler,
+    OverflowPolicy,
+)
+from powerflex_logging_utilities.rotating_file_handler import (
+    BackgroundRotatingFileHandler,
+    Compression,
+)
+from powerflex_logging_utilities.trace_logger import TraceLogger
 
 DEFAULT_LOGFILE_MAX_BYTES = 1000 * 1000 * 10  # 10 megabytes
 DEFAULT_LOGFILE_BACKUP_COUNT = 25
 
+FileFormat = Literal["json", "binary"]
+
 
 def min_log_level(level1: Union[str, int], level2: Optional[Union[str, int]]) -> int:
     if isinstance(level1, str):
@@ -19,21 +54,120 @@ def min_log_level(level1: Union[str, int], level2: Optional[Union[str, int]]) ->
     return min([level1, level2])
 
 
+FormatterOrType = Union[Type[logging.Formatter], logging.Formatter]
+
+
+def make_formatter(
+    formatter: FormatterOrType,
+    formatter_kwargs: Optional[Dict[str, Any]] = None,
+    log_format: str = DEFAULT_LOG_FORMAT,
+) -> logging.Formatter:
+    """Create a formatter, or return it if it is already a Formatter instance."""
+    if isinstance(formatter, logging.Formatter):
+        return formatter
+    if formatter_kwargs is None:
+        formatter_kwargs = {}
+    return formatter(fmt=log_format, **formatter_kwargs)
+
+
+def make_stream_handler(
+    log_level: Union[str, int],
+    formatter: FormatterOrType,
+    formatter_kwargs: Optional[Dict[str, Any]] = None,
+    log_format: str = DEFAULT_LOG_FORMAT,
+    stream: TextIO = sys.stdout,
+) -> logging.Handler:
+    """Create a handler named "stdout" that logs to the given stream."""
+    log_handler = logging.StreamHandler(stream=stream)
+    log_handler.set_name("stdout")
+    log_handler.setFormatter(make_formatter(formatter, formatter_kwargs, log_format))
+    log_handler.setLevel(log_level)
+    return log_handler
+
+
 def add_stream_handler(
     logger_instance: logging.Logger,
     log_level: Union[str, int],
-    formatter: Type[logging.Formatter],
+    formatter: FormatterOrType,
     formatter_kwargs: Optional[Dict[str, Any]] = None,
     log_format: str = DEFAULT_LOG_FORMAT,
     stream: TextIO = sys.stdout,
 ) -> None:
-    if formatter_kwargs is None:
-        formatter_kwargs = {}
-    log_handler = logging.StreamHandler(stream=stream)
-    log_handler.set_name("stdout")
-    log_handler.setFormatter(formatter(fmt=log_format, **formatter_kwargs))
+    logger_instance.addHandler(
+        make_stream_handler(log_level, formatter, formatter_kwargs, log_format, stream)
+    )
+
+
+def make_file_handler(
+    log_level: Union[str, int],
+    filename: str,
+    max_bytes: int,
+    backup_count: int,
+    formatter: FormatterOrType,
+    formatter_kwargs: Optional[Dict[str, Any]] = None,
+    log_format: str = DEFAULT_LOG_FORMAT,
+    background_rotation: bool = False,
+    rotation_interval_seconds: Optional[float] = None,
+    compression: Optional[Compression] = None,
+    file_format: FileFormat = "json",
+    index_files: bool = False,
+) -> logging.Handler:
+    """Create a rotating file handler.
+
+    Creates the log file directory if it doesn't exist.
+
+    background_rotation - If True, use a BackgroundRotatingFileHandler instead of
+        a logging.handlers.RotatingFileHandler. Setting rotation_interval_seconds
+        or compression also uses a BackgroundRotatingFileHandler.
+
+    file_format - "json" writes JSON lines.
+        "binary" uses a BinaryRotatingFileHandler, which rotates files like a
+        BackgroundRotatingFileHandler. The formatter must be a JsonFormatter.
+
+    index_files - If True, use an IndexedRotatingFileHandler, which indexes each
+        JSON log file when it is rotated for powerflex-logging-query.
+    """
+    if file_format not in get_args(FileFormat):
+        raise ValueError(
+            f"file_format must be one of {get_args(FileFormat)}, not {file_format!r}"
+        )
+    if index_files and file_format != "json":
+        raise ValueError("index_files requires the json file_format")
+    log_handler: logging.Handler
+    if file_format == "binary":
+        log_handler = BinaryRotatingFileHandler(
+            filename,
+            max_bytes=max_bytes,
+            interval_seconds=rotation_interval_seconds,
+            backup_count=backup_count,
+            compression=compression,
+        )
+    elif index_files:
+        log_handler = IndexedRotatingFileHandler(
+            filename,
+            max_bytes=max_bytes,
+            interval_seconds=rotation_interval_seconds,
+            backup_count=backup_count,
+            compression=compression,
+        )
+    elif background_rotation or rotation_interval_seconds or compression:
+        log_handler = BackgroundRotatingFileHandler(
+            filename,
+            max_bytes=max_bytes,
+            interval_seconds=rotation_interval_seconds,
+            backup_count=backup_count,
+            compression=compression,
+        )
+    else:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        log_handler = logging.handlers.RotatingFileHandler(
+            filename,
+            maxBytes=max_bytes,
+            backupCount=backup_count,
+        )
+    log_handler.setFormatter(make_formatter(formatter, formatter_kwargs, log_format))
     log_handler.setLevel(log_level)
-    logger_instance.addHandler(log_handler)
+    return log_handler
 
 
 def add_file_handler(
@@ -42,7 +176,7 @@ def add_file_handler(
     filename: str,
     max_bytes: int,
     backup_count: int,
-    formatter: Type[logging.Formatter],
+    formatter: FormatterOrType,
     formatter_kwargs: Optional[Dict[str, Any]] = None,
     log_format: str = DEFAULT_LOG_FORMAT,
 ) -> None:
@@ -50,22 +184,20 @@ def add_file_handler(
 
     Creates the log file directory if it doesn't exist.
     """
-    if formatter_kwargs is None:
-        formatter_kwargs = {}
-
-    os.makedirs(os.path.dirname(filename), exist_ok=True)
-
-    log_handler = logging.handlers.RotatingFileHandler(
-        filename,
-        maxBytes=max_bytes,
-        backupCount=backup_count,
+    logger_instance.addHandler(
+        make_file_handler(
+            log_level,
+            filename,
+            max_bytes,
+            backup_count,
+            formatter,
+            formatter_kwargs,
+            log_format,
+        )
     )
-    log_handler.setFormatter(formatter(fmt=log_format, **formatter_kwargs))
-    log_handler.setLevel(log_level)
-    logger_instance.addHandler(log_handler)
 
 
-def init_logger(
+def init_logger(  # pylint: disable=too-many-locals
     log_level: Union[str, int],
     file_log_level: Optional[Union[str, int]],
     filename: Optional[str],
@@ -73,47 +205,133 @@ def init_logger(
     max_bytes: int = DEFAULT_LOGFILE_MAX_BYTES,
     backup_count: int = DEFAULT_LOGFILE_BACKUP_COUNT,
     stream: TextIO = sys.stdout,
-    formatter: Type[logging.Formatter] = JsonFormatter,
+    formatter: FormatterOrType = JsonFormatter,
     formatter_kwargs: Optional[Dict[str, Any]] = None,
     log_format: str = DEFAULT_LOG_FORMAT,
+    use_queue: bool = False,
+    queue_max_size: int = DEFAULT_QUEUE_MAX_SIZE,
+    queue_overflow_policy: OverflowPolicy = DEFAULT_OVERFLOW_POLICY,
+    background_rotation: bool = False,
+    rotation_interval_seconds: Optional[float] = None,
+    compression: Optional[Compression] = None,
+    filters: Optional[Sequence[logging.Filter]] = None,
+    flight_recorder_level: Optional[Union[str, int]] = None,
+    flight_recorder_capacity: int = DEFAULT_FLIGHT_RECORDER_CAPACITY,
+    flight_recorder_max_bytes: int = DEFAULT_FLIGHT_RECORDER_MAX_BYTES,
+    file_format: FileFormat = "json",
+    index_files: bool = False,
+    file_handler: Optional[logging.Handler] = None,
 ) -> None:
     """Configure a logger to log to both the given stream and filename with the given formatter.
 
     logger_instance - Configure this Logger object.
         If a string, configure logging.getLogger(logger_instance)
+
+    formatter - A Formatter class, or a Formatter instance to share between handlers.
+        The stream and file handlers share one formatter, so a JsonFormatter
+        only serializes each record once.
+
+    use_queue - If True, the stream and file handlers write records on a
+        background thread. See BackgroundQueueHandler for queue_max_size and
+        queue_overflow_policy.
+
+    background_rotation, rotation_interval_seconds, compression - See make_file_handler.
+
+    filters - Filters to add to each handler, or to the queue handler if use_queue is True.
+        LogStatsFilter instances are added last, to the stream and file handlers,
+        so that they count the records where they are written, after the queue.
+
+    flight_recorder_level - If not None, wrap the stream and file handlers in a
+        FlightRecorderHandler keeping records at or above this level in memory.
+
+    file_format, index_files - See make_file_handler.
+
+    file_handler - If not None, use this handler to log to the file instead of
+        creating one, so that several loggers can share it.
     """
     if isinstance(logger_instance, str):
         logger_instance = logging.getLogger(logger_instance)
 
+    shared_formatter = make_formatter(formatter, formatter_kwargs, log_format)
+    if isinstance(shared_formatter, JsonFormatter):
+        # The stream and file handlers format the same records
+        shared_formatter.shared = True
+    formatter = shared_formatter
+
     # We need the minimum log level of the two so that we don't accidentally
     # set a logger to log at a higher level than is expected by either the
     # stdout or file handlers.
-    min_level = min_log_level(log_level, file_log_level)
+    min_level = min_log_level(
+        min_log_level(log_level, file_log_level), flight_recorder_level
+    )
 
     logger_instance.setLevel(min_level)
 
-    add_stream_handler(
-        logger_instance,
-        log_level,
-        formatter,
-        formatter_kwargs,
-        log_format,
-        stream=stream,
-    )
-    if not (file_log_level is None or filename is None):
-        add_file_handler(
-            logger_instance,
-            file_log_level,
-            filename,
-            max_bytes,
-            backup_count,
+    handlers: List[logging.Handler] = [
+        make_stream_handler(
+            log_level,
             formatter,
             formatter_kwargs,
             log_format,
+            stream=stream,
+        )
+    ]
+    if file_handler is not None:
+        handlers.append(file_handler)
+    elif not (file_log_level is None or filename is None):
+        handlers.append(
+            make_file_handler(
+                file_log_level,
+                filename,
+                max_bytes,
+                backup_count,
+                formatter,
+                formatter_kwargs,
+                log_format,
+                background_rotation=background_rotation,
+                rotation_interval_seconds=rotation_interval_seconds,
+                compression=compression,
+                file_format=file_format,
+                index_files=index_files,
+            )
+        )
+
+    writing_handlers = handlers
+    if flight_recorder_level is not None:
+        flight_recorder = FlightRecorderHandler(
+            handlers,
+            capacity=flight_recorder_capacity,
+            max_bytes=flight_recorder_max_bytes,
+            level=flight_recorder_level,
+        )
+        flight_recorder.set_name("flight_recorder")
+        handlers = [flight_recorder]
+
+    if use_queue:
+        queue_handler = BackgroundQueueHandler(
+            handlers,
+            max_size=queue_max_size,
+            overflow_policy=queue_overflow_policy,
         )
+        queue_handler.set_name("queue")
+        handlers = [queue_handler]
 
+    writing_filters = []
+    for log_filter in filters or []:
+        if isinstance(log_filter, LogStatsFilter):
+            writing_filters.append(log_filter)
+            continue
+        for handler in handlers:
+            handler.addFilter(log_filter)
+    # After the filters that drop records
+    for log_filter in writing_filters:
+        for handler in writing_handlers:
+            handler.addFilter(log_filter)
+    for handler in handlers:
+        logger_instance.addHandler(handler)
 
-def init_loggers(
+
+def init_loggers(  # pylint: disable=too-many-locals
     loggers: Collection[Union[logging.Logger, str]],
     log_level: Union[str, int],
     file_log_level: Optional[Union[str, int]],
@@ -121,10 +339,24 @@ def init_loggers(
     max_bytes: int = DEFAULT_LOGFILE_MAX_BYTES,
     backup_count: int = DEFAULT_LOGFILE_BACKUP_COUNT,
     stream: TextIO = sys.stdout,
-    formatter: Type[logging.Formatter] = JsonFormatter,
+    formatter: FormatterOrType = JsonFormatter,
     formatter_kwargs: Optional[Dict[str, Any]] = None,
     log_format: str = DEFAULT_LOG_FORMAT,
     info_logger: Optional[Union[logging.Logger, str]] = None,
+    use_queue: bool = False,
+    queue_max_size: int = DEFAULT_QUEUE_MAX_SIZE,
+    queue_overflow_policy: OverflowPolicy = DEFAULT_OVERFLOW_POLICY,
+    caller_info_level: Optional[Union[str, int]] = None,
+    background_rotation: bool = False,
+    rotation_interval_seconds: Optional[float] = None,
+    compression: Optional[Compression] = None,
+    filters: Optional[Sequence[logging.Filter]] = None,
+    flight_recorder_level: Optional[Union[str, int]] = None,
+    flight_recorder_capacity: int = DEFAULT_FLIGHT_RECORDER_CAPACITY,
+    flight_recorder_max_bytes: int = DEFAULT_FLIGHT_RECORDER_MAX_BYTES,
+    file_format: FileFormat = "json",
+    index_files: bool = False,
+    compact_records: bool = False,
 ) -> None:
     """Configure loggers to log to both the given stream and filename with the given formatter.
 
@@ -133,7 +365,100 @@ def init_loggers(
 
     info_logger - If not None, use it to log the logging configuration after setting up loggers.
         If a string is passed instead of a Logger, use logging.getLogger(info_logger)
+
+    formatter - A Formatter class, or a Formatter instance.
+        All handlers of all loggers share one formatter instance, so a record
+        propagating to several handlers is only serialized once by JsonFormatter.
+
+    use_queue - If True, each logger's stream and file handlers write records on a
+        background thread instead of the logging thread.
+        Records wait in a queue of at most queue_max_size records.
+        queue_overflow_policy is one of "block", "drop_newest" or "drop_oldest".
+        Queued records are written when the program exits or when the handler named
+        "queue" is flushed or closed.
+
+    caller_info_level - If not None, TraceLogger instances only find the file, line
+        number and function of records at or above this level. Finding the caller
+        is one of the most expensive parts of creating a record.
+        Below this level, fields such as funcName and lineno are "(unknown function)" and 0.
+        This applies to every TraceLogger, not only to the configured loggers.
+        See TraceLogger.set_caller_info_level.
+
+    background_rotation - If True, the log file is rotated by a BackgroundRotatingFileHandler.
+        Rotated files are named filename.1, filename.2, ... with the newest file
+        having the highest index. Old files are deleted on a background thread.
+        A single BackgroundRotatingFileHandler is shared by all loggers.
+
+    rotation_interval_seconds - If not None, also rotate the log file after this many seconds.
+
+    compression - None, "gzip" or "zstd". Compress rotated files on a background thread.
+        "zstd" requires the zstandard package.
+
+    Setting rotation_interval_seconds or compression implies background_rotation.
+
+    filters - Filters to add to the handlers of every logger, such as a RateLimitFilter.
+        Filters are added to handlers rather than loggers so that they also see
+        records propagated from child loggers.
+        Filter instances are shared by all handlers.
+
+    flight_recorder_level - If not None, keep the last records at or above this level
+        that the stream and file handlers don't write in memory, such as TRACE records.
+        When an ERROR record is logged, they are written first.
+        Each logger keeps at most flight_recorder_capacity records, using about
+        flight_recorder_max_bytes of memory. See FlightRecorderHandler.
+        Loggers are set to this level, so records at this level are created
+        but only formatted when they are written.
+
+    file_format - "json" writes JSON lines to the file. "binary" writes compact
+        binary records with a BinaryRotatingFileHandler, shared by all loggers.
+        Convert binary files to JSON lines with powerflex-logging-decode.
+
+    index_files - If True, index each JSON log file when it is rotated, on the
+        background thread of an IndexedRotatingFileHandler, so that
+        powerflex-logging-query reads the rotated files without indexing them.
+        Implies background_rotation.
+
+    compact_records - If True, create records as CompactLogRecord instances, which
+        keep their standard attributes in __slots__ and use less memory, such as
+        while they wait in the queue of use_queue. See CompactLogRecord.
+        Like caller_info_level, this applies to every logger, by calling
+        logging.setLogRecordFactory.
     """
+    if caller_info_level is not None:
+        TraceLogger.set_caller_info_level(caller_info_level)
+
+    if compact_records:
+        logging.setLogRecordFactory(CompactLogRecord)
+
+    formatter = make_formatter(formatter, formatter_kwargs, log_format)
+
+    file_handler: Optional[logging.Handler] = None
+    shared_file_handler = (
+        file_format == "binary"
+        or background_rotation
+        or rotation_interval_seconds
+        or compression
+        or index_files
+    )
+    if shared_file_handler and not (file_log_level is None or filename is None):
+        # Records of a binary file refer to the strings of the previous records,
+        # and each BackgroundRotatingFileHandler numbers the rotated files it
+        # writes, so a single handler writes the file
+        file_handler = make_file_handler(
+            file_log_level,
+            filename,
+            max_bytes,
+            backup_count,
+            formatter,
+            formatter_kwargs,
+            log_format,
+            background_rotation=background_rotation,
+            rotation_interval_seconds=rotation_interval_seconds,
+            compression=compression,
+            file_format=file_format,
+            index_files=index_files,
+        )
+
     for logger_instance in loggers:
         init_logger(
             log_level,
@@ -146,6 +471,19 @@ def init_loggers(
             formatter,
             formatter_kwargs,
             log_format,
+            use_queue=use_queue,
+            queue_max_size=queue_max_size,
+            queue_overflow_policy=queue_overflow_policy,
+            background_rotation=background_rotation,
+            rotation_interval_seconds=rotation_interval_seconds,
+            compression=compression,
+            filters=filters,
+            flight_recorder_level=flight_recorder_level,
+            flight_recorder_capacity=flight_recorder_capacity,
+            flight_recorder_max_bytes=flight_recorder_max_bytes,
+            file_format=file_format,
+            index_files=index_files,
+            file_handler=file_handler,
         )
 
     if info_logger is None:
@@ -1,9 +1,152 @@
-from typing import Any, Dict, Optional
+import json
+import logging
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    Tuple,
+    get_args,
+)
 
 # Wait for an update or write type stubs
 from pythonjsonlogger import jsonlogger  # type: ignore
 
+from powerflex_logging_utilities.compact_log_record import (
+    SLOT_ATTRIBUTES,
+    RecordAttributes,
+)
 from powerflex_logging_utilities.default_log_format import DEFAULT_LOG_FORMAT
+from powerflex_logging_utilities.log_context import record_log_context
+from powerflex_logging_utilities.payload_encoder import (
+    DEFAULT_MAX_PAYLOAD_BYTES,
+    PayloadEncoder,
+)
+
+Serializer = Literal["json", "orjson", "ujson", "auto"]
+
+TimeFormat = Literal["default", "cached", "rfc3339", "epoch_ns"]
+
+BytesSerializer = Callable[[Dict[str, Any]], bytes]
+
+# The fields added to the records of a log context, and these fields serialized
+# as the members of a JSON object, as text and UTF-8
+Fragment = Tuple[Dict[str, Any], str, bytes]
+
+# Extra values of these types are never truncated
+_SCALAR_TYPES = frozenset([int, float, bool, type(None)])
+
+# The record attribute holding the output of the last JsonFormatter formatting it
+OUTPUT_ATTRIBUTE = "_json_formatter_output"
+
+
+class _FormattedRecord:
+    """What a JsonFormatter made of a record, and the attributes it was made from."""
+
+    __slots__ = ("formatter", "state", "text", "data", "log_record")
+
+    def __init__(
+        self,
+        formatter: Optional["JsonFormatter"],
+        state: Any,
+        text: Optional[str] = None,
+        data: Optional[bytes] = None,
+        log_record: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.formatter = formatter
+        self.state = state
+        self.text = text
+        self.data = data
+        self.log_record = log_record
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # Pickled records, such as those sent by SocketHandler, are formatted again
+        return _FormattedRecord, (None, None)
+
+
+def _record_state(record: logging.LogRecord) -> Any:
+    """Return a copy of the attributes of a record, to tell if it changes later."""
+    record_dict = record.__dict__
+    if isinstance(record_dict, RecordAttributes):
+        snapshot = record_dict.snapshot()
+        if snapshot is not None:
+            snapshot[1].pop(OUTPUT_ATTRIBUTE, None)
+        return snapshot
+    state = record_dict.copy()
+    state.pop(OUTPUT_ATTRIBUTE, None)
+    return state
+
+
+def _same_state(state: Any, other: Any) -> bool:
+    if state is None or other is None:
+        return False
+    try:
+        # Compares identical values without calling their __eq__
+        same: bool = state == other
+        return same
+    except Exception:  # pylint: disable=broad-except
+        # Such as numpy arrays, which can't be compared to a bool
+        return False
+
+
+def _make_bytes_serializer(
+    serializer: Serializer,
+    default: Optional[Callable[[Any], Any]],
+    ensure_ascii: bool,
+) -> Tuple[str, Optional[BytesSerializer]]:
+    """Return the name of the serializer to use and a function serializing to bytes.
+
+    The function is None when the stdlib json module is used.
+    """
+    if serializer in ("orjson", "auto"):
+        try:
+            # pylint: disable=import-outside-toplevel
+            import orjson  # type: ignore
+        except ImportError:
+            if serializer == "orjson":
+                raise
+        else:
+
+            def orjson_dumps(log_record: Dict[str, Any]) -> bytes:
+                # pylint: disable=no-member
+                return orjson.dumps(  # type: ignore
+                    log_record,
+                    default=default,
+                    # Convert dataclasses with default, like the other serializers
+                    option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS,
+                )
+
+            return "orjson", orjson_dumps
+
+    if serializer in ("ujson", "auto"):
+        try:
+            # pylint: disable=import-outside-toplevel
+            import ujson  # type: ignore
+        except ImportError:
+            if serializer == "ujson":
+                raise
+        else:
+
+            def ujson_dumps(log_record: Dict[str, Any]) -> bytes:
+                return ujson.dumps(  # type: ignore
+                    log_record,
+                    default=default,
+                    ensure_ascii=ensure_ascii,
+                    escape_forward_slashes=False,
+                ).encode("utf-8")
+
+            return "ujson", ujson_dumps
+
+    if serializer not in ("json", "auto"):
+        raise ValueError(
+            f'serializer must be "json", "orjson", "ujson" or "auto", not {serializer!r}'
+        )
+    return "json", None
 
 
 class JsonFormatter(jsonlogger.JsonFormatter):  # type: ignore
@@ -11,18 +154,433 @@ class JsonFormatter(jsonlogger.JsonFormatter):  # type: ignore
 
     - Replaces the "levelname" field with "severity".
     - Replaces non-string keys in the log record with their __str__ representation
+
+    The fields to log are worked out from fmt once, when the formatter is
+    created, and each record is turned into a dict in a single pass.
+
+    serializer - How to serialize the log record to JSON.
+        "json" uses json_serializer like python-json-logger does (default).
+        "orjson" and "ujson" use these packages, which must be installed.
+        "auto" uses orjson, then ujson, then json, depending on what is installed.
+        orjson and ujson write more compact JSON than the json module.
+    constant_fields - Fields that are the same for every record, such as the
+        service name, host, pid or version. They are serialized once, when the
+        formatter is created, and spliced into the output after the record's
+        fields. Unlike static_fields, fields of the record win over them.
+    time_format - How to format the asctime field.
+        "default" uses formatTime, like logging.Formatter.
+        "cached" writes the same text as "default", but only formats the
+        date and time once per second.
+        "rfc3339" writes UTC times like 2024-05-01T10:00:00.123Z.
+        "epoch_ns" writes the nanoseconds since the epoch as an integer.
+    max_payload_bytes - Roughly the most bytes of JSON written for one extra
+        value, such as a string, dict, pydantic model, dataclass, numpy array
+        or Lazy. Bigger values are truncated. None doesn't truncate.
+        See payload_encoder for how these values are converted.
+
+    The fields of the log_context a record was logged in are added after its
+    other fields. They are serialized once per context and spliced into the
+    output of each record. Fields of the record win over the context's.
+
+    The output is kept with the record, so handlers sharing a JsonFormatter
+    instance only serialize a record once. If shared is True, the formatter
+    also keeps a shallow copy of the attributes of each record, and serializes
+    a record again if a filter changed an attribute between two handlers.
+    Changes inside mutable values are not seen. init_loggers sets shared,
+    and the formatter sets it when it is given a record a second time.
     """
 
-    def __init__(self, fmt: Optional[str] = DEFAULT_LOG_FORMAT, **kwargs: Any) -> None:
+    serializer: str
+    shared: bool
+
+    def __init__(
+        self,
+        fmt: Optional[str] = DEFAULT_LOG_FORMAT,
+        serializer: Serializer = "json",
+        constant_fields: Optional[Dict[str, Any]] = None,
+        time_format: TimeFormat = "default",
+        max_payload_bytes: Optional[int] = DEFAULT_MAX_PAYLOAD_BYTES,
+        **kwargs: Any,
+    ) -> None:
         super().__init__(fmt=fmt, **kwargs)  # type: ignore
 
-    def process_log_record(self, log_record: Dict[str, Any]) -> Any:
-        log_record["severity"] = log_record["levelname"]
-        del log_record["levelname"]
+        if time_format not in get_args(TimeFormat):
+            raise ValueError(
+                f"time_format must be one of {get_args(TimeFormat)}, not {time_format!r}"
+            )
+        self.time_format = time_format
+        # Holds (seconds since the epoch, datefmt, formatted date and time)
+        self._cached_time: Tuple[int, Optional[str], str] = (-1, None, "")
+
+        self._fields: Tuple[str, ...] = tuple(
+            field for field in self._required_fields if field != "levelname"
+        )
+        self._uses_asctime = "asctime" in self._required_fields
+        self._use_fast_path = (
+            not getattr(self, "rename_fields", None)
+            and not getattr(self, "rename_fields_keep_missing", False)
+            and not getattr(self, "defaults", None)
+            and not self.timestamp
+            # Subclasses customizing these methods need the python-json-logger code path
+            and type(self).add_fields is jsonlogger.JsonFormatter.add_fields  # type: ignore
+            and type(self).process_log_record is JsonFormatter.process_log_record
+        )
+        # The slots of a CompactLogRecord are never extra fields, so only its
+        # instance dict needs to be searched for them
+        self._skips_slot_attributes = all(
+            name in self._skip_fields or name.startswith("_")
+            for name in SLOT_ATTRIBUTES
+        )
+
+        fallback = self.json_default
+        if fallback is None and self.json_encoder is not None:
+            fallback = self.json_encoder().default
+        # Converts values that are not of a JSON type
+        default = PayloadEncoder(fallback, max_payload_bytes)
+        self._truncate: Optional[Callable[[Any], Any]] = None
+        if max_payload_bytes is not None:
+            self._truncate = default.truncate
+        self.json_default_function: Callable[[Any], Any] = default
+        self.serializer, self._bytes_serializer = _make_bytes_serializer(
+            serializer, default, self.json_ensure_ascii
+        )
 
-        for key in log_record.copy():
+        # json.dumps creates a new encoder for every call. Reuse one instead.
+        self._json_encoder: Optional[json.JSONEncoder] = None
+        if self.json_serializer is json.dumps:
+            self._json_encoder = (self.json_encoder or json.JSONEncoder)(
+                default=default,
+                indent=self.json_indent,
+                ensure_ascii=self.json_ensure_ascii,
+            )
+
+        # What the serializer writes between two members of an object
+        probe = self.jsonify_log_record({"a": 0, "b": 0})
+        self._member_separator = probe[probe.index("0") + 1 : probe.index('"b"')]
+        # Whether the output ends with the closing brace, without whitespace
+        self._compact_output = self._bytes_serializer is not None or (
+            self._json_encoder is not None and self.json_indent is None
+        )
+        self._constant_fields: Dict[str, Any] = {
+            str(key): value for key, value in (constant_fields or {}).items()
+        }
+        self._constant_fragment: Optional[Fragment] = None
+        self.shared = False
+        if self._constant_fields:
+            self._constant_fragment = self._make_fragment({})
+
+    def formatTime(  # pylint: disable=invalid-name
+        self, record: logging.LogRecord, datefmt: Optional[str] = None
+    ) -> Any:
+        """Format the asctime field of a record according to time_format."""
+        time_format = self.time_format
+        if time_format == "cached":
+            seconds, cached_datefmt, text = self._cached_time
+            if seconds != int(record.created) or cached_datefmt != datefmt:
+                seconds = int(record.created)
+                text = time.strftime(
+                    datefmt or self.default_time_format, self.converter(seconds)
+                )
+                self._cached_time = (seconds, datefmt, text)
+            if datefmt:
+                return text
+            return self.default_msec_format % (text, record.msecs)
+        if time_format == "rfc3339":
+            seconds, _datefmt, text = self._cached_time
+            if seconds != int(record.created):
+                seconds = int(record.created)
+                text = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+                self._cached_time = (seconds, None, text)
+            return f"{text}.{int(record.msecs):03d}Z"
+        if time_format == "epoch_ns":
+            # Multiplying created by 1e9 would lose the precision of the fraction
+            seconds = int(record.created)
+            return seconds * 1000000000 + round((record.created - seconds) * 1e9)
+        return super().formatTime(record, datefmt)
+
+    def process_log_record(self, log_data: Dict[str, Any]) -> Any:
+        log_data["severity"] = log_data["levelname"]
+        del log_data["levelname"]
+
+        for key in log_data.copy():
             if not isinstance(key, str):
-                log_record[str(key)] = log_record[key]
-                del log_record[key]
+                log_data[str(key)] = log_data[key]
+                del log_data[key]
+
+        return super().process_log_record(log_data)  # type: ignore
+
+    def make_log_record(  # pylint: disable=too-many-branches
+        self, record: logging.LogRecord
+    ) -> Dict[str, Any]:
+        """Build the dict that will be serialized for this record.
+
+        This has the same fields, in the same order, as python-json-logger's
+        add_fields followed by process_log_record, without copying the dict.
+        """
+        record.message = record.getMessage()
+        if self._uses_asctime:
+            record.asctime = self.formatTime(record, self.datefmt)
+
+        record_dict = record.__dict__
+        extra_items: Iterable[Tuple[Any, Any]] = record_dict.items()
+        if isinstance(record_dict, RecordAttributes):
+            # Read the attributes of a CompactLogRecord without going through its mapping
+            overflow = record_dict.overflow
+            log_record = {
+                field: (
+                    getattr(record, field, None)
+                    if field in SLOT_ATTRIBUTES
+                    else overflow.get(field)
+                )
+                for field in self._fields
+            }
+            if self._skips_slot_attributes:
+                extra_items = overflow.items()
+        else:
+            log_record = {field: record_dict.get(field) for field in self._fields}
+        if self.static_fields:
+            log_record.update(self.static_fields)
+
+        # Display formatted exception
+        if record.exc_info:
+            log_record["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            log_record["exc_info"] = record.exc_text
+        if record.stack_info:
+            log_record["stack_info"] = self.formatStack(record.stack_info)
+
+        skip_fields = self._skip_fields
+        truncate = self._truncate
+        non_str_keys: Optional[List[Any]] = None
+        for key, value in extra_items:
+            if key in skip_fields:
+                continue
+            if isinstance(key, str):
+                if not key.startswith("_"):
+                    if truncate is not None and type(value) not in _SCALAR_TYPES:
+                        value = truncate(value)
+                    log_record[key] = value
+            elif non_str_keys is None:
+                non_str_keys = [key]
+            else:
+                non_str_keys.append(key)
+
+        log_record["severity"] = record.levelname
+
+        if non_str_keys is not None:
+            for key in non_str_keys:
+                value = record_dict[key]
+                if truncate is not None and type(value) not in _SCALAR_TYPES:
+                    value = truncate(value)
+                log_record[str(key)] = value
+
+        return log_record
+
+    def log_record_dict(self, record: logging.LogRecord) -> Dict[str, Any]:
+        """Return the dict that format serializes for this record.
+
+        Like the formatted output, the dict is kept with the record.
+        """
+        cached = self._get_cached(record)
+        if cached is not None and cached.log_record is not None:
+            log_record: Dict[str, Any] = cached.log_record
+        else:
+            log_record = self._build_log_record_dict(record)
+            if cached is not None:
+                cached.log_record = log_record
+            else:
+                self._set_cached(
+                    record, _FormattedRecord(self, None, log_record=log_record)
+                )
+        fragment = self._record_fragment(record)
+        if fragment is not None:
+            return self._with_fields(log_record, fragment[0])
+        return log_record
+
+    def _record_fragment(self, record: logging.LogRecord) -> Optional[Fragment]:
+        """Return the fields to add to a record, from its log_context and constant_fields."""
+        context = record_log_context(record)
+        if context is None:
+            return self._constant_fragment
+        return context.cached(self, self._make_fragment)
+
+    def _make_fragment(self, context_fields: Mapping[str, Any]) -> Fragment:
+        fields = dict(context_fields)
+        for key, value in self._constant_fields.items():
+            fields.setdefault(key, value)
+        if not fields:
+            return fields, "", b""
+        text = self.jsonify_log_record(fields)
+        # Members follow the fields of the record, so they start with a separator
+        members = self._member_separator + (
+            text[text.index("{") + 1 : text.rindex("}")].strip()
+        )
+        return fields, members, members.encode("utf-8")
+
+    @staticmethod
+    def _with_fields(
+        log_record: Dict[str, Any], fields: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Return the log record with the fields it does not have added at the end."""
+        merged = dict(log_record)
+        for key, value in fields.items():
+            merged.setdefault(key, value)
+        return merged
+
+    def _splice_fragment(
+        self, output: str, log_record: Dict[str, Any], fragment: Fragment
+    ) -> str:
+        """Add the serialized fields of a fragment to the serialized log record."""
+        fields, members, _encoded = fragment
+        if not log_record or not log_record.keys().isdisjoint(fields):
+            text: str = self.serialize_log_record(self._with_fields(log_record, fields))
+            return text
+        if self._compact_output:
+            return output[:-1] + members + "}"
+        end = len(output.rstrip()[:-1].rstrip())
+        return output[:end] + members + output[end:]
+
+    def _splice_fragment_bytes(
+        self, output: bytes, log_record: Dict[str, Any], fragment: Fragment
+    ) -> bytes:
+        fields, _text, members = fragment
+        if not log_record or not log_record.keys().isdisjoint(fields):
+            text: str = self.serialize_log_record(self._with_fields(log_record, fields))
+            return text.encode("utf-8")
+        if self._compact_output:
+            return output[:-1] + members + b"}"
+        end = len(output.rstrip()[:-1].rstrip())
+        return output[:end] + members + output[end:]
+
+    def _build_log_record_dict(self, record: logging.LogRecord) -> Dict[str, Any]:
+        if self._use_fast_path and not isinstance(record.msg, dict):
+            return self.make_log_record(record)
+
+        # Same steps as python-json-logger's format, without serializing
+        message_dict: Dict[str, Any] = {}
+        if isinstance(record.msg, dict):
+            message_dict = record.msg.copy()
+            record.message = ""
+        else:
+            record.message = record.getMessage()
+        if self._uses_asctime:
+            record.asctime = self.formatTime(record, self.datefmt)
+        if record.exc_info and not message_dict.get("exc_info"):
+            message_dict["exc_info"] = self.formatException(record.exc_info)
+        if not message_dict.get("exc_info") and record.exc_text:
+            message_dict["exc_info"] = record.exc_text
+        if record.stack_info and not message_dict.get("stack_info"):
+            message_dict["stack_info"] = self.formatStack(record.stack_info)
+
+        log_record: Dict[str, Any] = {}
+        self.add_fields(log_record, record, message_dict)
+        if self._truncate is not None:
+            self._truncate_extra_fields(log_record, record)
+        processed: Dict[str, Any] = self.process_log_record(log_record)
+        return processed
+
+    def _truncate_extra_fields(
+        self, log_record: Dict[str, Any], record: logging.LogRecord
+    ) -> None:
+        """Truncate the extra fields python-json-logger's add_fields added."""
+        assert self._truncate is not None
+        rename_fields = getattr(self, "rename_fields", None) or {}
+        for key in record.__dict__:
+            if key in self._skip_fields or (
+                isinstance(key, str) and key.startswith("_")
+            ):
+                continue
+            field = rename_fields.get(key, key)
+            value = log_record.get(field)
+            if type(value) not in _SCALAR_TYPES:
+                log_record[field] = self._truncate(value)
+
+    def jsonify_log_record(self, log_data: Dict[str, Any]) -> str:
+        if self._bytes_serializer is not None:
+            return self._bytes_serializer(log_data).decode("utf-8")
+        if self._json_encoder is not None:
+            return self._json_encoder.encode(log_data)
+        return super().jsonify_log_record(log_data)  # type: ignore
+
+    def _get_cached(self, record: logging.LogRecord) -> Optional[_FormattedRecord]:
+        """Return what this formatter made of the record, if the record didn't change since."""
+        cached: Optional[_FormattedRecord] = getattr(record, OUTPUT_ATTRIBUTE, None)
+        if cached is None or cached.formatter is not self:
+            return None
+        if cached.state is None:
+            # Not copied, since the formatter wasn't known to be shared. The
+            # record may have changed, so it is formatted again.
+            self.shared = True
+            return None
+        if _same_state(cached.state, _record_state(record)):
+            return cached
+        return None
+
+    def _set_cached(self, record: logging.LogRecord, cached: _FormattedRecord) -> None:
+        if self.shared:
+            # Taken once the record was formatted, which sets its message and asctime
+            cached.state = _record_state(record)
+        setattr(record, OUTPUT_ATTRIBUTE, cached)
+
+    def _cached_text(self, record: logging.LogRecord, cached: _FormattedRecord) -> str:
+        if cached.text is None:
+            if cached.data is not None:
+                cached.text = cached.data.decode("utf-8")
+            else:
+                log_record = cached.log_record
+                if log_record is None:
+                    log_record = cached.log_record = self._build_log_record_dict(record)
+                fragment = self._record_fragment(record)
+                if fragment is not None:
+                    log_record = self._with_fields(log_record, fragment[0])
+                cached.text = self.serialize_log_record(log_record)
+        return cached.text
+
+    def format(self, record: logging.LogRecord) -> str:
+        cached = self._get_cached(record)
+        if cached is not None:
+            return self._cached_text(record, cached)
+
+        log_record: Optional[Dict[str, Any]] = None
+        fragment = self._record_fragment(record)
+        if not self._use_fast_path or isinstance(record.msg, dict):
+            log_record = self._build_log_record_dict(record)
+            if fragment is None:
+                text: str = self.serialize_log_record(log_record)
+            else:
+                text = self.serialize_log_record(
+                    self._with_fields(log_record, fragment[0])
+                )
+        else:
+            log_record = self.make_log_record(record)
+            text = self.serialize_log_record(log_record)
+            if fragment is not None:
+                text = self._splice_fragment(text, log_record, fragment)
+        self._set_cached(record, _FormattedRecord(self, None, text, None, log_record))
+        return text
+
+    def format_bytes(self, record: logging.LogRecord) -> bytes:
+        """Format the record as UTF-8 encoded JSON.
+
+        With the orjson serializer, this avoids decoding orjson's output to a str.
+        """
+        cached = self._get_cached(record)
+        if cached is not None:
+            if cached.data is None:
+                cached.data = self._cached_text(record, cached).encode("utf-8")
+            return cached.data
 
-        return super().process_log_record(log_record)  # type: ignore
+        if (
+            self._bytes_serializer is None
+            or not self._use_fast_path
+            or isinstance(record.msg, dict)
+        ):
+            return self.format(record).encode("utf-8")
+        prefix: str = self.prefix
+        log_record = self.make_log_record(record)
+        data = prefix.encode("utf-8") + self._bytes_serializer(log_record)
+        fragment = self._record_fragment(record)
+        if fragment is not None:
+            data = self._splice_fragment_bytes(data, log_record, fragment)
+        self._set_cached(record, _FormattedRecord(self, None, None, data, log_record))
+        return data
@@ -0,0 +1,150 @@
+"""Structured context, such as request or site ids, added to every record logged in a scope.
+
+The context is stored in a contextvars.ContextVar, so each asyncio task and
+thread has its own, and tasks inherit the context of the code creating them.
+JsonFormatter adds the fields of the context to its output. It serializes the
+fields of each context once and splices them into the JSON of each record,
+instead of copying them into every record like extra= or a LoggerAdapter does.
+
+Records written later by another thread, such as by BackgroundQueueHandler,
+keep the context they were logged in.
+"""
+import asyncio
+import contextvars
+import logging
+from types import MappingProxyType, TracebackType
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Type,
+    TypeVar,
+)
+
+T = TypeVar("T")
+
+# The attribute holding the context of a record logged in another thread than
+# the one formatting it. JsonFormatter skips attributes starting with "_".
+RECORD_ATTRIBUTE = "_log_context"
+
+_NOT_ATTACHED: Any = object()
+
+
+class LogContext:
+    """Immutable fields added to the records logged in a scope.
+
+    Formatters cache what they make of the fields, such as the serialized
+    fields, with cached. This is only done once per context and formatter.
+    """
+
+    __slots__ = ("fields", "_cache")
+
+    def __init__(self, fields: Mapping[str, Any]) -> None:
+        self.fields: Mapping[str, Any] = MappingProxyType(dict(fields))
+        self._cache: Dict[Any, Any] = {}
+
+    def with_fields(self, fields: Mapping[str, Any]) -> "LogContext":
+        """Return a context with these fields added to or replacing this one's."""
+        return LogContext({**self.fields, **fields})
+
+    def cached(self, key: Any, build: Callable[[Mapping[str, Any]], T]) -> T:
+        """Return build(fields), only calling it the first time it is called with key."""
+        try:
+            value: T = self._cache[key]
+        except KeyError:
+            value = self._cache[key] = build(self.fields)
+        return value
+
+    def __repr__(self) -> str:
+        return f"LogContext({dict(self.fields)!r})"
+
+
+_current_context: "contextvars.ContextVar[Optional[LogContext]]" = (
+    contextvars.ContextVar("powerflex_log_context", default=None)
+)
+
+
+def current_log_context() -> Optional[LogContext]:
+    return _current_context.get()
+
+
+def get_log_context() -> Mapping[str, Any]:
+    """Return the fields of the current context."""
+    context = _current_context.get()
+    return context.fields if context is not None else MappingProxyType({})
+
+
+def bind_log_context(
+    **fields: Any,
+) -> "contextvars.Token[Optional[LogContext]]":
+    """Add fields to the context of the current task or thread.
+
+    Returns a token to pass to reset_log_context to remove them.
+    """
+    context = _current_context.get()
+    if context is None:
+        return _current_context.set(LogContext(fields))
+    return _current_context.set(context.with_fields(fields))
+
+
+def reset_log_context(token: "contextvars.Token[Optional[LogContext]]") -> None:
+    """Set the context back to what it was before bind_log_context returned the token."""
+    _current_context.reset(token)
+
+
+class log_context:  # pylint: disable=invalid-name
+    """Add fields to the records logged in a with block.
+
+    with log_context(request_id=request.id, site_id=site.id):
+        logger.info("Handling the request")
+    """
+
+    def __init__(self, **fields: Any) -> None:
+        self.fields = fields
+        self._tokens: List["contextvars.Token[Optional[LogContext]]"] = []
+
+    def __enter__(self) -> Mapping[str, Any]:
+        self._tokens.append(bind_log_context(**self.fields))
+        return get_log_context()
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        reset_log_context(self._tokens.pop())
+
+
+def create_task_with_log_context(
+    coroutine: Coroutine[Any, Any, T], **fields: Any
+) -> "asyncio.Task[T]":
+    """Run a coroutine in a task that logs with these fields added to the current context.
+
+    The context of the caller is not changed.
+    """
+    context = contextvars.copy_context()
+    context.run(bind_log_context, **fields)
+    # The task copies the context it is created in
+    return context.run(asyncio.ensure_future, coroutine)  # type: ignore
+
+
+def record_log_context(record: logging.LogRecord) -> Optional[LogContext]:
+    """Return the context a record was logged in.
+
+    This is the current context, unless attach_log_context was called when
+    the record was logged.
+    """
+    context: Optional[LogContext] = getattr(record, RECORD_ATTRIBUTE, _NOT_ATTACHED)
+    if context is _NOT_ATTACHED:
+        return _current_context.get()
+    return context
+
+
+def attach_log_context(record: logging.LogRecord) -> None:
+    """Keep the current context with a record that will be formatted later or in another thread."""
+    record.__dict__.setdefault(RECORD_ATTRIBUTE, _current_context.get())
@@ -0,0 +1,610 @@
+"""Index JSON log files by time, severity and logger, and query them without reading them whole.
+
+Each log file, or segment, gets a sidecar index file named after it with an
+.idx suffix, such as app.log.3.idx. The index is sparse: it splits the segment
+into blocks of about block_bytes bytes of whole lines, and keeps for each block
+the time range, severities and logger names of its records.
+A query only reads the blocks that can hold matching records, straight from a
+memory-mapped segment, and checks their lines one by one.
+
+The sidecar index is a JSON object:
+
+    {
+        "version": 1,
+        "block_bytes": 65536,
+        # Bytes at the start of the segment, and their SHA-1, to detect that
+        # the file was replaced, for example by a rotation renaming it
+        "fingerprint_bytes": 4096,
+        "fingerprint": "<sha1 hex digest>",
+        # Offset of the end of the last indexed line
+        "indexed_bytes": 1234567,
+        "blocks": [
+            {
+                "start": 0,
+                "end": 65530,
+                # Seconds since the epoch, from the asctime or created field,
+                # or null if no record has a time
+                "min_time": 1700000000.123,
+                "max_time": 1700000050.456,
+                # null for a segment read without an index
+                "severities": ["DEBUG", "INFO"],
+                # null when the block has more than MAX_BLOCK_NAMES loggers,
+                # or for a segment read without an index
+                "names": ["app", "app.db"]
+            }
+        ]
+    }
+
+Indexes are updated incrementally: the lines appended since the last update
+are indexed as new blocks, and an index whose fingerprint doesn't match its
+segment is rebuilt. Compressed .gz and .zst segments are indexed and queried
+by decompressing them, with offsets in the decompressed data.
+IndexedRotatingFileHandler, or init_loggers(index_files=True), indexes each
+file when it is rotated, so queries only index the current log file.
+
+Usage:
+
+    powerflex-logging-query logs/app.log --since "2024-05-01 10:00" --level WARNING
+    powerflex-logging-query logs/app.log --logger app.db --field request_id=a7c3e5d2
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import sys
+from typing import (
+    IO,
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+from powerflex_logging_utilities.rotating_file_handler import (
+    BackgroundRotatingFileHandler,
+    Compression,
+    open_rotated_file,
+)
+from powerflex_logging_utilities.trace_logger import level_number
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".idx"
+DEFAULT_BLOCK_BYTES = 64 * 1024
+FINGERPRINT_BYTES = 4096
+MAX_BLOCK_NAMES = 64
+
+_COMPRESSED_SUFFIXES = (".gz", ".zst")
+
+Timestamp = Union[float, str, datetime.datetime]
+
+
+def parse_timestamp(value: Any) -> Optional[float]:
+    """Return the seconds since the epoch of a created, asctime or ISO 8601 time.
+
+    Times without a time zone are in local time, like asctime.
+    Returns None if the value is not a time.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if not isinstance(value, str):
+        return None
+    if value.endswith("Z"):
+        # fromisoformat only accepts Z from Python 3.11
+        value = value[:-1] + "+00:00"
+    try:
+        # asctime separates milliseconds with a comma
+        return datetime.datetime.fromisoformat(value.replace(",", ".")).timestamp()
+    except ValueError:
+        return None
+
+
+def record_time(record: Mapping[str, Any]) -> Optional[float]:
+    """Return the time of a JSON log record, from its created or asctime field."""
+    created = record.get("created")
+    if created is not None:
+        return parse_timestamp(created)
+    asctime = record.get("asctime")
+    if isinstance(asctime, int) and not isinstance(asctime, bool):
+        # Written by JsonFormatter with time_format="epoch_ns"
+        return asctime / 1e9
+    return parse_timestamp(asctime)
+
+
+def _name_matches(name: Any, logger_names: Sequence[str]) -> bool:
+    """Return whether a logger is one of the logger_names or their descendants."""
+    if not isinstance(name, str):
+        return False
+    return any(
+        name == prefix or name.startswith(prefix + ".") for prefix in logger_names
+    )
+
+
+def find_segments(filename: str) -> List[str]:
+    """Return a log file and its rotated files, such as app.log.1 and app.log.2.gz.
+
+    The files are sorted by index. Whether the oldest file has the highest
+    index depends on the handler, so query_logs sorts segments by time.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    pattern = re.compile(
+        re.escape(os.path.basename(filename)) + r"\.(\d+)(\.gz|\.zst)?$"
+    )
+    rotated = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            match = pattern.match(name)
+            if match:
+                rotated.append((int(match.group(1)), os.path.join(directory, name)))
+    segments = [path for _index, path in sorted(rotated)]
+    if os.path.exists(filename):
+        segments.append(filename)
+    return segments
+
+
+def remove_stale_indexes(filename: str) -> List[str]:
+    """Delete the indexes of the rotated files of a log file that were deleted.
+
+    Returns the deleted index paths.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    pattern = re.compile(
+        re.escape(os.path.basename(filename))
+        + r"(\.\d+(\.gz|\.zst)?)?"
+        + re.escape(INDEX_SUFFIX)
+        + "$"
+    )
+    removed = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            index_path = os.path.join(directory, name)
+            if pattern.match(name) and not os.path.exists(
+                index_path[: -len(INDEX_SUFFIX)]
+            ):
+                os.remove(index_path)
+                removed.append(index_path)
+    return removed
+
+
+class _BlockBuilder:
+    def __init__(self, start: int) -> None:
+        self.start = start
+        self.end = start
+        self.min_time: Optional[float] = None
+        self.max_time: Optional[float] = None
+        self.severities: Set[str] = set()
+        self.names: Optional[Set[str]] = set()
+
+    def add(self, line: bytes, end: int) -> None:
+        self.end = end
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return
+        if not isinstance(record, dict):
+            return
+        time = record_time(record)
+        if time is not None:
+            if self.min_time is None or time < self.min_time:
+                self.min_time = time
+            if self.max_time is None or time > self.max_time:
+                self.max_time = time
+        severity = record.get("severity", record.get("levelname"))
+        if isinstance(severity, str):
+            self.severities.add(severity)
+        name = record.get("name")
+        if self.names is not None and isinstance(name, str):
+            self.names.add(name)
+            if len(self.names) > MAX_BLOCK_NAMES:
+                self.names = None
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "start": self.start,
+            "end": self.end,
+            "min_time": self.min_time,
+            "max_time": self.max_time,
+            "severities": sorted(self.severities),
+            "names": sorted(self.names) if self.names is not None else None,
+        }
+
+
+class SegmentIndex:
+    """The sidecar index of a log segment. See the module docstring for its format.
+
+    block_bytes - The size of the blocks of new indexes.
+    """
+
+    def __init__(self, path: str, block_bytes: int = DEFAULT_BLOCK_BYTES) -> None:
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.block_bytes = block_bytes
+        self.fingerprint_bytes = 0
+        self.fingerprint = ""
+        self.indexed_bytes = 0
+        self.blocks: List[Dict[str, Any]] = []
+
+    def load(self) -> bool:
+        """Read the sidecar index. Returns False if it is missing or invalid."""
+        try:
+            with open(self.index_path, encoding="utf-8") as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            return False
+        if not isinstance(index, dict) or index.get("version") != INDEX_VERSION:
+            return False
+        self.block_bytes = index["block_bytes"]
+        self.fingerprint_bytes = index["fingerprint_bytes"]
+        self.fingerprint = index["fingerprint"]
+        self.indexed_bytes = index["indexed_bytes"]
+        self.blocks = index["blocks"]
+        return True
+
+    def save(self) -> None:
+        temporary = self.index_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as index_file:
+            json.dump(
+                {
+                    "version": INDEX_VERSION,
+                    "block_bytes": self.block_bytes,
+                    "fingerprint_bytes": self.fingerprint_bytes,
+                    "fingerprint": self.fingerprint,
+                    "indexed_bytes": self.indexed_bytes,
+                    "blocks": self.blocks,
+                },
+                index_file,
+            )
+        os.replace(temporary, self.index_path)
+
+    def _read_fingerprint(self, size: int) -> str:
+        with open_rotated_file(self.path) as segment:
+            return hashlib.sha1(segment.read(size)).hexdigest()
+
+    def update(self) -> bool:
+        """Index the lines appended since the last update, or rebuild the index.
+
+        Returns whether the index changed.
+        """
+        compressed = self.path.endswith(_COMPRESSED_SUFFIXES)
+        loaded = self.load()
+        if loaded and (
+            (not compressed and os.path.getsize(self.path) < self.indexed_bytes)
+            or self._read_fingerprint(self.fingerprint_bytes) != self.fingerprint
+        ):
+            loaded = False
+        if not loaded:
+            self.indexed_bytes = 0
+            self.blocks = []
+        elif compressed:
+            # Compressed segments don't grow
+            return False
+
+        with open_rotated_file(self.path) as segment:
+            if self.indexed_bytes:
+                segment.seek(self.indexed_bytes)
+            new_blocks, indexed_bytes = self._index_lines(segment, self.indexed_bytes)
+        if not new_blocks and loaded:
+            return False
+        self.blocks.extend(new_blocks)
+        self.indexed_bytes = indexed_bytes
+        self.fingerprint_bytes = min(FINGERPRINT_BYTES, indexed_bytes)
+        self.fingerprint = self._read_fingerprint(self.fingerprint_bytes)
+        self.save()
+        return True
+
+    def _index_lines(
+        self, segment: IO[bytes], offset: int
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        blocks = []
+        block: Optional[_BlockBuilder] = None
+        for line in segment:
+            if not line.endswith(b"\n"):
+                # Being written. Index it with the next update.
+                break
+            if block is None:
+                block = _BlockBuilder(offset)
+            offset += len(line)
+            block.add(line, offset)
+            if offset - block.start >= self.block_bytes:
+                blocks.append(block.to_json())
+                block = None
+        if block is not None:
+            blocks.append(block.to_json())
+        return blocks, offset
+
+
+class IndexedRotatingFileHandler(BackgroundRotatingFileHandler):
+    """A BackgroundRotatingFileHandler that indexes each JSON log file when it is rotated.
+
+    block_bytes - The size of the blocks of the indexes.
+
+    Rotated files are indexed on the background thread, before they are
+    compressed, and the indexes of deleted rotated files are deleted. Queries
+    index the lines of the current log file as it grows.
+    See BackgroundRotatingFileHandler for the other arguments.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        filename: str,
+        max_bytes: int = 0,
+        interval_seconds: Optional[float] = None,
+        backup_count: int = 0,
+        compression: Optional[Compression] = None,
+        level: int = logging.NOTSET,
+        block_bytes: int = DEFAULT_BLOCK_BYTES,
+    ) -> None:
+        self.block_bytes = block_bytes
+        super().__init__(
+            filename,
+            max_bytes=max_bytes,
+            interval_seconds=interval_seconds,
+            backup_count=backup_count,
+            compression=compression,
+            level=level,
+        )
+
+    def process_rotated_file(self, path: str) -> str:
+        index = SegmentIndex(path, block_bytes=self.block_bytes)
+        index.update()
+        processed = super().process_rotated_file(path)
+        if processed != path:
+            # Offsets are in the decompressed data, so the index stays valid
+            os.replace(index.index_path, processed + INDEX_SUFFIX)
+        return processed
+
+    def _delete_old_segments(self) -> None:
+        super()._delete_old_segments()
+        remove_stale_indexes(self.filename)
+
+
+def _unindexed_block(path: str) -> Dict[str, Any]:
+    """Return a block holding a whole segment, which may hold any record."""
+    if path.endswith(_COMPRESSED_SUFFIXES):
+        # Decompressing streams can't seek from the end
+        with open_rotated_file(path) as segment:
+            end = sum(len(chunk) for chunk in iter(lambda: segment.read(1 << 20), b""))
+    else:
+        end = os.path.getsize(path)
+    return {
+        "start": 0,
+        "end": end,
+        "min_time": None,
+        "max_time": None,
+        "severities": None,
+        "names": None,
+    }
+
+
+def _block_matches(
+    block: Mapping[str, Any],
+    since: Optional[float],
+    until: Optional[float],
+    min_level: Optional[int],
+    logger_names: Optional[Sequence[str]],
+) -> bool:
+    min_time, max_time = block["min_time"], block["max_time"]
+    if since is not None and max_time is not None and max_time < since:
+        return False
+    if until is not None and min_time is not None and min_time > until:
+        return False
+    severities = block["severities"]
+    if min_level is not None and severities is not None:
+        levels = [logging.getLevelName(severity) for severity in severities]
+        if not any(isinstance(level, int) and level >= min_level for level in levels):
+            return False
+    names = block["names"]
+    if logger_names is not None and names is not None:
+        return any(_name_matches(name, logger_names) for name in names)
+    return True
+
+
+def _record_matches(  # pylint: disable=too-many-arguments
+    record: Mapping[str, Any],
+    since: Optional[float],
+    until: Optional[float],
+    min_level: Optional[int],
+    logger_names: Optional[Sequence[str]],
+    fields: Mapping[str, Any],
+) -> bool:
+    if since is not None or until is not None:
+        time = record_time(record)
+        if time is None:
+            return False
+        if (since is not None and time < since) or (until is not None and time > until):
+            return False
+    if min_level is not None:
+        severity = record.get("severity", record.get("levelname"))
+        level = logging.getLevelName(severity) if isinstance(severity, str) else None
+        if not isinstance(level, int) or level < min_level:
+            return False
+    if logger_names is not None and not _name_matches(record.get("name"), logger_names):
+        return False
+    return all(record.get(key) == value for key, value in fields.items())
+
+
+def _read_blocks(path: str, blocks: Iterable[Mapping[str, Any]]) -> Iterator[bytes]:
+    """Yield the lines of the blocks of a segment."""
+    if path.endswith(_COMPRESSED_SUFFIXES):
+        with open_rotated_file(path) as segment:
+            # Decompressed files can't seek, but blocks are in order
+            position = 0
+            for block in blocks:
+                while position < block["start"]:
+                    skipped = segment.read(min(block["start"] - position, 1 << 20))
+                    if not skipped:
+                        return
+                    position += len(skipped)
+                data = segment.read(block["end"] - block["start"])
+                position += len(data)
+                yield from data.splitlines()
+        return
+
+    with open(path, "rb") as segment:
+        if os.fstat(segment.fileno()).st_size == 0:
+            return
+        with mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for block in blocks:
+                yield from mapped[block["start"] : block["end"]].splitlines()
+
+
+def query_logs(  # pylint: disable=too-many-arguments,too-many-locals
+    paths: Iterable[str],
+    since: Optional[Timestamp] = None,
+    until: Optional[Timestamp] = None,
+    level: Optional[Union[str, int]] = None,
+    logger_names: Optional[Sequence[str]] = None,
+    fields: Optional[Mapping[str, Any]] = None,
+    update_index: bool = True,
+    block_bytes: int = DEFAULT_BLOCK_BYTES,
+) -> Iterator[bytes]:
+    """Yield the JSON lines of the segments matching a query, oldest segment first.
+
+    since, until - Only records logged in this time range, including its bounds.
+        A number of seconds since the epoch, a datetime, or an asctime or
+        ISO 8601 string.
+
+    level - Only records at or above this level.
+
+    logger_names - Only records of these loggers and their descendants.
+
+    fields - Only records whose fields have these values.
+
+    update_index - Update the index of each segment before reading it.
+        Otherwise, segments without an index are read whole.
+    """
+    since_time = parse_timestamp(since) if since is not None else None
+    until_time = parse_timestamp(until) if until is not None else None
+    if (since is not None and since_time is None) or (
+        until is not None and until_time is None
+    ):
+        raise ValueError("since and until must be times")
+    min_level = level_number(level) if level is not None else None
+    fields = fields or {}
+    # ASCII letters and digits are never escaped, so such field values appear
+    # as they are in matching lines. Other characters may be written escaped.
+    needles = [
+        json.dumps(value).encode("ascii")
+        for value in fields.values()
+        if isinstance(value, str) and value.isascii() and value.isalnum()
+    ]
+
+    indexes = []
+    for path in paths:
+        index = SegmentIndex(path, block_bytes=block_bytes)
+        if update_index:
+            index.update()
+        elif not index.load():
+            index.blocks = [_unindexed_block(path)]
+        indexes.append(index)
+
+    def first_time(index: SegmentIndex) -> float:
+        times = [block["min_time"] for block in index.blocks if block["min_time"]]
+        return min(times) if times else 0.0
+
+    for index in sorted(indexes, key=first_time):
+        blocks = [
+            block
+            for block in index.blocks
+            if _block_matches(block, since_time, until_time, min_level, logger_names)
+        ]
+        for line in _read_blocks(index.path, blocks):
+            if any(needle not in line for needle in needles):
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and _record_matches(
+                record, since_time, until_time, min_level, logger_names, fields
+            ):
+                yield line
+
+
+def _parse_field(text: str) -> Tuple[str, Any]:
+    key, separator, value = text.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError(f"expected KEY=VALUE, not {text!r}")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="powerflex-logging-query",
+        description="Query JSON log files and their rotated files, using sidecar indexes.",
+    )
+    parser.add_argument(
+        "filenames",
+        nargs="+",
+        help="Log files. Their rotated files, such as app.log.1, are also queried.",
+    )
+    parser.add_argument("--since", help="Start time, such as 2024-05-01 10:00:00")
+    parser.add_argument("--until", help="End time, such as 2024-05-01T11:00:00+00:00")
+    parser.add_argument("--level", help="Minimum severity, such as WARNING")
+    parser.add_argument(
+        "--logger",
+        action="append",
+        help="Logger name. Also matches its descendants. Can be repeated.",
+    )
+    parser.add_argument(
+        "--field",
+        action="append",
+        type=_parse_field,
+        default=[],
+        help="KEY=VALUE that records must have. VALUE is parsed as JSON if it can be.",
+    )
+    parser.add_argument(
+        "--index-only",
+        action="store_true",
+        help="Update the indexes without querying",
+    )
+    parser.add_argument("--block-bytes", type=int, default=DEFAULT_BLOCK_BYTES)
+    args = parser.parse_args(argv)
+
+    segments = [
+        segment for filename in args.filenames for segment in find_segments(filename)
+    ]
+    try:
+        for filename in args.filenames:
+            remove_stale_indexes(filename)
+        if args.index_only:
+            for segment in segments:
+                SegmentIndex(segment, block_bytes=args.block_bytes).update()
+            return 0
+        output = sys.stdout.buffer
+        for line in query_logs(
+            segments,
+            since=args.since,
+            until=args.until,
+            level=args.level,
+            logger_names=args.logger,
+            fields=dict(args.field),
+            block_bytes=args.block_bytes,
+        ):
+            output.write(line + b"\n")
+        output.flush()
+    except (OSError, ValueError) as error:
+        print(f"powerflex-logging-query: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
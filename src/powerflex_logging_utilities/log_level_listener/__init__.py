@@ -1,7 +1,10 @@
+import heapq
+import itertools
 import json
-from asyncio import ensure_future, sleep
+import logging
+from asyncio import AbstractEventLoop, TimerHandle, get_running_loop, sleep
 from logging import Handler, Logger
-from typing import Literal, Union
+from typing import Any, Dict, Iterable, List, Literal, Optional, Sequence, Tuple, Union
 
 from pydantic import BaseModel, Field
 
@@ -11,8 +14,54 @@ except ImportError:
     # pylint: disable=ungrouped-imports
     from pydantic import BaseSettings  # type: ignore
 
+from powerflex_logging_utilities.log_level_listener.logger_levels import (
+    LoggerIndex,
+    LoggerLevelFilter,
+)
+from powerflex_logging_utilities.log_stats import (
+    LogStats,
+    find_dropped_counts,
+    get_effective_levels,
+)
+from powerflex_logging_utilities.trace_logger import level_number
+
 DEFAULT_DURATION_SECONDS = 60
 
+# Deadline, sequence number, and logger pattern or None for the stdout handler
+_Reset = Tuple[float, int, Optional[str]]
+
+
+def _find_stdout_handler(handlers: Iterable[Handler]) -> Optional[Handler]:
+    for handler in handlers:
+        if handler.get_name() == "stdout":
+            return handler
+        # Also look for the stdout handler behind handlers that wrap other
+        # handlers, such as BackgroundQueueHandler
+        wrapped = _find_stdout_handler(getattr(handler, "handlers", []))
+        if wrapped is not None:
+            return wrapped
+    return None
+
+
+def _find_logger_level_filter(handler: Handler) -> Optional[LoggerLevelFilter]:
+    for handler_filter in handler.filters:
+        if isinstance(handler_filter, LoggerLevelFilter):
+            return handler_filter
+    return None
+
+
+def _set_handler_or_logger_level(
+    handler_or_logger: Union[Handler, Logger], level: Union[str, int]
+) -> None:
+    if isinstance(handler_or_logger, Handler):
+        level_filter = _find_logger_level_filter(handler_or_logger)
+        if level_filter is not None:
+            # Keep the levels of the targeted loggers
+            level_filter.set_default_level(level_number(level))
+            handler_or_logger.setLevel(level_filter.min_level)
+            return
+    handler_or_logger.setLevel(level)
+
 
 class LogLevelListenerConfig(BaseSettings):  # type: ignore
     """Pydantic settings object to configure a log level listener."""
@@ -35,28 +84,70 @@ class LogLevelRequestMessage(BaseModel):
         default=DEFAULT_DURATION_SECONDS,
         ge=0,
     )
+    loggers: Optional[List[str]] = Field(
+        description="only change the log level of these loggers and their descendants; "
+        "names such as app.db or app.db.*, or patterns with wildcards such as app.*.sql",
+        default=None,
+    )
 
 
 class BaseAsyncLogLevelListener:
     """
     Log level listener that changes the log level of the logging handler with name="stdout".
 
+    The stdout handler may also be one of the handlers wrapped by a BackgroundQueueHandler
+    or a FlightRecorderHandler.
+
     Changes the log level of the stdout logging handler (or the logger itself if no stdout logging
     handler is found) for a specified duration. These parameters are provided via a LogLevelRequestMessage.
+
+    If the request lists loggers, only the levels of the matching loggers are changed.
+    A LoggerLevelFilter is added to the stdout handler, so that the records of the
+    other loggers are still filtered at the previous level of the handler.
+
+    Resets are scheduled on a single timer of the async loop, with one deadline
+    for the stdout handler and one for each logger pattern. A newer request for
+    the same target replaces the pending reset. Call close() to cancel the pending resets.
+    Requests with a duration made outside the loop, such as from another thread,
+    are scheduled on the last loop the listener ran on.
+
+    log_stats - The LogStats counted by a LogStatsFilter, returned by get_log_stats.
     """
 
     logger: Logger
     config: LogLevelListenerConfig
+    log_stats: Optional[LogStats]
 
-    def __init__(self, logger: Logger, config: LogLevelListenerConfig):
+    def __init__(
+        self,
+        logger: Logger,
+        config: LogLevelListenerConfig,
+        log_stats: Optional[LogStats] = None,
+    ):
         self.logger = logger
         self.config = config
+        self.log_stats = log_stats
+        self.logger_index = LoggerIndex()
+        self._stdout_handler_cache: Tuple[
+            Tuple[Handler, ...], Union[Handler, Logger, None]
+        ] = ((), None)
+        # A heap of (deadline, sequence number, target) with replaced resets
+        # left in place, and the pending reset of each target. The target is a
+        # logger pattern, or None for the stdout handler.
+        self._reset_heap: List[_Reset] = []
+        self._pending_resets: Dict[Optional[str], _Reset] = {}
+        self._reset_sequence = itertools.count()
+        self._reset_timer: Optional[TimerHandle] = None
+        # The loop the resets are scheduled on
+        self._loop: Optional[AbstractEventLoop] = None
 
     def _get_stdout_handler_or_logger(self) -> Union[Handler, Logger]:
-        for handler in self.logger.handlers:
-            if handler.get_name() == "stdout":
-                return handler
-        return self.logger
+        handlers = tuple(self.logger.handlers)
+        cached_handlers, handler_or_logger = self._stdout_handler_cache
+        if handler_or_logger is None or handlers != cached_handlers:
+            handler_or_logger = _find_stdout_handler(handlers) or self.logger
+            self._stdout_handler_cache = (handlers, handler_or_logger)
+        return handler_or_logger
 
     async def reset_log_level(
         self,
@@ -64,33 +155,215 @@ class BaseAsyncLogLevelListener:
         level: Union[str, int],
         delay: float,
     ) -> None:
-        """Reset the log level after a certain delay."""
+        """Reset the log level after a certain delay.
+
+        set_log_level doesn't use this: it schedules resets on the listener's timer.
+        """
         await sleep(delay)
         self.logger.info(f"Resetting log level to {level}")
-        handler_or_logger.setLevel(level)
+        _set_handler_or_logger_level(handler_or_logger, level)
 
     def set_log_level(
-        self, level: str, duration: float = DEFAULT_DURATION_SECONDS
+        self,
+        level: str,
+        duration: float = DEFAULT_DURATION_SECONDS,
+        loggers: Optional[Sequence[str]] = None,
     ) -> None:
-        """Set the log level and starts and async task to reset it later."""
+        """Set the log level and schedule a reset later, replacing the pending reset.
+
+        loggers - Only set the level of the loggers matching these names or patterns.
+
+        With a duration, raises a RuntimeError without changing the level if
+        there is no running loop and the listener never ran on one.
+        """
+        if loggers:
+            self.set_logger_levels(level, loggers, duration)
+            return
+        loop = self._get_loop(duration)
         self.logger.info(f"Setting log level to {level}")
         handler_or_logger = self._get_stdout_handler_or_logger()
-        handler_or_logger.setLevel(level)
+        _set_handler_or_logger_level(handler_or_logger, level)
 
         if duration > 0:
             self.logger.info(f"Log level will be reset in {duration} seconds")
-            ensure_future(
-                self.reset_log_level(
-                    handler_or_logger, self.config.FALLBACK_LOG_LEVEL, duration
-                )
-            )
         else:
             self.logger.warning("Log level will not be automatically reset")
+        self._schedule_resets([None], duration, loop)
+
+    def set_logger_levels(
+        self,
+        level: str,
+        loggers: Sequence[str],
+        duration: float = DEFAULT_DURATION_SECONDS,
+    ) -> None:
+        """Set the level of the loggers matching the patterns, and let their records through the stdout handler.
+
+        All the loggers are changed in one batch, clearing the cached levels of
+        the loggers once. When several pending patterns match a logger, the
+        longest pattern wins. When the reset of a pattern is due, each logger it
+        matched gets the level of the patterns still pending for it, or the
+        level it had before the first of the pending requests.
+        Only existing loggers are changed.
+        Raises a RuntimeError like set_log_level.
+        """
+        loop = self._get_loop(duration)
+        self.logger.info(
+            f"Setting log level of loggers {', '.join(loggers)} to {level}"
+        )
+        number = level_number(level)
+        handler_or_logger = self._get_stdout_handler_or_logger()
+        if isinstance(handler_or_logger, Handler):
+            level_filter = _find_logger_level_filter(handler_or_logger)
+            if level_filter is None:
+                level_filter = LoggerLevelFilter(handler_or_logger.level)
+                handler_or_logger.addFilter(level_filter)
+            level_filter.set_levels({pattern: number for pattern in loggers})
+            handler_or_logger.setLevel(level_filter.min_level)
+        self.logger_index.set_levels(loggers, number)
+        if duration <= 0:
+            self.logger_index.forget_levels(loggers)
+
+        if duration > 0:
+            self.logger.info(f"Log level will be reset in {duration} seconds")
+        else:
+            self.logger.warning("Log level will not be automatically reset")
+        self._schedule_resets(loggers, duration, loop)
+
+    def _get_loop(self, duration: float) -> Optional[AbstractEventLoop]:
+        """Return the loop to schedule a reset after duration on, or None if there is no reset."""
+        if duration <= 0:
+            return None
+        try:
+            self._loop = get_running_loop()
+        except RuntimeError:
+            if self._loop is None or self._loop.is_closed():
+                raise RuntimeError(
+                    "Resetting the log level requires a running event loop"
+                ) from None
+        return self._loop
+
+    def _schedule_resets(
+        self,
+        targets: Sequence[Optional[str]],
+        duration: float,
+        loop: Optional[AbstractEventLoop],
+    ) -> None:
+        if loop is None:
+            for target in targets:
+                self._pending_resets.pop(target, None)
+            return
+        try:
+            running_loop: Optional[AbstractEventLoop] = get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is not loop:
+            # The timer belongs to the loop's thread
+            loop.call_soon_threadsafe(
+                self._schedule_resets, list(targets), duration, loop
+            )
+            return
+        deadline = loop.time() + duration
+        for target in targets:
+            reset = (deadline, next(self._reset_sequence), target)
+            self._pending_resets[target] = reset
+            heapq.heappush(self._reset_heap, reset)
+        if len(self._reset_heap) > 2 * len(self._pending_resets) + 16:
+            # Forget the replaced resets
+            self._reset_heap = list(self._pending_resets.values())
+            heapq.heapify(self._reset_heap)
+        self._schedule_timer(loop)
+
+    def _schedule_timer(self, loop: AbstractEventLoop) -> None:
+        heap = self._reset_heap
+        while heap and self._pending_resets.get(heap[0][2]) is not heap[0]:
+            heapq.heappop(heap)
+        if not heap:
+            if self._reset_timer is not None:
+                self._reset_timer.cancel()
+                self._reset_timer = None
+            return
+        deadline = heap[0][0]
+        if self._reset_timer is not None:
+            if self._reset_timer.when() == deadline:
+                return
+            self._reset_timer.cancel()
+        self._reset_timer = loop.call_at(deadline, self._run_due_resets, loop)
+
+    def _run_due_resets(self, loop: AbstractEventLoop) -> None:
+        self._reset_timer = None
+        now = loop.time()
+        due: List[Optional[str]] = []
+        while self._reset_heap and self._reset_heap[0][0] <= now:
+            reset = heapq.heappop(self._reset_heap)
+            target = reset[2]
+            if self._pending_resets.get(target) is reset:
+                del self._pending_resets[target]
+                due.append(target)
+        try:
+            self._reset(due)
+        finally:
+            self._schedule_timer(loop)
+
+    def _reset(self, targets: Sequence[Optional[str]]) -> None:
+        handler_or_logger = self._get_stdout_handler_or_logger()
+        if None in targets:
+            level = self.config.FALLBACK_LOG_LEVEL
+            self.logger.info(f"Resetting log level to {level}")
+            _set_handler_or_logger_level(handler_or_logger, level)
+
+        patterns = [target for target in targets if target is not None]
+        if not patterns:
+            return
+        self.logger.info(f"Resetting log level of loggers {', '.join(patterns)}")
+        self.logger_index.reset_levels(patterns)
+        if isinstance(handler_or_logger, Handler):
+            level_filter = _find_logger_level_filter(handler_or_logger)
+            if level_filter is not None:
+                level_filter.remove_levels(patterns)
+                handler_or_logger.setLevel(level_filter.min_level)
+
+    def get_log_stats(self) -> Dict[str, Any]:
+        """Return the log counters and levels as a JSON serializable dictionary.
+
+        records, bytes and records_per_second - The counters of log_stats, if any.
+
+        levels - The effective level of the listener's logger and of the counted loggers.
+
+        stdout_handler_level - The level of the stdout handler, if any.
+
+        dropped - The records dropped by the queues, samplers and rate limiters
+            of the listener's logger.
+        """
+        stats = self.log_stats.snapshot() if self.log_stats is not None else {}
+        names = {self.logger.name, *stats.get("records", {})}
+        stats["levels"] = get_effective_levels(sorted(names))
+        handler_or_logger = self._get_stdout_handler_or_logger()
+        if isinstance(handler_or_logger, Handler):
+            stats["stdout_handler_level"] = logging.getLevelName(
+                handler_or_logger.level
+            )
+        stats["dropped"] = find_dropped_counts(
+            self.logger.handlers, self.logger.filters
+        )
+        return stats
+
+    def close(self) -> None:
+        """Cancel the pending resets, leaving the current log levels as they are."""
+        if self._reset_timer is not None:
+            self._reset_timer.cancel()
+            self._reset_timer = None
+        self.logger_index.forget_levels(
+            [target for target in self._pending_resets if target is not None]
+        )
+        self._reset_heap = []
+        self._pending_resets = {}
 
     async def handle_log_level_change_message(
         self, json_message: Union[str, bytes]
     ) -> LogLevelRequestMessage:
         body = json.loads(json_message)
         request = LogLevelRequestMessage(**body)
-        self.set_log_level(level=request.level, duration=request.duration)
+        self.set_log_level(
+            level=request.level, duration=request.duration, loggers=request.loggers
+        )
         return request
@@ -0,0 +1,197 @@
+"""Change the log level of the loggers matching name patterns, such as app.db or app.*.sql."""
+import logging
+import re
+from bisect import bisect_left
+from fnmatch import fnmatchcase
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+_WILDCARD_PATTERN = re.compile(r"[*?\[]")
+
+
+def split_logger_pattern(pattern: str) -> Tuple[str, Optional[str]]:
+    """Return the literal prefix of a logger name pattern, and the glob it must match.
+
+    A name without wildcards, or ending with ".*", matches that logger and its
+    descendants, so the glob is None. Other patterns are matched with fnmatch.
+    """
+    if pattern.endswith(".*"):
+        pattern = pattern[:-2]
+    wildcard = _WILDCARD_PATTERN.search(pattern)
+    if wildcard is None:
+        return pattern, None
+    return pattern[: wildcard.start()], pattern
+
+
+def logger_name_matches(name: str, pattern: str) -> bool:
+    prefix, glob = split_logger_pattern(pattern)
+    if glob is not None:
+        return fnmatchcase(name, glob)
+    return name == prefix or name.startswith(prefix + ".")
+
+
+class LoggerIndex:
+    """A sorted index of the names of the loggers, to find the loggers matching a pattern.
+
+    Finding the loggers under a prefix is a binary search, so it stays fast with
+    thousands of loggers. The index is rebuilt when loggers are added.
+    set_levels and reset_levels change the levels of the matching loggers.
+    """
+
+    def __init__(self, manager: Optional[logging.Manager] = None) -> None:
+        self.manager = manager or logging.Logger.manager
+        self._names: List[str] = []
+        self._indexed_count = -1
+        # The level set by each pattern, the patterns that set the level of
+        # each logger, most recent last, and the level of each logger before
+        # the first of them
+        self._pattern_levels: Dict[str, int] = {}
+        self._logger_patterns: Dict[logging.Logger, List[str]] = {}
+        self._original_levels: Dict[logging.Logger, int] = {}
+
+    def _sorted_names(self) -> List[str]:
+        logger_dict = self.manager.loggerDict
+        if len(logger_dict) != self._indexed_count:
+            self._names = sorted(logger_dict)
+            self._indexed_count = len(self._names)
+        return self._names
+
+    def find(self, pattern: str) -> List[logging.Logger]:
+        """Return the existing loggers matching the pattern."""
+        prefix, _glob = split_logger_pattern(pattern)
+        names = self._sorted_names()
+        loggers = []
+        for index in range(bisect_left(names, prefix), len(names)):
+            name = names[index]
+            if not name.startswith(prefix):
+                break
+            logger = self.manager.loggerDict.get(name)
+            # Skip the placeholders of loggers that were never created
+            if isinstance(logger, logging.Logger) and logger_name_matches(
+                name, pattern
+            ):
+                loggers.append(logger)
+        return loggers
+
+    def set_levels(self, patterns: Iterable[str], level: int) -> None:
+        """Set the level of the existing loggers matching the patterns, until reset_levels.
+
+        Loggers are not created to match a pattern: a logger created later
+        keeps its own level.
+        Each logger remembers the patterns that set its level, most recent last,
+        and the level it had before the first of them. When several patterns
+        match a logger, the longest pattern wins, like in LoggerLevelFilter,
+        then the most recent one.
+        The levels cached by loggers are cleared once, instead of once per logger.
+        """
+        for pattern in patterns:
+            self._pattern_levels[pattern] = level
+            for logger in self.find(pattern):
+                logger_patterns = self._logger_patterns.setdefault(logger, [])
+                if not logger_patterns:
+                    self._original_levels[logger] = logger.level
+                elif pattern in logger_patterns:
+                    logger_patterns.remove(pattern)
+                logger_patterns.append(pattern)
+                logger.level = self._pattern_level(logger_patterns)
+        self.clear_cache()
+
+    def reset_levels(self, patterns: Iterable[str]) -> None:
+        """Undo set_levels for the patterns.
+
+        Each logger they matched gets the level of the patterns that still apply
+        to it, or the level it had before the first pattern.
+        """
+        self._forget_patterns(patterns, restore=True)
+
+    def forget_levels(self, patterns: Iterable[str]) -> None:
+        """Keep the levels set for the patterns, so that no reset changes them back.
+
+        The loggers matched by the most recent of the patterns forget the
+        patterns that set their level before.
+        """
+        self._forget_patterns(patterns, restore=False)
+
+    def _pattern_level(self, patterns: List[str]) -> int:
+        return self._pattern_levels[max(reversed(patterns), key=len)]
+
+    def _forget_patterns(self, patterns: Iterable[str], restore: bool) -> None:
+        forgotten = set(patterns)
+        for pattern in forgotten:
+            self._pattern_levels.pop(pattern, None)
+        for logger, logger_patterns in list(self._logger_patterns.items()):
+            remaining = [
+                pattern for pattern in logger_patterns if pattern not in forgotten
+            ]
+            if len(remaining) == len(logger_patterns):
+                continue
+            if not restore and logger_patterns[-1] in forgotten:
+                remaining = []
+            if remaining:
+                self._logger_patterns[logger] = remaining
+                if restore:
+                    logger.level = self._pattern_level(remaining)
+            else:
+                del self._logger_patterns[logger]
+                original_level = self._original_levels.pop(logger)
+                if restore:
+                    logger.level = original_level
+        self.clear_cache()
+
+    def clear_cache(self) -> None:
+        # Logger.setLevel does this after every change
+        self.manager._clear_cache()  # type: ignore # pylint: disable=protected-access
+
+
+class LoggerLevelFilter(logging.Filter):
+    """Filter the records of a handler with a different level for some loggers.
+
+    default_level - The level of records from loggers that don't match any pattern.
+
+    Set the level of the handler to min_level, so that the records of the
+    loggers with a lower level reach this filter.
+    The level of each logger name is cached, so filtering is a dictionary lookup.
+    When several patterns match a logger, the longest pattern wins.
+    """
+
+    def __init__(self, default_level: int) -> None:
+        super().__init__()
+        self.default_level = default_level
+        self.levels: Dict[str, int] = {}
+        self._cache: Dict[str, int] = {}
+
+    @property
+    def min_level(self) -> int:
+        return min([self.default_level, *self.levels.values()])
+
+    def set_default_level(self, level: int) -> None:
+        self.default_level = level
+        self._cache = {}
+
+    def set_levels(self, levels: Mapping[str, int]) -> None:
+        """Set the level of the loggers matching each pattern."""
+        self.levels = {**self.levels, **levels}
+        self._cache = {}
+
+    def remove_levels(self, patterns: Iterable[str]) -> None:
+        removed = set(patterns)
+        self.levels = {
+            pattern: level
+            for pattern, level in self.levels.items()
+            if pattern not in removed
+        }
+        self._cache = {}
+
+    def get_level(self, name: str) -> int:
+        level = self._cache.get(name)
+        if level is None:
+            matching = [
+                pattern for pattern in self.levels if logger_name_matches(name, pattern)
+            ]
+            level = (
+                self.levels[max(matching, key=len)] if matching else self.default_level
+            )
+            self._cache[name] = level
+        return level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= self.get_level(record.name)
@@ -1,4 +1,6 @@
 import json
+import logging
+from asyncio import get_running_loop
 from json import JSONDecodeError
 from logging import Logger
 from typing import Optional
@@ -14,6 +16,7 @@ from powerflex_logging_utilities.log_level_listener import (
 from powerflex_logging_utilities.log_level_listener.format_exception import (
     format_exception,
 )
+from powerflex_logging_utilities.log_stats import LogStats
 
 
 class NatsLogLevelListenerConfig(LogLevelListenerConfig):
@@ -22,6 +25,10 @@ class NatsLogLevelListenerConfig(LogLevelListenerConfig):
     NATS_LOG_LEVEL_LISTENER_SUBJECT: str = Field(
         description="NATS subject that will receive LogLevelRequestMessage messages"
     )
+    NATS_LOG_STATS_SUBJECT: Optional[str] = Field(
+        description="NATS subject that will receive requests for the log counters and levels",
+        default=None,
+    )
 
 
 class AsyncNatsLogLevelListener(BaseAsyncLogLevelListener):
@@ -30,6 +37,9 @@ class AsyncNatsLogLevelListener(BaseAsyncLogLevelListener):
 
     Changes the log level of the stdout logging handler (or the logger itself if no stdout logging
     handler is found) for a specified duration. These parameters are provided via a LogLevelRequestMessage.
+
+    If NATS_LOG_STATS_SUBJECT is set, requests to that subject get the JSON
+    result of get_log_stats as a reply, or {"error": ...} if it fails.
     """
 
     nats_client: NATSClient
@@ -41,11 +51,14 @@ class AsyncNatsLogLevelListener(BaseAsyncLogLevelListener):
         nats_client: NATSClient,
         logger: Logger,
         config: NatsLogLevelListenerConfig,
+        log_stats: Optional[LogStats] = None,
     ):
         self.nats_client = nats_client
-        super().__init__(logger, config)
+        super().__init__(logger, config, log_stats)
 
     async def async_init(self) -> None:
+        # Requests made from other threads schedule their resets on this loop
+        self._loop = get_running_loop()
         self.logger.info(
             "Log Level Listener subscribing to subject %s",
             self.config.NATS_LOG_LEVEL_LISTENER_SUBJECT,
@@ -54,23 +67,37 @@ class AsyncNatsLogLevelListener(BaseAsyncLogLevelListener):
             subject=self.config.NATS_LOG_LEVEL_LISTENER_SUBJECT,
             cb=self.handle_log_level_change_nats_message,
         )
+        if self.config.NATS_LOG_STATS_SUBJECT:
+            self.logger.info(
+                "Log Level Listener subscribing to log stats subject %s",
+                self.config.NATS_LOG_STATS_SUBJECT,
+            )
+            await self.nats_client.subscribe(
+                subject=self.config.NATS_LOG_STATS_SUBJECT,
+                cb=self.handle_log_stats_nats_message,
+            )
 
     @staticmethod
     async def create(
         nats_client: NATSClient,
         logger: Logger,
         config: Optional[NatsLogLevelListenerConfig] = None,
+        log_stats: Optional[LogStats] = None,
     ) -> "AsyncNatsLogLevelListener":
         if config is None:
             config = NatsLogLevelListenerConfig(
                 # type: ignore
             )
         log_level_listener = AsyncNatsLogLevelListener(
-            nats_client=nats_client, logger=logger, config=config
-        )
-        logger.info(
-            f"Log Level Listener initialized with config {config}", extra=config.dict()
+            nats_client=nats_client, logger=logger, config=config, log_stats=log_stats
         )
+        if logger.isEnabledFor(logging.INFO):
+            # Only build the config's dict if the record can be logged
+            logger.info(
+                "Log Level Listener initialized with config %s",
+                config,
+                extra=config.dict(),
+            )
         await log_level_listener.async_init()
         return log_level_listener
 
@@ -78,7 +105,10 @@ class AsyncNatsLogLevelListener(BaseAsyncLogLevelListener):
         try:
             request = await self.handle_log_level_change_message(msg.data)
             if msg.reply:
-                response = {"result": f"Log level set to {request.level}"}
+                result = f"Log level set to {request.level}"
+                if request.loggers:
+                    result += f" for loggers {', '.join(request.loggers)}"
+                response = {"result": result}
                 await self.nats_client.publish(msg.reply, json.dumps(response).encode())
         except ValidationError as ex:
             if msg.reply:
@@ -88,3 +118,20 @@ class AsyncNatsLogLevelListener(BaseAsyncLogLevelListener):
             if msg.reply:
                 response = {"error": "Error when parsing JSON\n" + format_exception(ex)}
                 await self.nats_client.publish(msg.reply, json.dumps(response).encode())
+
+    async def handle_log_stats_nats_message(self, msg: Msg) -> None:
+        """Reply with the log stats, or with an error if they can't be computed.
+
+        Errors while publishing the reply are logged, as the requester only
+        sees a timeout.
+        """
+        if not msg.reply:
+            return
+        try:
+            response = self.get_log_stats()
+        except Exception as ex:  # pylint: disable=broad-except
+            response = {"error": format_exception(ex)}
+        try:
+            await self.nats_client.publish(msg.reply, json.dumps(response).encode())
+        except Exception:  # pylint: disable=broad-except
+            self.logger.warning("Could not reply to a log stats request", exc_info=True)
@@ -1,14 +1,151 @@
+import asyncio
+import os
+import re
+import time
 from logging import INFO, WARN, Logger
+from typing import Any, Dict, List, Optional, Tuple
 
 # For some reason, mypy doesn't detect this package's type hints
 import aiodebug.log_slow_callbacks  # type: ignore
 
+from powerflex_logging_utilities.histogram import Histogram
+from powerflex_logging_utilities.stack_sampler import (
+    DEFAULT_MAX_SAMPLES,
+    DEFAULT_SAMPLE_INTERVAL_SEC,
+    StackSampler,
+)
+
+DEFAULT_TOP_N = 10
+DEFAULT_MAX_CALLBACK_NAMES = 1000
+
+DEFAULT_HEARTBEAT_INTERVAL_SEC = 0.1
+DEFAULT_LAG_THRESHOLD_SEC = 0.25
+DEFAULT_LAG_SUMMARY_INTERVAL_SEC = 60.0
+
+# Callbacks are counted under this name when there are too many callback names
+OTHER_CALLBACKS_NAME = "<other>"
+
+_CORO_NAME_PATTERN = re.compile(r"coro=<([^\s(]+)")
+_HANDLE_NAME_PATTERN = re.compile(r"<\w*Handle (?:when=\S+ )?([^\s(>]+)")
+
+
+def get_callback_name(task_name: str) -> str:
+    """Return a short name for a slow callback formatted by asyncio.
+
+    For tasks, this is the name of the coroutine, such as "handle_request".
+    For other callbacks, this is the name of the function.
+    Unique details such as task names and memory addresses are removed, so
+    all the callbacks from the same code are counted together.
+    """
+    match = _CORO_NAME_PATTERN.search(task_name) or _HANDLE_NAME_PATTERN.match(
+        task_name
+    )
+    if match is None:
+        return task_name
+    return match.group(1)
+
+
+class SlowCallbackStats:
+    """Histograms of slow callback durations for each callback name, logged as a summary.
+
+    logger - Log a summary with this logger at the end of each interval with slow callbacks.
+
+    interval - How many seconds to count slow callbacks for before logging a summary.
+
+    top_n - How many callbacks to list in the summary.
+
+    max_callback_names - Count callbacks with more names than this under OTHER_CALLBACKS_NAME.
+    """
+
+    histograms: Dict[str, Histogram]
+
+    def __init__(
+        self,
+        logger: Logger,
+        interval: float,
+        top_n: int = DEFAULT_TOP_N,
+        max_callback_names: int = DEFAULT_MAX_CALLBACK_NAMES,
+    ) -> None:
+        self.logger = logger
+        self.interval = interval
+        self.top_n = top_n
+        self.max_callback_names = max_callback_names
+        self.histograms = {}
+        self._scheduled: Optional[asyncio.TimerHandle] = None
+
+    def record(self, task_name: str, duration: float) -> None:
+        """Count a slow callback and make sure a summary is logged at the end of the interval."""
+        name = get_callback_name(task_name)
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            if len(self.histograms) >= self.max_callback_names:
+                name = OTHER_CALLBACKS_NAME
+            histogram = self.histograms.setdefault(name, Histogram())
+        histogram.record(duration)
+
+        if self._scheduled is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._scheduled = loop.call_later(self.interval, self.log_summary)
+
+    def top(self) -> List[Tuple[str, Histogram]]:
+        """Return the top_n callbacks that blocked the loop for the longest total time."""
+        return sorted(
+            self.histograms.items(), key=lambda item: item[1].total, reverse=True
+        )[: self.top_n]
+
+    def log_summary(self) -> None:
+        """Log a summary of the slow callbacks counted so far, and reset the counts."""
+        if self._scheduled is not None:
+            self._scheduled.cancel()
+            self._scheduled = None
+        histograms = self.histograms.values()
+        count = sum(histogram.count for histogram in histograms)
+        if not count:
+            return
+        total = sum(histogram.total for histogram in histograms)
+        top = [
+            {"callback": name, **histogram.summary()} for name, histogram in self.top()
+        ]
+        self.histograms = {}
+        self.logger.info(
+            "%s slow async callbacks blocked the async loop for %.3f seconds",
+            count,
+            total,
+            extra={
+                "slow_callback_count": count,
+                "slow_callback_total_duration": total,
+                "slow_callbacks": top,
+            },
+        )
+
+
+def write_stack_samples(directory: str, stack_samples: str) -> str:
+    """Write folded stack samples to a new file in directory and return its path."""
+    path = os.path.join(
+        directory,
+        f"slow-callback-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{time.monotonic_ns()}.folded",
+    )
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(stack_samples)
+        file.write("\n")
+    return path
+
 
 def log_slow_callbacks(
     logger: Logger,
     slow_async_task_threshold_sec: float = 0.15,
     very_slow_async_task_threshold_sec: float = 0.5,
-) -> None:
+    summary_interval_sec: Optional[float] = None,
+    top_n: int = DEFAULT_TOP_N,
+    max_callback_names: int = DEFAULT_MAX_CALLBACK_NAMES,
+    sample_stacks: bool = False,
+    stack_sample_interval_sec: float = DEFAULT_SAMPLE_INTERVAL_SEC,
+    max_stack_samples: int = DEFAULT_MAX_SAMPLES,
+    stack_samples_dir: Optional[str] = None,
+) -> Optional[SlowCallbackStats]:
     """Log at INFO or WARN severity levels when an async task runs too slowly.
 
     slow_async_task_threshold_sec - INFO log if an async task runs longer than
@@ -17,20 +154,197 @@ def log_slow_callbacks(
 
     very_slow_async_task_threshold_sec - WARN log if an async task runs longer
         than this many seconds.
+
+    summary_interval_sec - If not None, don't log each slow task at INFO severity.
+        Instead, count them in histograms for each coroutine or function name,
+        and log one INFO summary per interval with the top_n callbacks that
+        blocked the loop for the longest total time. The summary has a
+        slow_callbacks field listing the count, total, mean, max, p50, p95 and
+        p99 durations of each callback. Very slow tasks are still logged right away.
+        Callback names are grouped under "<other>" after max_callback_names names.
+        Returns the SlowCallbackStats in this mode. Call its log_summary method
+        to log a summary right away, for example before the program exits.
+
+    sample_stacks - If True, a watchdog thread samples the stack of the loop
+        thread every stack_sample_interval_sec while a callback runs longer than
+        slow_async_task_threshold_sec, keeping at most max_stack_samples samples
+        per callback. Slow callback logs get a stack_samples field with the
+        samples as folded stacks, which flamegraph.pl and speedscope can read.
+        Callbacks faster than the threshold are never sampled.
+
+    stack_samples_dir - If set with sample_stacks, the samples of very slow
+        callbacks are written to a .folded file in this directory instead, and
+        the log has the path of the file in a stack_samples_file field.
+        The samples are attached to the log if the file can't be written.
     """
+    sampler: Optional[StackSampler] = None
+    if sample_stacks:
+        sampler = StackSampler(
+            slow_async_task_threshold_sec,
+            interval_sec=stack_sample_interval_sec,
+            max_samples=max_stack_samples,
+        )
+        # The sampler must run inside aiodebug's wrapper, so its samples are
+        # ready when on_slow_callback is called
+        sampler.install()
+        if stack_samples_dir is not None:
+            os.makedirs(stack_samples_dir, exist_ok=True)
+
+    stats: Optional[SlowCallbackStats] = None
+    if summary_interval_sec is not None:
+        stats = SlowCallbackStats(
+            logger, summary_interval_sec, top_n, max_callback_names
+        )
 
     def on_slow_callback(task_name: str, duration: float) -> None:
+        stack_samples = sampler.pop_samples() if sampler is not None else None
+        if stats is not None:
+            stats.record(task_name, duration)
+            if duration <= very_slow_async_task_threshold_sec:
+                return
         level = INFO
         if duration > very_slow_async_task_threshold_sec:
             level = WARN
+        extra: Dict[str, Any] = {"task_name": task_name, "duration": duration}
+        if stack_samples is not None:
+            if level == WARN and stack_samples_dir is not None:
+                try:
+                    extra["stack_samples_file"] = write_stack_samples(
+                        stack_samples_dir, stack_samples
+                    )
+                except OSError:
+                    extra["stack_samples"] = stack_samples
+            else:
+                extra["stack_samples"] = stack_samples
         logger.log(
             level,
             "Executing task %s blocked async loop for %s seconds",
             task_name,
             duration,
-            extra={"task_name": task_name, "duration": duration},
+            extra=extra,
         )
 
     aiodebug.log_slow_callbacks.enable(
         slow_async_task_threshold_sec, on_slow_callback=on_slow_callback
     )
+    return stats
+
+
+class LoopLagMonitor:
+    """Measure how late the async loop runs a heartbeat callback.
+
+    Many short callbacks, a long ready queue or garbage collection pauses all
+    delay the loop without any single callback being slow. The heartbeat is
+    scheduled every heartbeat_interval_sec, and the delay between when it
+    should have run and when it ran is the loop lag.
+
+    logger - Log with this logger.
+
+    lag_threshold_sec - WARN log each heartbeat later than this many seconds.
+
+    summary_interval_sec - INFO log a summary of the loop lag and ready queue
+        depth this often, in loop_lag and ready_queue_depth fields with the
+        count, total, mean, max, p50, p95 and p99 of each.
+        The statistics are reset after each summary.
+
+    The ready queue depth is the number of callbacks waiting to run when the
+    heartbeat runs. It is only available with the default asyncio event loop.
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        heartbeat_interval_sec: float = DEFAULT_HEARTBEAT_INTERVAL_SEC,
+        lag_threshold_sec: float = DEFAULT_LAG_THRESHOLD_SEC,
+        summary_interval_sec: float = DEFAULT_LAG_SUMMARY_INTERVAL_SEC,
+    ) -> None:
+        self.logger = logger
+        self.heartbeat_interval_sec = heartbeat_interval_sec
+        self.lag_threshold_sec = lag_threshold_sec
+        self.summary_interval_sec = summary_interval_sec
+        self.lag = Histogram()
+        self.ready_queue_depth = Histogram(scale=1)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._heartbeat: Optional[asyncio.TimerHandle] = None
+        self._expected_at = 0.0
+        self._next_summary_at = 0.0
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        """Start measuring the lag of the loop, or of the running loop if loop is None."""
+        self.stop()
+        self._loop = loop or asyncio.get_running_loop()
+        now = self._loop.time()
+        self._next_summary_at = now + self.summary_interval_sec
+        self._schedule(now)
+
+    def stop(self) -> None:
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+    def _schedule(self, now: float) -> None:
+        assert self._loop is not None
+        self._expected_at = now + self.heartbeat_interval_sec
+        self._heartbeat = self._loop.call_at(self._expected_at, self._on_heartbeat)
+
+    def _on_heartbeat(self) -> None:
+        assert self._loop is not None
+        now = self._loop.time()
+        # The loop can run timers up to its clock resolution early
+        lag = max(0.0, now - self._expected_at)
+        self.lag.record(lag)
+        ready = getattr(self._loop, "_ready", None)
+        depth = None if ready is None else len(ready)
+        if depth is not None:
+            self.ready_queue_depth.record(depth)
+
+        if lag > self.lag_threshold_sec:
+            self.logger.warning(
+                "Async loop lag of %.3f seconds",
+                lag,
+                extra={"loop_lag": lag, "ready_queue_depth": depth},
+            )
+        if now >= self._next_summary_at:
+            self._next_summary_at = now + self.summary_interval_sec
+            self.log_summary()
+        self._schedule(now)
+
+    def log_summary(self) -> None:
+        """Log a summary of the loop lag and ready queue depth, and reset them."""
+        if not self.lag.count:
+            return
+        self.logger.info(
+            "Async loop lag p99 %.3f seconds, max %.3f seconds",
+            self.lag.percentile(0.99),
+            self.lag.max,
+            extra={
+                "loop_lag": self.lag.summary(),
+                "ready_queue_depth": self.ready_queue_depth.summary()
+                if self.ready_queue_depth.count
+                else None,
+            },
+        )
+        self.lag.reset()
+        self.ready_queue_depth.reset()
+
+
+def monitor_loop_lag(
+    logger: Logger,
+    heartbeat_interval_sec: float = DEFAULT_HEARTBEAT_INTERVAL_SEC,
+    lag_threshold_sec: float = DEFAULT_LAG_THRESHOLD_SEC,
+    summary_interval_sec: float = DEFAULT_LAG_SUMMARY_INTERVAL_SEC,
+    loop: Optional[asyncio.AbstractEventLoop] = None,
+) -> LoopLagMonitor:
+    """Start a LoopLagMonitor on the given loop, or on the running loop if loop is None.
+
+    Use it with log_slow_callbacks to tell one slow callback apart from an
+    overloaded loop. Call stop() on the returned monitor to stop it.
+    """
+    monitor = LoopLagMonitor(
+        logger,
+        heartbeat_interval_sec=heartbeat_interval_sec,
+        lag_threshold_sec=lag_threshold_sec,
+        summary_interval_sec=summary_interval_sec,
+    )
+    monitor.start(loop)
+    return monitor
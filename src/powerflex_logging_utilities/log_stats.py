@@ -0,0 +1,183 @@
+"""Count the records logged per logger and level, to find which loggers flood the logs."""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_RATE_WINDOW_SEC = 10
+
+# Counters of records dropped by this package's handlers and filters
+DROPPED_COUNTER_ATTRIBUTES = ("dropped_count", "dropped_total", "suppressed_total")
+
+
+class LogStats:
+    """Counters of records and bytes for each logger name and level.
+
+    rate_window_sec - Compute records_per_second over this many past seconds.
+    """
+
+    records: Dict[Tuple[str, str], int]
+    bytes: Dict[Tuple[str, str], int]
+
+    def __init__(self, rate_window_sec: int = DEFAULT_RATE_WINDOW_SEC) -> None:
+        self.rate_window_sec = rate_window_sec
+        self.records = {}
+        self.bytes = {}
+        self._lock = threading.Lock()
+        # Number of records logged in each of the last seconds
+        self._per_second: Deque[List[int]] = deque(maxlen=rate_window_sec + 1)
+
+    def count(self, name: str, levelname: str, size: int, created: float) -> None:
+        """Count a record of size bytes logged at the created time."""
+        key = (name, levelname)
+        second = int(created)
+        with self._lock:
+            self.records[key] = self.records.get(key, 0) + 1
+            self.bytes[key] = self.bytes.get(key, 0) + size
+            per_second = self._per_second
+            if per_second and per_second[-1][0] == second:
+                per_second[-1][1] += 1
+            elif not per_second or per_second[-1][0] < second:
+                per_second.append([second, 1])
+            else:
+                self._count_late_record(second)
+
+    def _count_late_record(self, second: int) -> None:
+        """Count a record created before the last counted second, such as by a preempted thread."""
+        per_second = self._per_second
+        for index in range(len(per_second) - 1, -1, -1):
+            counted_second = per_second[index][0]
+            if counted_second == second:
+                per_second[index][1] += 1
+                return
+            if counted_second < second:
+                if len(per_second) == per_second.maxlen:
+                    per_second.popleft()
+                    index -= 1
+                per_second.insert(index + 1, [second, 1])
+                return
+        # Older than every counted second, so older than the rate window
+
+    def records_per_second(self, now: Optional[float] = None) -> float:
+        """Return the average number of records per second over the last complete seconds.
+
+        Records are counted in the second they were created, even if they are
+        counted later. Records counted more than rate_window_sec after they
+        were created are left out.
+        """
+        if now is None:
+            now = time.time()
+        current_second = int(now)
+        window_start = current_second - self.rate_window_sec
+        with self._lock:
+            total = sum(
+                count
+                for second, count in self._per_second
+                if window_start <= second < current_second
+            )
+        return total / self.rate_window_sec
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the counters as a JSON serializable dictionary.
+
+        records and bytes map each logger name to the counts of each level name.
+        """
+        with self._lock:
+            counters = list(self.records.items()), list(self.bytes.items())
+        records: Dict[str, Dict[str, int]] = {}
+        size: Dict[str, Dict[str, int]] = {}
+        for result, items in zip((records, size), counters):
+            for (name, levelname), count in items:
+                result.setdefault(name, {})[levelname] = count
+        return {
+            "records": records,
+            "bytes": size,
+            "records_per_second": self.records_per_second(),
+        }
+
+
+class LogStatsFilter(logging.Filter):
+    """Count the records going through a handler in a LogStats object.
+
+    formatter - If it has a format_bytes method, such as JsonFormatter, count
+        the size of the formatted records. Use the formatter of the handlers so
+        that JsonFormatter reuses the formatted record. Otherwise, count the size
+        of the rendered messages.
+
+    Add it after the filters that drop records, such as SamplingFilter, to only
+    count the records that are written.
+    Add it to the handlers that write the records rather than to a
+    BackgroundQueueHandler, so that records are formatted on the background
+    thread, once. init_loggers does this with the LogStatsFilter instances
+    in its filters.
+    A filter instance can be shared by several handlers. Each record is only
+    counted once, even if it goes through several handlers.
+    """
+
+    def __init__(
+        self, stats: LogStats, formatter: Optional[logging.Formatter] = None
+    ) -> None:
+        super().__init__()
+        self.stats = stats
+        self.formatter = formatter
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record_dict = record.__dict__
+        if record_dict.get("_log_stats_counted") is self:
+            return True
+        formatter = self.formatter
+        if formatter is not None and hasattr(formatter, "format_bytes"):
+            size = len(formatter.format_bytes(record))
+        else:
+            size = len(record.getMessage())
+        self.stats.count(record.name, record.levelname, size, record.created)
+        record_dict["_log_stats_counted"] = self
+        return True
+
+
+def _source_name(kind: str, source: Any) -> str:
+    name = getattr(source, "name", None)
+    if isinstance(name, str) and name:
+        return f"{kind} {name}"
+    return f"{kind} {type(source).__name__}"
+
+
+def find_dropped_counts(
+    handlers: Iterable[logging.Handler], filters: Iterable[Any] = ()
+) -> Dict[str, int]:
+    """Return the records dropped by these handlers and filters, and the handlers and filters they wrap.
+
+    Handlers and filters are found by their dropped_count, dropped_total or
+    suppressed_total counters, such as BackgroundQueueHandler, NatsLogHandler,
+    SamplingFilter and RateLimitFilter.
+    """
+    dropped: Dict[str, int] = {}
+
+    def add(kind: str, source: Any) -> None:
+        for attribute in DROPPED_COUNTER_ATTRIBUTES:
+            count = getattr(source, attribute, None)
+            if isinstance(count, int):
+                name = _source_name(kind, source)
+                dropped[name] = dropped.get(name, 0) + count
+
+    for source_filter in filters:
+        add("filter", source_filter)
+    for handler in handlers:
+        add("handler", handler)
+        wrapped = find_dropped_counts(getattr(handler, "handlers", []), handler.filters)
+        for name, count in wrapped.items():
+            dropped[name] = dropped.get(name, 0) + count
+    return dropped
+
+
+def get_effective_levels(names: Iterable[str]) -> Dict[str, str]:
+    """Return the name of the effective level of each logger."""
+    return {
+        name: logging.getLevelName(
+            (
+                logging.getLogger() if name == "root" else logging.getLogger(name)
+            ).getEffectiveLevel()
+        )
+        for name in names
+    }
@@ -0,0 +1,336 @@
+"""A logging handler that publishes batches of JSON logs to a NATS subject.
+
+Aggregators can subscribe to the subject instead of tailing log files.
+"""
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable, Deque, List, Optional, Tuple, Union
+
+from nats.aio.client import Client as NATSClient
+from pydantic import Field
+
+from powerflex_logging_utilities.default_log_format import DEFAULT_LOG_FORMAT
+from powerflex_logging_utilities.json_formatter import JsonFormatter
+
+try:
+    from pydantic_settings import BaseSettings
+except ImportError:
+    # pylint: disable=ungrouped-imports
+    from pydantic import BaseSettings  # type: ignore
+
+DEFAULT_BATCH_MAX_COUNT = 100
+DEFAULT_BATCH_MAX_BYTES = 512 * 1024  # Half of the default NATS max payload
+DEFAULT_FLUSH_INTERVAL_SEC = 1.0
+DEFAULT_BUFFER_MAX_RECORDS = 10000
+DEFAULT_CLOSE_TIMEOUT_SEC = 5.0
+
+DROPPED_RECORDS_MESSAGE = (
+    "Dropped %s log records because the NATS log buffer was full or publishing failed"
+)
+
+
+class NatsLogHandlerConfig(BaseSettings):  # type: ignore
+    """Pydantic settings object to configure a NatsLogHandler."""
+
+    NATS_LOG_HANDLER_SUBJECT: str = Field(
+        description="NATS subject that will receive batches of JSON logs"
+    )
+    NATS_LOG_HANDLER_BATCH_MAX_COUNT: int = Field(
+        description="Publish a batch once it has this many records",
+        default=DEFAULT_BATCH_MAX_COUNT,
+        gt=0,
+    )
+    NATS_LOG_HANDLER_BATCH_MAX_BYTES: int = Field(
+        description="Publish a batch once it has this many bytes",
+        default=DEFAULT_BATCH_MAX_BYTES,
+        gt=0,
+    )
+    NATS_LOG_HANDLER_FLUSH_INTERVAL_SEC: float = Field(
+        description="Publish records at most this many seconds after they are logged",
+        default=DEFAULT_FLUSH_INTERVAL_SEC,
+        gt=0,
+    )
+    NATS_LOG_HANDLER_BUFFER_MAX_RECORDS: int = Field(
+        description="Drop records logged while this many records wait to be published",
+        default=DEFAULT_BUFFER_MAX_RECORDS,
+        gt=0,
+    )
+
+
+class NatsLogHandler(logging.Handler):
+    """Publish formatted records to a NATS subject in batches, from the async loop.
+
+    nats_client - A connected NATS client. Any object with an async publish
+        method taking a subject and a payload works, such as a fake client in tests.
+
+    config - The subject and batch limits. If None, read from the environment.
+
+    loop - The async loop of the NATS client. Defaults to the running loop.
+
+    Each NATS message holds a batch of records, one JSON object per line.
+    A batch is published when it reaches NATS_LOG_HANDLER_BATCH_MAX_COUNT records
+    or NATS_LOG_HANDLER_BATCH_MAX_BYTES bytes, or NATS_LOG_HANDLER_FLUSH_INTERVAL_SEC
+    after its first record.
+
+    Logging never blocks: records are formatted in the logging thread and put in
+    a bounded buffer, and the async loop is woken up at most once per batch.
+    Records logged while the buffer is full are dropped before they are formatted.
+    Dropped records, and records that fail to publish, are counted in
+    dropped_count and reported by a WARNING record in the next batch.
+    The WARNING record is not counted in dropped_count or published_count.
+
+    close() publishes the buffered records, waiting up to close_timeout_sec when
+    called from another thread than the loop's. logging.shutdown() calls it when
+    the program exits. Call `await handler.aflush()` before closing the NATS
+    client to publish the last records.
+    """
+
+    nats_client: NATSClient
+    config: NatsLogHandlerConfig
+    dropped_count: int
+    published_count: int
+
+    def __init__(
+        self,
+        nats_client: NATSClient,
+        config: Optional[NatsLogHandlerConfig] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        level: Union[str, int] = logging.NOTSET,
+        close_timeout_sec: float = DEFAULT_CLOSE_TIMEOUT_SEC,
+    ) -> None:
+        super().__init__(level)
+        if config is None:
+            config = NatsLogHandlerConfig(
+                # type: ignore
+            )
+        self.nats_client = nats_client
+        self.config = config
+        self.loop = loop or asyncio.get_running_loop()
+        self.close_timeout_sec = close_timeout_sec
+        self.setFormatter(JsonFormatter(fmt=DEFAULT_LOG_FORMAT))
+        self.dropped_count = 0
+        self.published_count = 0
+        self._buffer: Deque[bytes] = deque()
+        self._buffer_bytes = 0
+        self._unreported_dropped_count = 0
+        self._buffer_lock = threading.Lock()
+        self._flush_requested = False
+        # Only used in the loop
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional["asyncio.Task[None]"] = None
+        self._publish_all = False
+
+    def format_bytes(self, record: logging.LogRecord) -> bytes:
+        """Format the record, using the formatter's format_bytes method if it has one."""
+        formatter = self.formatter
+        if formatter is not None and hasattr(formatter, "format_bytes"):
+            data: bytes = formatter.format_bytes(record)
+            return data
+        return self.format(record).encode("utf-8")
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        # emit is thread safe without the handler lock, and close() holds that
+        # lock while it waits for the loop, which may be logging
+        result = self.filter(record)
+        if result:
+            self.emit(record)
+        return bool(result)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Don't format the records that are dropped
+        if self._drop_if_full():
+            return
+        try:
+            data = self.format_bytes(record)
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+            return
+
+        wake_up: Optional[Callable[[], None]] = None
+        with self._buffer_lock:
+            # Other threads may have filled the buffer while formatting
+            if self._drop_if_full_locked():
+                return
+            was_empty = not self._buffer
+            self._buffer.append(data)
+            self._buffer_bytes += len(data)
+            if not self._flush_requested and self._batch_is_full():
+                self._flush_requested = True
+                wake_up = self._start_flush
+            elif was_empty:
+                wake_up = self._start_timer
+        if wake_up is not None:
+            self._call_soon(wake_up)
+
+    def _drop_if_full(self) -> bool:
+        with self._buffer_lock:
+            return self._drop_if_full_locked()
+
+    def _drop_if_full_locked(self) -> bool:
+        if len(self._buffer) < self.config.NATS_LOG_HANDLER_BUFFER_MAX_RECORDS:
+            return False
+        self.dropped_count += 1
+        self._unreported_dropped_count += 1
+        return True
+
+    def _call_soon(self, callback: Callable[[], None]) -> None:
+        try:
+            self.loop.call_soon_threadsafe(callback)
+        except RuntimeError:
+            # The loop is closed. close() counts the records left in the buffer.
+            pass
+
+    def _start_timer(self) -> None:
+        if self._timer is None:
+            self._timer = self.loop.call_later(
+                self.config.NATS_LOG_HANDLER_FLUSH_INTERVAL_SEC, self._flush_all
+            )
+
+    def _flush_all(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._start_flush(full_batches_only=False)
+
+    def _start_flush(self, full_batches_only: bool = True) -> None:
+        with self._buffer_lock:
+            self._flush_requested = False
+        if self._flush_task is not None and not self._flush_task.done():
+            # The running flush takes the new records
+            self._publish_all |= not full_batches_only
+            return
+        self._publish_all = not full_batches_only
+        self._flush_task = self.loop.create_task(self._publish_buffered())
+
+    async def _publish_buffered(self) -> None:
+        while True:
+            batch, reported_count = self._take_batch(
+                full_batches_only=not self._publish_all
+            )
+            if not batch or not await self._publish(batch, reported_count):
+                break
+        # Publish the rest of the records after the flush interval
+        if self._buffer:
+            self._start_timer()
+
+    def _batch_is_full(self) -> bool:
+        return (
+            len(self._buffer) >= self.config.NATS_LOG_HANDLER_BATCH_MAX_COUNT
+            or self._buffer_bytes >= self.config.NATS_LOG_HANDLER_BATCH_MAX_BYTES
+        )
+
+    def _take_batch(self, full_batches_only: bool = False) -> Tuple[List[bytes], int]:
+        """Return the next batch, and the dropped records reported by its first record."""
+        batch: List[bytes] = []
+        batch_bytes = 0
+        with self._buffer_lock:
+            if full_batches_only and not self._batch_is_full():
+                return batch, 0
+            while self._buffer and (
+                not batch
+                or (
+                    len(batch) < self.config.NATS_LOG_HANDLER_BATCH_MAX_COUNT
+                    and batch_bytes + len(self._buffer[0])
+                    <= self.config.NATS_LOG_HANDLER_BATCH_MAX_BYTES
+                )
+            ):
+                data = self._buffer.popleft()
+                batch.append(data)
+                batch_bytes += len(data)
+            self._buffer_bytes -= batch_bytes
+            dropped_count, self._unreported_dropped_count = (
+                self._unreported_dropped_count,
+                0,
+            )
+        if dropped_count:
+            batch.insert(0, self._dropped_records_report(dropped_count))
+        return batch, dropped_count
+
+    def _dropped_records_report(self, dropped_count: int) -> bytes:
+        record = logging.makeLogRecord(
+            {
+                "name": __name__,
+                "levelno": logging.WARNING,
+                "levelname": logging.getLevelName(logging.WARNING),
+                "msg": DROPPED_RECORDS_MESSAGE,
+                "args": (dropped_count,),
+                "dropped_count": dropped_count,
+            }
+        )
+        return self.format_bytes(record)
+
+    async def _publish(self, batch: List[bytes], reported_count: int = 0) -> bool:
+        """Publish a batch, whose first record reports reported_count dropped records if not 0."""
+        try:
+            await self.nats_client.publish(
+                self.config.NATS_LOG_HANDLER_SUBJECT, b"\n".join(batch)
+            )
+        except Exception:  # pylint: disable=broad-except
+            # The report is not a dropped record, but the records it reported
+            # are reported again in the next batch
+            record_count = len(batch) - 1 if reported_count else len(batch)
+            with self._buffer_lock:
+                self.dropped_count += record_count
+                self._unreported_dropped_count += record_count + reported_count
+            return False
+        self.published_count += len(batch) - 1 if reported_count else len(batch)
+        return True
+
+    async def aflush(self) -> None:
+        """Publish the buffered records in batches, until the buffer is empty."""
+        while True:
+            batch, reported_count = self._take_batch()
+            if not batch or not await self._publish(batch, reported_count):
+                return
+
+    def flush(self) -> None:
+        """Start publishing the buffered records, without waiting."""
+        if self._buffer:
+            self._call_soon(self._flush_all)
+
+    def close(self) -> None:
+        """Publish the buffered records, waiting for them if called from another thread than the loop's."""
+        try:
+            self._flush_before_close()
+        finally:
+            with self._buffer_lock:
+                self.dropped_count += len(self._buffer)
+                self._buffer.clear()
+                self._buffer_bytes = 0
+            super().close()
+
+    def _flush_before_close(self) -> None:
+        loop = self.loop
+        if loop.is_closed():
+            return
+        try:
+            running_loop: Optional[
+                asyncio.AbstractEventLoop
+            ] = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            # Can't wait for the loop from the loop. Take the buffered records
+            # now, as the buffer is cleared when closing.
+            batches = []
+            while True:
+                batch, reported_count = self._take_batch()
+                if not batch:
+                    break
+                batches.append((batch, reported_count))
+            loop.create_task(self._publish_batches(batches))
+        elif loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(self.aflush(), loop)
+            try:
+                future.result(self.close_timeout_sec)
+            except FutureTimeoutError:
+                future.cancel()
+        else:
+            loop.run_until_complete(self.aflush())
+
+    async def _publish_batches(self, batches: List[Tuple[List[bytes], int]]) -> None:
+        for batch, reported_count in batches:
+            await self._publish(batch, reported_count)
@@ -0,0 +1,245 @@
+"""Convert rich extra values, such as pydantic models, dataclasses and numpy arrays, to JSON types.
+
+Pass the objects themselves, or a Lazy, in extra instead of converting them
+when logging. JsonFormatter converts them with PayloadEncoder when the record
+is formatted, so the work is skipped for records that are not emitted.
+
+    logger.debug("Config loaded", extra={"config": config})
+    logger.trace("State", extra={"state": Lazy(build_state)})
+
+The encoder of each type is worked out once, including the field names of
+dataclasses and pydantic models. Register encoders for other types with
+register_encoder.
+"""
+import dataclasses
+import datetime
+import enum
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from powerflex_logging_utilities.trace_logger import Lazy
+
+Encoder = Callable[[Any], Any]
+
+# Roughly the most bytes of JSON written for one payload
+DEFAULT_MAX_PAYLOAD_BYTES = 64 * 1024
+
+# Deeper values are replaced with TRUNCATED, which also stops reference cycles
+MAX_DEPTH = 32
+
+TRUNCATED = "..."
+
+_registered_encoders: Dict[type, Encoder] = {}
+
+# The encoder of each type seen, or None if it has none
+_encoders: Dict[type, Optional[Encoder]] = {}
+
+
+def register_encoder(cls: type, encoder: Encoder) -> None:
+    """Convert instances of cls and its subclasses with encoder.
+
+    encoder returns a value of a JSON type, or a value that is itself converted,
+    like the default function of json.dumps.
+    """
+    _registered_encoders[cls] = encoder
+    _encoders.clear()
+
+
+def _attributes_encoder(names: Tuple[str, ...]) -> Encoder:
+    def encode(value: Any) -> Dict[str, Any]:
+        return {name: getattr(value, name) for name in names}
+
+    return encode
+
+
+def _pydantic_encoder(names: Tuple[str, ...]) -> Encoder:
+    def encode(value: Any) -> Dict[str, Any]:
+        fields = {name: getattr(value, name) for name in names}
+        # Fields of models allowing extra fields
+        extra = getattr(value, "__pydantic_extra__", None)
+        if extra:
+            fields.update(extra)
+        return fields
+
+    return encode
+
+
+def _budget_left(  # pylint: disable=too-many-return-statements
+    value: Any, budget: int, depth: int
+) -> int:
+    """Return the bytes of budget left after value, like PayloadEncoder._truncate.
+
+    Returns -1 if value doesn't fit, or if it holds values that are not of a JSON type.
+    """
+    value_type = type(value)
+    if value_type is str:
+        return budget - len(value) - 2
+    if value_type in (int, float, bool) or value is None:
+        return budget - 8
+    if depth >= MAX_DEPTH:
+        return -1
+    if value_type is dict:
+        budget -= 2
+        for key, item in value.items():
+            if not isinstance(key, str):
+                return -1
+            budget = _budget_left(item, budget - len(key) - 4, depth + 1)
+            if budget < 0:
+                return -1
+        return budget
+    if value_type is list or value_type is tuple:
+        budget -= 2
+        for item in value:
+            budget = _budget_left(item, budget - 1, depth + 1)
+            if budget < 0:
+                return -1
+        return budget
+    return -1
+
+
+def _is_numpy(cls: type) -> bool:
+    # Checked without importing numpy, which is optional
+    return cls.__module__ == "numpy" and hasattr(cls, "tolist")
+
+
+def _make_encoder(  # pylint: disable=too-many-return-statements
+    cls: type,
+) -> Optional[Encoder]:
+    for base in cls.__mro__:
+        if base in _registered_encoders:
+            return _registered_encoders[base]
+    if issubclass(cls, Lazy):
+        return lambda value: value.value
+    if dataclasses.is_dataclass(cls):
+        return _attributes_encoder(
+            tuple(field.name for field in dataclasses.fields(cls))
+        )
+    model_fields = getattr(cls, "model_fields", None)
+    if isinstance(model_fields, dict) and hasattr(cls, "model_dump"):
+        return _pydantic_encoder(tuple(model_fields))
+    v1_fields = getattr(cls, "__fields__", None)
+    if isinstance(v1_fields, dict) and hasattr(cls, "dict"):
+        return _pydantic_encoder(tuple(v1_fields))
+    if issubclass(cls, enum.Enum):
+        return lambda value: value.value
+    if issubclass(cls, (datetime.date, datetime.time)):
+        return lambda value: value.isoformat()
+    if _is_numpy(cls):
+        # Python scalars for numpy scalars, and nested lists for arrays
+        return lambda value: value.tolist()
+    return None
+
+
+def find_encoder(cls: type) -> Optional[Encoder]:
+    """Return the function converting instances of cls, or None if there is none."""
+    try:
+        return _encoders[cls]
+    except KeyError:
+        encoder = _encoders[cls] = _make_encoder(cls)
+        return encoder
+
+
+class PayloadEncoder:
+    """Convert values that are not of a JSON type, as the default function of a JSON serializer.
+
+    fallback - Converts values without an encoder, such as the default method
+        of python-json-logger's JsonEncoder. If None, they raise a TypeError.
+    max_bytes - Roughly the most bytes of JSON written for one value that is
+        not of a JSON type, or for one value passed to truncate. Longer strings
+        are cut, and the items of longer lists and dicts are replaced by a
+        count of the missing items.
+        The payload is converted until it reaches this size, so the rest of a
+        huge payload is never converted. None converts whole payloads.
+    """
+
+    def __init__(
+        self,
+        fallback: Optional[Encoder] = None,
+        max_bytes: Optional[int] = DEFAULT_MAX_PAYLOAD_BYTES,
+    ) -> None:
+        self.fallback = fallback
+        self.max_bytes = max_bytes
+
+    def __call__(self, value: Any) -> Any:
+        if self.max_bytes is None:
+            return self._convert(value)
+        converted, _remaining = self._truncate(value, self.max_bytes, 0)
+        return converted
+
+    def truncate(self, value: Any) -> Any:
+        """Return value converted to JSON types, truncated to about max_bytes.
+
+        Unlike calling the encoder, this also truncates strings, lists and dicts.
+        Values of JSON types that fit are returned as they are.
+        """
+        if self.max_bytes is None or _budget_left(value, self.max_bytes, 0) >= 0:
+            return value
+        converted, _remaining = self._truncate(value, self.max_bytes, 0)
+        return converted
+
+    def _convert(self, value: Any) -> Any:
+        encoder = find_encoder(type(value))
+        if encoder is not None:
+            return encoder(value)
+        if self.fallback is None:
+            raise TypeError(
+                f"Object of type {type(value).__name__} is not JSON serializable"
+            )
+        return self.fallback(value)
+
+    def _truncate(  # pylint: disable=too-many-return-statements,too-many-branches
+        self, value: Any, budget: int, depth: int
+    ) -> Tuple[Any, int]:
+        """Convert value to JSON types, using about budget bytes at most.
+
+        Returns the converted value and the bytes left.
+        """
+        if value is None or isinstance(value, (bool, int, float)):
+            return value, budget - 8
+        if isinstance(value, str):
+            if len(value) + 2 > budget:
+                return value[: max(budget - 2, 0)] + TRUNCATED, 0
+            return value, budget - len(value) - 2
+        if depth >= MAX_DEPTH:
+            return TRUNCATED, budget - len(TRUNCATED) - 2
+
+        if isinstance(value, dict):
+            fields: Dict[Any, Any] = {}
+            budget -= 2
+            for index, (key, item) in enumerate(value.items()):
+                if budget <= 0:
+                    fields[TRUNCATED] = f"{len(value) - index} more fields"
+                    break
+                # The serializer writes keys that are not strings
+                fields[key], budget = self._truncate(
+                    item, budget - len(str(key)) - 4, depth + 1
+                )
+            return fields, budget
+        if isinstance(value, (list, tuple)):
+            return self._truncate_items(value, len(value), budget, depth)
+
+        if _is_numpy(type(value)) and getattr(value, "ndim", 0) > 0 and len(value):
+            # Only convert the rows of an array that fit, at about 8 bytes per number
+            rows = max(budget // (8 * max(value.size // len(value), 1)), 1)
+            if rows < len(value):
+                return self._truncate_items(
+                    value[:rows].tolist(), len(value), budget, depth
+                )
+        converted = self._convert(value)
+        if converted is value:
+            return TRUNCATED, budget - len(TRUNCATED) - 2
+        return self._truncate(converted, budget, depth + 1)
+
+    def _truncate_items(
+        self, items: Any, count: int, budget: int, depth: int
+    ) -> Tuple[List[Any], int]:
+        """Convert the first of count items, which may be fewer than count."""
+        converted: List[Any] = []
+        budget -= 2
+        for item in items:
+            if budget <= 0:
+                break
+            value, budget = self._truncate(item, budget - 1, depth + 1)
+            converted.append(value)
+        if len(converted) < count:
+            converted.append(f"{TRUNCATED} {count - len(converted)} more items")
+        return converted, budget
@@ -0,0 +1,270 @@
+"""Funnel the logs of worker processes to a single writer in the parent process.
+
+Worker processes that write to the same log file corrupt its rotation and
+interleave partial lines. Instead, workers send compact records in batches over
+a multiprocessing queue, and one thread of the parent process writes them with
+the parent's stdout and file handlers.
+"""
+import logging
+import multiprocessing
+import multiprocessing.context
+import multiprocessing.queues
+import multiprocessing.util
+import pickle
+import threading
+from typing import Any, Iterable, List, Optional, Sequence, Union
+
+from powerflex_logging_utilities.record_snapshot import (
+    CompactRecord,
+    compact_record,
+    restore_record,
+)
+
+DEFAULT_MAX_BATCHES = 1000
+DEFAULT_BATCH_MAX_COUNT = 100
+DEFAULT_FLUSH_INTERVAL_SEC = 0.1
+
+# Run before the finalizer of multiprocessing queues, which waits for their
+# feeder thread, when a worker process exits
+_FLUSH_EXIT_PRIORITY = 10
+
+
+def _picklable(compact: CompactRecord) -> CompactRecord:
+    """Return the record, with its extra fields as text if they can't be pickled."""
+    try:
+        pickle.dumps(compact, pickle.HIGHEST_PROTOCOL)
+    except Exception:  # pylint: disable=broad-except
+        values, message, _args, exc_text, stack_info, extra = compact
+        return (
+            values,
+            message if isinstance(message, str) else repr(message),
+            None,
+            exc_text,
+            stack_info,
+            {key: repr(value) for key, value in (extra or {}).items()} or None,
+        )
+    return compact
+
+
+def _pickle_batch(batch: List[CompactRecord]) -> bytes:
+    try:
+        return pickle.dumps(batch, pickle.HIGHEST_PROTOCOL)
+    except Exception:  # pylint: disable=broad-except
+        # Only pickle each record to find the ones that can't be pickled
+        return pickle.dumps(
+            [_picklable(compact) for compact in batch], pickle.HIGHEST_PROTOCOL
+        )
+
+
+class ProcessFunnelHandler(logging.Handler):
+    """Send records to a LogFunnel in the parent process, in batches.
+
+    record_queue - The queue of the LogFunnel.
+
+    batch_max_count - Send a batch once it has this many records.
+
+    flush_interval_sec - Send records at most this many seconds after they are logged.
+
+    Records are copied when they are logged, with their message and exception
+    rendered as text, like in the flight recorder. Each batch is pickled once,
+    when it is sent, so extra values should not be changed after logging them.
+    Records whose extra values can't be pickled are sent with their extra
+    values as text.
+    Sending a batch blocks while the queue of the LogFunnel is full, so workers
+    slow down instead of using more memory when the writer falls behind.
+
+    The buffered records are sent when the worker process exits normally,
+    including the workers of a multiprocessing.Pool.
+    """
+
+    record_queue: "multiprocessing.queues.Queue[Optional[bytes]]"
+    sent_count: int
+
+    def __init__(
+        self,
+        record_queue: "multiprocessing.queues.Queue[Optional[bytes]]",
+        batch_max_count: int = DEFAULT_BATCH_MAX_COUNT,
+        flush_interval_sec: float = DEFAULT_FLUSH_INTERVAL_SEC,
+        level: Union[str, int] = logging.NOTSET,
+    ) -> None:
+        super().__init__(level)
+        self.record_queue = record_queue
+        self.batch_max_count = batch_max_count
+        self.flush_interval_sec = flush_interval_sec
+        self.sent_count = 0
+        self._batch: List[CompactRecord] = []
+        self._batch_lock = threading.Lock()
+        # Held while sending, so batches are sent in order
+        self._send_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._flush_thread = threading.Thread(
+            target=self._flush_periodically,
+            name="process-funnel-flush",
+            daemon=True,
+        )
+        self._flush_thread.start()
+        multiprocessing.util.Finalize(
+            None, self.close, exitpriority=_FLUSH_EXIT_PRIORITY
+        )
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            compact = compact_record(record)
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+            return
+        with self._batch_lock:
+            self._batch.append(compact)
+            batch_is_full = len(self._batch) >= self.batch_max_count
+        if batch_is_full:
+            self._send()
+
+    def _send(self) -> None:
+        with self._send_lock:
+            with self._batch_lock:
+                batch, self._batch = self._batch, []
+            if batch:
+                self.record_queue.put(_pickle_batch(batch))
+                self.sent_count += len(batch)
+
+    def _flush_periodically(self) -> None:
+        while not self._stopped.wait(self.flush_interval_sec):
+            self._send()
+
+    def flush(self) -> None:
+        """Send the buffered records to the LogFunnel."""
+        self._send()
+
+    def close(self) -> None:
+        """Send the buffered records and stop the flush thread."""
+        if not self._stopped.is_set():
+            self._stopped.set()
+            self._send()
+        super().close()
+
+
+def init_worker_logging(
+    record_queue: "multiprocessing.queues.Queue[Optional[bytes]]",
+    loggers: Sequence[Union[logging.Logger, str]] = ("",),
+    log_level: Union[str, int] = logging.NOTSET,
+    batch_max_count: int = DEFAULT_BATCH_MAX_COUNT,
+    flush_interval_sec: float = DEFAULT_FLUSH_INTERVAL_SEC,
+) -> ProcessFunnelHandler:
+    """Send the logs of this worker process to a LogFunnel.
+
+    Use it as the initializer of a multiprocessing.Pool, or call it at the start
+    of a multiprocessing.Process target.
+
+    loggers - Replace the handlers of these loggers with one ProcessFunnelHandler.
+        Pass the loggers given to init_loggers in the parent process, since
+        forked workers inherit their handlers. Defaults to the root logger.
+
+    log_level - If set, the level of the loggers.
+
+    The inherited handlers are removed without being closed, since they are
+    shared with the parent process.
+    """
+    handler = ProcessFunnelHandler(
+        record_queue,
+        batch_max_count=batch_max_count,
+        flush_interval_sec=flush_interval_sec,
+    )
+    for logger in loggers:
+        if isinstance(logger, str):
+            logger = logging.getLogger(logger)
+        logger.handlers = [handler]
+        if log_level:
+            logger.setLevel(log_level)
+    return handler
+
+
+class LogFunnel:
+    """Write the records sent by the worker processes on a thread of this process.
+
+    handlers - The handlers that write the records. Their levels are respected.
+        If None, each record is handled by the logger of this process with the
+        same name, so the handlers set by init_loggers write it.
+
+    max_batches - The maximum number of batches waiting to be written.
+        Workers block when it is reached.
+
+    context - The multiprocessing context of the workers. Defaults to the
+        default context.
+
+    Call start() before starting the workers, pass the queue to
+    init_worker_logging, and call stop() after the workers exited to write the
+    last records.
+    """
+
+    handlers: Optional[List[logging.Handler]]
+    received_count: int
+
+    def __init__(
+        self,
+        handlers: Optional[Iterable[logging.Handler]] = None,
+        max_batches: int = DEFAULT_MAX_BATCHES,
+        context: Optional[multiprocessing.context.BaseContext] = None,
+    ) -> None:
+        self.handlers = list(handlers) if handlers is not None else None
+        if context is None:
+            context = multiprocessing.get_context()
+        self.queue: "multiprocessing.queues.Queue[Optional[bytes]]" = context.Queue(
+            max_batches
+        )
+        self.received_count = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start the writer thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._write_batches, name="process-funnel-writer", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Write the records already sent and stop the writer thread."""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join()
+
+    def __enter__(self) -> "LogFunnel":
+        self.start()
+        return self
+
+    def __exit__(self, *_exc_info: Any) -> None:
+        self.stop()
+
+    def _write_batches(self) -> None:
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            try:
+                batch: List[CompactRecord] = pickle.loads(data)
+            except Exception:  # pylint: disable=broad-except
+                logging.getLogger(__name__).exception(
+                    "Could not read a batch of log records of a worker process"
+                )
+                continue
+            for compact in batch:
+                self.received_count += 1
+                try:
+                    self.handle(restore_record(compact))
+                except Exception:  # pylint: disable=broad-except
+                    logging.getLogger(__name__).exception(
+                        "Could not write a log record of a worker process"
+                    )
+
+    def handle(self, record: logging.LogRecord) -> None:
+        if self.handlers is None:
+            if record.name == "root":
+                logger = logging.getLogger()
+            else:
+                logger = logging.getLogger(record.name)
+            logger.handle(record)
+            return
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
@@ -0,0 +1,234 @@
+"""A logging handler that hands records to other handlers on a background thread.
+
+The logging thread only puts records on a bounded queue, so slow writes such as
+disk stalls or log file rotation never block the caller.
+"""
+import copy
+import logging
+import logging.handlers
+import queue
+import threading
+from typing import Iterable, List, Literal, Optional, get_args
+
+from powerflex_logging_utilities.log_context import attach_log_context
+
+OverflowPolicy = Literal["block", "drop_newest", "drop_oldest"]
+
+DEFAULT_QUEUE_MAX_SIZE = 10000
+DEFAULT_OVERFLOW_POLICY: OverflowPolicy = "block"
+
+DROPPED_RECORDS_MESSAGE = "Dropped %s log records because the log queue was full"
+
+_exception_formatter = logging.Formatter()
+
+
+class _FlushMarker(logging.LogRecord):
+    """Queued by flush. written is set when the writer thread reaches it."""
+
+    def __init__(self) -> None:
+        super().__init__(__name__, logging.NOTSET, __file__, 0, "flush", None, None)
+        self.written = threading.Event()
+
+
+class _BackgroundQueueListener(logging.handlers.QueueListener):
+    """Queue listener that reports records dropped by its BackgroundQueueHandler."""
+
+    def __init__(
+        self, queue_handler: "BackgroundQueueHandler", handlers: List[logging.Handler]
+    ) -> None:
+        super().__init__(
+            queue_handler.record_queue, *handlers, respect_handler_level=True
+        )
+        self.queue_handler = queue_handler
+
+    def enqueue_sentinel(self) -> None:
+        # The queue is bounded, so wait for the writer thread to make room
+        # instead of raising queue.Full like QueueListener does.
+        self.queue_handler.record_queue.put(self._sentinel)  # type: ignore
+
+    def handle(self, record: logging.LogRecord) -> None:
+        self.queue_handler.handle_dropped_records()
+        if isinstance(record, _FlushMarker):
+            record.written.set()
+            return
+        super().handle(record)
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """Write records with the given handlers on a background writer thread.
+
+    handlers - The handlers that will write records. Their levels are respected.
+
+    max_size - The maximum number of records waiting to be written.
+
+    overflow_policy - What to do with a record when the queue is full.
+        "block" waits for room in the queue.
+        "drop_newest" drops the record being logged.
+        "drop_oldest" drops the oldest record in the queue to make room.
+        Dropped records are counted and reported with a WARNING record.
+
+    Call close() to write all queued records and stop the writer thread.
+    logging.shutdown() does this automatically when the program exits.
+    Records logged after close() are dropped and counted in dropped_count.
+    """
+
+    handlers: List[logging.Handler]
+    overflow_policy: OverflowPolicy
+    dropped_count: int
+
+    def __init__(
+        self,
+        handlers: Iterable[logging.Handler],
+        max_size: int = DEFAULT_QUEUE_MAX_SIZE,
+        overflow_policy: OverflowPolicy = DEFAULT_OVERFLOW_POLICY,
+    ) -> None:
+        if overflow_policy not in get_args(OverflowPolicy):
+            raise ValueError(
+                f"overflow_policy must be one of {get_args(OverflowPolicy)}, not {overflow_policy!r}"
+            )
+        self.record_queue: "queue.Queue[Optional[logging.LogRecord]]" = queue.Queue(
+            max_size
+        )
+        super().__init__(self.record_queue)
+        self.handlers = list(handlers)
+        self.overflow_policy = overflow_policy
+        self.dropped_count = 0
+        self._unreported_dropped_count = 0
+        self._dropped_lock = threading.Lock()
+        self._listener = _BackgroundQueueListener(self, self.handlers)
+        self._listener.start()
+        self._running = True
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Skip records that none of the handlers would write, without rendering
+        # their message, so Lazy arguments are not evaluated for nothing.
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                break
+        else:
+            return
+        self.acquire()
+        try:
+            # close() marks the handler stopped while holding the lock, so no
+            # record is queued once the writer thread is being stopped
+            if self._running:
+                super().emit(record)
+            else:
+                self._count_dropped()
+        finally:
+            self.release()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Copy the record and render its message so it is safe to write later.
+
+        Unlike QueueHandler.prepare, the record is not formatted here, so
+        the wrapped handlers' formatters still see the original fields, and
+        the log_context the record was logged in is kept with it.
+        """
+        record = copy.copy(record)
+        attach_log_context(record)
+        if not isinstance(record.msg, dict):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.overflow_policy == "block":
+            self.record_queue.put(record)
+            return
+
+        try:
+            self.record_queue.put_nowait(record)
+            return
+        except queue.Full:
+            if self.overflow_policy == "drop_newest":
+                self._count_dropped()
+                return
+
+        while True:
+            try:
+                dropped = self.record_queue.get_nowait()
+            except queue.Empty:
+                pass
+            else:
+                self.record_queue.task_done()
+                if dropped is None:
+                    # The writer thread is stopping, and needs its sentinel
+                    self.record_queue.put(dropped)
+                    self._count_dropped()
+                    return
+                if isinstance(dropped, _FlushMarker):
+                    # The records queued before it were already taken
+                    dropped.written.set()
+                else:
+                    self._count_dropped()
+            try:
+                self.record_queue.put_nowait(record)
+                return
+            except queue.Full:
+                continue
+
+    def _count_dropped(self) -> None:
+        with self._dropped_lock:
+            self.dropped_count += 1
+            self._unreported_dropped_count += 1
+
+    def handle_dropped_records(self) -> None:
+        """Write a WARNING record if records were dropped since the last call."""
+        if not self._unreported_dropped_count:
+            return
+        with self._dropped_lock:
+            dropped = self._unreported_dropped_count
+            self._unreported_dropped_count = 0
+        record = logging.LogRecord(
+            name=__name__,
+            level=logging.WARNING,
+            pathname=__file__,
+            lineno=0,
+            msg=DROPPED_RECORDS_MESSAGE,
+            args=(dropped,),
+            exc_info=None,
+        )
+        record.dropped_count = dropped
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def flush(self) -> None:
+        """Wait until the writer thread has written the records queued before this call.
+
+        Records logged while waiting are not waited for, so this returns even
+        if other threads keep logging.
+        """
+        marker = None
+        self.acquire()
+        try:
+            # close() marks the handler stopped while holding the lock, so the
+            # marker is queued before the writer thread stops
+            if self._running:
+                marker = _FlushMarker()
+                self.record_queue.put(marker)
+        finally:
+            self.release()
+        if marker is not None:
+            marker.written.wait()
+        for handler in self.handlers:
+            handler.flush()
+
+    def close(self) -> None:
+        """Write all queued records, stop the writer thread and close the wrapped handlers."""
+        self.acquire()
+        try:
+            running, self._running = self._running, False
+        finally:
+            self.release()
+        if running:
+            self._listener.stop()
+            self.handle_dropped_records()
+            for handler in self.handlers:
+                handler.close()
+        super().close()
@@ -0,0 +1,186 @@
+"""A logging filter that rate limits each call site and summarizes what it suppressed.
+
+A call site is a (logger name, pathname, line number, level) tuple.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_RATE_PER_SECOND = 10.0
+DEFAULT_BURST = 20
+DEFAULT_MAX_CALL_SITES = 1024
+DEFAULT_SUMMARY_INTERVAL_SECONDS = 10.0
+
+REPEATED_MESSAGE = "Previous message repeated %s times: %s"
+
+CallSiteKey = Tuple[str, str, int, int]
+
+
+class _CallSite:
+    __slots__ = (
+        "tokens",
+        "updated_at",
+        "suppressed_count",
+        "first_suppressed_at",
+        "last_suppressed",
+    )
+
+    def __init__(self, tokens: float, now: float) -> None:
+        self.tokens = tokens
+        self.updated_at = now
+        self.suppressed_count = 0
+        self.first_suppressed_at = 0.0
+        self.last_suppressed: Optional[logging.LogRecord] = None
+
+
+class RateLimitFilter(logging.Filter):
+    """Let through at most rate_per_second records per call site, with bursts of up to burst records.
+
+    rate_per_second - How many records per second each call site can log on average.
+
+    burst - How many records a call site can log at once before it is rate limited.
+
+    max_call_sites - How many call sites to remember. The least recently used
+        call site is forgotten when there are more.
+
+    summary_interval_seconds - How often to log a summary of suppressed records.
+        For each call site with suppressed records, a record with the message
+        "Previous message repeated N times: <message>" is logged by the same logger,
+        where <message> is the message of the last suppressed record,
+        at the same level. It has the extra fields suppressed_count and
+        first_suppressed_at (a timestamp like LogRecord.created).
+        Summaries are logged when a record goes through the filter, when a
+        call site is forgotten, or when flush_summaries() is called.
+
+    Summaries are logged with logging.getLogger(record.name), so use loggers
+    from logging.getLogger.
+
+    A filter instance can be shared by several handlers. Each record is only
+    counted once, even if it goes through several handlers.
+    """
+
+    rate_per_second: float
+    burst: int
+    max_call_sites: int
+    summary_interval_seconds: float
+    suppressed_total: int
+
+    def __init__(
+        self,
+        rate_per_second: float = DEFAULT_RATE_PER_SECOND,
+        burst: int = DEFAULT_BURST,
+        max_call_sites: int = DEFAULT_MAX_CALL_SITES,
+        summary_interval_seconds: float = DEFAULT_SUMMARY_INTERVAL_SECONDS,
+    ) -> None:
+        super().__init__()
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.max_call_sites = max_call_sites
+        self.summary_interval_seconds = summary_interval_seconds
+        self.suppressed_total = 0
+        self._call_sites: "OrderedDict[CallSiteKey, _CallSite]" = OrderedDict()
+        # Call sites with suppressed records that are not summarized yet
+        self._pending: Dict[CallSiteKey, _CallSite] = {}
+        self._next_summary_at = time.monotonic() + summary_interval_seconds
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record_dict = record.__dict__
+        if record_dict.get("_rate_limit_summary"):
+            return True
+        # Don't count a record twice when this filter is shared by several handlers
+        cached = record_dict.get("_rate_limit_decision")
+        if cached is not None and cached[0] is self:
+            allowed: bool = cached[1]
+            return allowed
+
+        key = (record.name, record.pathname, record.lineno, record.levelno)
+        now = time.monotonic()
+        summaries: List[logging.LogRecord] = []
+        with self._lock:
+            call_site = self._call_sites.get(key)
+            if call_site is None:
+                call_site = self._call_sites[key] = _CallSite(self.burst, now)
+                if len(self._call_sites) > self.max_call_sites:
+                    evicted_key, evicted = self._call_sites.popitem(last=False)
+                    self._summarize(evicted_key, evicted, summaries)
+            else:
+                self._call_sites.move_to_end(key)
+                call_site.tokens = min(
+                    self.burst,
+                    call_site.tokens
+                    + (now - call_site.updated_at) * self.rate_per_second,
+                )
+                call_site.updated_at = now
+
+            allowed = call_site.tokens >= 1
+            if allowed:
+                call_site.tokens -= 1
+            else:
+                if not call_site.suppressed_count:
+                    call_site.first_suppressed_at = record.created
+                    self._pending[key] = call_site
+                call_site.suppressed_count += 1
+                call_site.last_suppressed = record
+                self.suppressed_total += 1
+
+            if now >= self._next_summary_at:
+                self._next_summary_at = now + self.summary_interval_seconds
+                for pending_key, pending in list(self._pending.items()):
+                    self._summarize(pending_key, pending, summaries)
+
+        record_dict["_rate_limit_decision"] = (self, allowed)
+        self._log_summaries(summaries)
+        return allowed
+
+    def _summarize(
+        self, key: CallSiteKey, call_site: _CallSite, summaries: List[logging.LogRecord]
+    ) -> None:
+        """Add a summary record for the call site to summaries if it suppressed records."""
+        last = call_site.last_suppressed
+        if last is None or not call_site.suppressed_count:
+            return
+        try:
+            message = last.getMessage()
+        except Exception:  # pylint: disable=broad-except
+            # Such as arguments that don't match the message
+            message = str(last.msg)
+        summary = logging.makeLogRecord(
+            {
+                "name": last.name,
+                "levelno": last.levelno,
+                "levelname": last.levelname,
+                "pathname": last.pathname,
+                "filename": last.filename,
+                "module": last.module,
+                "lineno": last.lineno,
+                "funcName": last.funcName,
+                "msg": REPEATED_MESSAGE,
+                "args": (call_site.suppressed_count, message),
+                "suppressed_count": call_site.suppressed_count,
+                "first_suppressed_at": call_site.first_suppressed_at,
+                "_rate_limit_summary": True,
+            }
+        )
+        summaries.append(summary)
+        call_site.suppressed_count = 0
+        call_site.last_suppressed = None
+        self._pending.pop(key, None)
+
+    @staticmethod
+    def _log_summaries(summaries: List[logging.LogRecord]) -> None:
+        for summary in summaries:
+            name: Optional[str] = None if summary.name == "root" else summary.name
+            logger = logging.getLogger(name)
+            if logger.isEnabledFor(summary.levelno):
+                logger.handle(summary)
+
+    def flush_summaries(self) -> None:
+        """Log a summary for every call site with suppressed records now."""
+        summaries: List[logging.LogRecord] = []
+        with self._lock:
+            for key, call_site in list(self._pending.items()):
+                self._summarize(key, call_site, summaries)
+        self._log_summaries(summaries)
@@ -0,0 +1,110 @@
+"""Copy log records as tuples of values that can be kept in memory or pickled.
+
+The message, exception and stack are rendered as text, so the copies don't
+refer to the arguments or the traceback of the original record. Messages
+whose arguments can't change, such as strings, numbers and Lazy values, may
+also be kept as they are, and only rendered when the copy is written.
+"""
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from powerflex_logging_utilities.log_context import record_log_context
+from powerflex_logging_utilities.trace_logger import Lazy
+
+_STANDARD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {
+    "message",
+    "asctime",
+}
+# Attributes copied as they are. The message, exception and stack are stored as text.
+_COPIED_ATTRIBUTES = tuple(
+    sorted(
+        _STANDARD_ATTRIBUTES
+        - {"msg", "args", "exc_info", "exc_text", "stack_info", "message", "asctime"}
+    )
+)
+
+# Message arguments that are kept without rendering the message
+_IMMUTABLE_TYPES = frozenset([str, int, float, bool, bytes, type(None), Lazy])
+
+_exception_formatter = logging.Formatter()
+
+# Copied attribute values, message, message arguments, exception text, stack
+# info, extra fields
+CompactRecord = Tuple[
+    Tuple[Any, ...],
+    Any,
+    Optional[Tuple[Any, ...]],
+    Optional[str],
+    Optional[str],
+    Optional[Dict[str, Any]],
+]
+
+
+def _message(
+    record: logging.LogRecord, render: bool
+) -> Tuple[Any, Optional[Tuple[Any, ...]]]:
+    """Return the message and arguments to keep for a record."""
+    msg = record.msg
+    if isinstance(msg, dict):
+        return msg, None
+    if not render and type(msg) in (str, Lazy):
+        args = record.args
+        if not args:
+            return msg, None
+        if isinstance(args, tuple) and all(
+            type(arg) in _IMMUTABLE_TYPES for arg in args
+        ):
+            return msg, args
+    return record.getMessage(), None
+
+
+def compact_record(record: logging.LogRecord, render: bool = True) -> CompactRecord:
+    """Return the fields of a record, with its message, exception and stack rendered as text.
+
+    render - If False, the message and its arguments are kept as they are if
+        they can't change, such as strings, numbers and Lazy values, so that
+        they are only rendered if the restored record is formatted.
+
+    Extra fields whose name starts with "_" are left out. The fields of the
+    log_context the record was logged in are added to the extra fields.
+    """
+    record_dict = record.__dict__
+    exc_text = record.exc_text
+    if record.exc_info and not exc_text:
+        exc_text = _exception_formatter.formatException(record.exc_info)
+    extra = {
+        key: value
+        for key, value in record_dict.items()
+        if key not in _STANDARD_ATTRIBUTES
+        and not (isinstance(key, str) and key.startswith("_"))
+    }
+    context = record_log_context(record)
+    if context is not None:
+        for key, value in context.fields.items():
+            if key not in record_dict:
+                extra.setdefault(key, value)
+    message, args = _message(record, render)
+    return (
+        tuple(record_dict.get(name) for name in _COPIED_ATTRIBUTES),
+        message,
+        args,
+        exc_text,
+        record.stack_info,
+        extra or None,
+    )
+
+
+def restore_record(compact: CompactRecord, **fields: Any) -> logging.LogRecord:
+    """Return a record made from the result of compact_record, with additional fields."""
+    values, message, args, exc_text, stack_info, extra = compact
+    record_dict: Dict[str, Any] = dict(zip(_COPIED_ATTRIBUTES, values))
+    if extra is not None:
+        record_dict.update(extra)
+    record_dict.update(
+        msg=message,
+        args=args,
+        exc_text=exc_text,
+        stack_info=stack_info,
+        **fields,
+    )
+    return logging.makeLogRecord(record_dict)
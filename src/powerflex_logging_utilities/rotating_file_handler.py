@@ -0,0 +1,259 @@
+"""A rotating file handler that compresses and deletes old log files on a background thread.
+
+Rotated files are named with an increasing index, such as app.log.1, app.log.2, ...
+The newest rotated file has the highest index, so rotating only renames the
+current log file, no matter how many rotated files are kept.
+"""
+import gzip
+import io
+import logging
+import os
+import queue
+import re
+import shutil
+import sys
+import threading
+import time
+import traceback
+from typing import BinaryIO, Dict, List, Literal, Optional, Tuple, cast, get_args
+
+Compression = Literal["gzip", "zstd"]
+
+COMPRESSION_SUFFIXES: Dict[str, str] = {"gzip": ".gz", "zstd": ".zst"}
+
+GZIP_COMPRESS_LEVEL = 6
+
+
+def _compress_gzip(source: BinaryIO, destination: BinaryIO) -> None:
+    with gzip.GzipFile(
+        fileobj=destination, mode="wb", compresslevel=GZIP_COMPRESS_LEVEL
+    ) as compressed:
+        shutil.copyfileobj(source, compressed)
+
+
+def _compress_zstd(source: BinaryIO, destination: BinaryIO) -> None:
+    # pylint: disable=import-outside-toplevel
+    import zstandard  # type: ignore
+
+    zstandard.ZstdCompressor().copy_stream(source, destination)
+
+
+def open_rotated_file(path: str) -> BinaryIO:
+    """Open a log file or a rotated log file for reading, decompressing .gz and .zst files.
+
+    Decompressed files can only seek forward.
+    """
+    if path.endswith(".gz"):
+        return cast(BinaryIO, gzip.open(path, "rb"))
+    if path.endswith(".zst"):
+        # pylint: disable=import-outside-toplevel
+        import zstandard  # type: ignore
+
+        # pylint: disable=consider-using-with
+        return cast(
+            BinaryIO,
+            io.BufferedReader(
+                zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+            ),
+        )
+    return open(path, "rb")  # pylint: disable=consider-using-with
+
+
+class BackgroundRotatingFileHandler(logging.Handler):
+    """Log to a file, rotating it by size and/or age.
+
+    filename - The file to log to. Rotated files are named filename.1, filename.2, ...
+        with a .gz or .zst suffix when they are compressed.
+
+    max_bytes - Rotate before the file grows larger than this. 0 disables size-based rotation.
+
+    interval_seconds - Rotate after logging to the same file for this long.
+        None disables time-based rotation.
+
+    backup_count - How many rotated files to keep. 0 keeps all of them.
+
+    compression - None, "gzip" or "zstd". "zstd" requires the zstandard package.
+
+    Rotating only closes, renames and reopens the log file on the logging thread.
+    Compressing and deleting old files happens on a background thread.
+    Call wait_for_rotation() to wait for it, for example in tests.
+    """
+
+    filename: str
+    max_bytes: int
+    interval_seconds: Optional[float]
+    backup_count: int
+    compression: Optional[Compression]
+    terminator = b"\n"
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        filename: str,
+        max_bytes: int = 0,
+        interval_seconds: Optional[float] = None,
+        backup_count: int = 0,
+        compression: Optional[Compression] = None,
+        level: int = logging.NOTSET,
+    ) -> None:
+        if compression is not None and compression not in get_args(Compression):
+            raise ValueError(
+                f"compression must be None or one of {get_args(Compression)}, not {compression!r}"
+            )
+        if compression == "zstd":
+            # Fail now rather than on the first rotation
+            # pylint: disable=import-outside-toplevel,unused-import
+            import zstandard  # type: ignore
+
+        super().__init__(level)
+        self.filename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.interval_seconds = interval_seconds
+        self.backup_count = backup_count
+        self.compression = compression
+
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        self._segment_pattern = re.compile(
+            re.escape(os.path.basename(self.filename)) + r"\.(\d+)(\.gz|\.zst)?$"
+        )
+        segments = self._list_segments()
+        self._last_index = segments[-1][0] if segments else 0
+
+        self._stream: Optional[BinaryIO] = None
+        self._size = 0
+        self._rollover_at: Optional[float] = None
+        self._open()
+
+        self._jobs: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._worker = threading.Thread(
+            target=self._work, name=f"{type(self).__name__}-{filename}", daemon=True
+        )
+        self._worker.start()
+        if compression is not None:
+            # Compress files left uncompressed by a previous run
+            for _index, path in segments:
+                if not path.endswith((".gz", ".zst")):
+                    self._jobs.put(path)
+
+    def _list_segments(self) -> List[Tuple[int, str]]:
+        """Return the index and path of each rotated file, oldest first."""
+        directory = os.path.dirname(self.filename)
+        segments = []
+        for name in os.listdir(directory):
+            match = self._segment_pattern.match(name)
+            if match:
+                segments.append((int(match.group(1)), os.path.join(directory, name)))
+        segments.sort()
+        return segments
+
+    def _open(self) -> BinaryIO:
+        # pylint: disable=consider-using-with
+        stream = self._stream = open(self.filename, "ab")
+        self._size = stream.tell()
+        if self.interval_seconds is not None:
+            self._rollover_at = time.time() + self.interval_seconds
+        return stream
+
+    def format_bytes(self, record: logging.LogRecord) -> bytes:
+        """Format the record, using the formatter's format_bytes method if it has one."""
+        formatter = self.formatter
+        if formatter is not None and hasattr(formatter, "format_bytes"):
+            data: bytes = formatter.format_bytes(record)
+            return data
+        return self.format(record).encode("utf-8")
+
+    def should_rollover(self, size: int) -> bool:
+        """Return whether to rotate before writing size more bytes."""
+        if self._rollover_at is not None and time.time() >= self._rollover_at:
+            return True
+        return 0 < self.max_bytes < self._size + size and self._size > 0
+
+    def do_rollover(self) -> None:
+        """Rename the current log file to the next index and start a new one."""
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        if os.path.exists(self.filename) and os.path.getsize(self.filename) > 0:
+            self._last_index += 1
+            rotated = f"{self.filename}.{self._last_index}"
+            os.replace(self.filename, rotated)
+            self._jobs.put(rotated)
+        self._open()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            data = self.format_bytes(record) + self.terminator
+            if self.should_rollover(len(data)):
+                self.do_rollover()
+            stream = self._stream or self._open()
+            stream.write(data)
+            stream.flush()
+            self._size += len(data)
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+    def process_rotated_file(self, path: str) -> str:
+        """Compress a rotated file, on the background thread.
+
+        Returns the path of the compressed file. Subclasses can extend this to
+        process rotated files, such as to index them.
+        """
+        if self.compression is None or path.endswith((".gz", ".zst")):
+            return path
+        compressed = path + COMPRESSION_SUFFIXES[self.compression]
+        temporary = compressed + ".tmp"
+        compress = _compress_gzip if self.compression == "gzip" else _compress_zstd
+        with open(path, "rb") as source, open(temporary, "wb") as destination:
+            compress(source, destination)
+        os.replace(temporary, compressed)
+        os.remove(path)
+        return compressed
+
+    def _delete_old_segments(self) -> None:
+        if self.backup_count <= 0:
+            return
+        segments = self._list_segments()
+        for _index, path in segments[: -self.backup_count]:
+            os.remove(path)
+
+    def _work(self) -> None:
+        while True:
+            path = self._jobs.get()
+            try:
+                if path is not None:
+                    if os.path.exists(path):
+                        self.process_rotated_file(path)
+                    self._delete_old_segments()
+            except Exception:  # pylint: disable=broad-except
+                if logging.raiseExceptions:
+                    traceback.print_exc(file=sys.stderr)
+            finally:
+                self._jobs.task_done()
+            if path is None:
+                return
+
+    def wait_for_rotation(self) -> None:
+        """Wait until rotated files are compressed and old files are deleted."""
+        if self._worker.is_alive():
+            self._jobs.join()
+
+    def flush(self) -> None:
+        self.acquire()
+        try:
+            if self._stream is not None:
+                self._stream.flush()
+        finally:
+            self.release()
+
+    def close(self) -> None:
+        """Close the log file and wait for the background thread to finish."""
+        self.acquire()
+        try:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+            if self._worker.is_alive():
+                self._jobs.put(None)
+        finally:
+            self.release()
+        self._worker.join()
+        super().close()
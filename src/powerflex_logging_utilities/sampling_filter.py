@@ -0,0 +1,123 @@
+"""A logging filter that keeps a sample of the records at verbose levels such as DEBUG and TRACE."""
+import logging
+import random
+import threading
+import time
+import zlib
+from contextvars import ContextVar
+from typing import Any, Dict, Mapping, Optional, Union
+
+from powerflex_logging_utilities.trace_logger import level_number
+
+# The highest value of zlib.crc32, plus one
+_CRC32_RANGE = float(2**32)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a random sample of the records at some levels.
+
+    sample_rates - The fraction of records to keep for each level, such as
+        {"TRACE": 0.01, "DEBUG": 0.1}. Records at other levels are always kept.
+
+    sample_by - A record attribute name, such as "request_id", or a ContextVar.
+        Records with the same value are either all kept or all dropped, so a
+        sampled request keeps all its records. Records without a value are sampled randomly.
+
+    max_records_per_second - If not None, lower the sample rates when more than
+        this many sampled records per second would be kept. Every second, the
+        rates are multiplied by a factor so that the expected number of kept
+        records fits this budget. Records over the budget within a second are dropped.
+
+    Kept records that were sampled have a sample_rate field with the rate used.
+
+    A filter instance can be shared by several handlers. Each record is only
+    sampled once, even if it goes through several handlers.
+    """
+
+    sample_rates: Dict[int, float]
+    sample_by: Union[str, "ContextVar[Any]", None]
+    max_records_per_second: Optional[float]
+    sample_rate_factor: float
+    dropped_total: int
+
+    def __init__(
+        self,
+        sample_rates: Mapping[Union[str, int], float],
+        sample_by: Union[str, "ContextVar[Any]", None] = None,
+        max_records_per_second: Optional[float] = None,
+    ) -> None:
+        super().__init__()
+        self.sample_rates = {
+            level_number(level): rate for level, rate in sample_rates.items()
+        }
+        self.sample_by = sample_by
+        self.max_records_per_second = max_records_per_second
+        self.sample_rate_factor = 1.0
+        self.dropped_total = 0
+
+        self._lock = threading.Lock()
+        self._window_end = time.monotonic() + 1
+        # Records kept in the current window, and the expected number of kept
+        # records if sample_rate_factor was 1
+        self._window_kept = 0
+        self._window_expected = 0.0
+
+    def _get_sample_by_value(self, record: logging.LogRecord) -> Any:
+        if self.sample_by is None:
+            return None
+        if isinstance(self.sample_by, str):
+            return record.__dict__.get(self.sample_by)
+        return self.sample_by.get(None)
+
+    def _adapt(self, rate: float, budget: float) -> float:
+        """Return the rate to use for a record, given the budget of records per second.
+
+        Returns 0 if the budget is used up for the current second.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._window_end:
+                # Choose the factor that would have kept the last window within budget
+                if self._window_expected > 0:
+                    self.sample_rate_factor = min(1.0, budget / self._window_expected)
+                else:
+                    self.sample_rate_factor = 1.0
+                self._window_end = now + 1
+                self._window_kept = 0
+                self._window_expected = 0.0
+            self._window_expected += rate
+            if self._window_kept >= budget:
+                return 0.0
+            return rate * self.sample_rate_factor
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.sample_rates.get(record.levelno)
+        if rate is None:
+            return True
+        record_dict = record.__dict__
+        # Don't sample a record twice when this filter is shared by several handlers
+        cached = record_dict.get("_sampling_decision")
+        if cached is not None and cached[0] is self:
+            kept: bool = cached[1]
+            return kept
+
+        budget = self.max_records_per_second
+        if budget is not None:
+            rate = self._adapt(rate, budget)
+
+        value = self._get_sample_by_value(record)
+        if value is None:
+            kept = random.random() < rate
+        else:
+            kept = zlib.crc32(str(value).encode("utf-8")) / _CRC32_RANGE < rate
+
+        if kept:
+            if rate < 1:
+                record.sample_rate = rate
+            if budget is not None:
+                with self._lock:
+                    self._window_kept += 1
+        else:
+            self.dropped_total += 1
+        record_dict["_sampling_decision"] = (self, kept)
+        return kept
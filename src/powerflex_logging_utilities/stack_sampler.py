@@ -0,0 +1,158 @@
+"""Sample the stack of async loop callbacks that run for too long.
+
+A watchdog thread looks at the stack of each thread running an async callback
+for longer than a threshold. The samples are folded stacks, the format used by
+flamegraph.pl and speedscope: one line per distinct stack, with the frames
+from the outermost to the innermost separated by semicolons, then the number of samples.
+"""
+import asyncio.events
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType, FrameType
+from typing import Any, Callable, Dict, List, Optional
+
+DEFAULT_SAMPLE_INTERVAL_SEC = 0.01
+DEFAULT_MAX_SAMPLES = 200
+DEFAULT_MAX_DEPTH = 64
+
+_ASYNCIO_EVENTS_FILE = asyncio.events.__file__
+
+
+class _RunningCallback:
+    __slots__ = ("started_at", "samples")
+
+    def __init__(self, started_at: float) -> None:
+        self.started_at = started_at
+        self.samples: Optional["Counter[str]"] = None
+
+
+def format_folded_stacks(samples: "Counter[str]") -> str:
+    """Return one "frame;frame;frame count" line per stack, most sampled first."""
+    return "\n".join(f"{stack} {count}" for stack, count in samples.most_common())
+
+
+class StackSampler:
+    """Sample the stacks of async callbacks running longer than threshold_sec.
+
+    threshold_sec - Start sampling a callback once it has run this long.
+
+    interval_sec - How often the watchdog thread takes samples.
+
+    max_samples - The maximum number of samples kept for a single callback.
+
+    max_depth - The maximum number of frames kept in each sample.
+
+    The overhead is a few attribute writes for each callback, and sampling only
+    happens while a callback is slower than threshold_sec.
+
+    Call install() to start sampling, and pop_samples() from the loop thread
+    right after a slow callback, for example in an aiodebug on_slow_callback hook.
+    """
+
+    def __init__(
+        self,
+        threshold_sec: float,
+        interval_sec: float = DEFAULT_SAMPLE_INTERVAL_SEC,
+        max_samples: int = DEFAULT_MAX_SAMPLES,
+        max_depth: int = DEFAULT_MAX_DEPTH,
+    ) -> None:
+        self.threshold_sec = threshold_sec
+        self.interval_sec = interval_sec
+        self.max_samples = max_samples
+        self.max_depth = max_depth
+        # The callback running in each thread, and the samples of the last one
+        self._running: Dict[int, _RunningCallback] = {}
+        self._last_samples: Dict[int, "Counter[str]"] = {}
+        self._original_run: Optional[Callable[[Any], Any]] = None
+        self._sampled_run_code: Optional[CodeType] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def install(self) -> None:
+        """Wrap asyncio's callback runner and start the watchdog thread.
+
+        Install before aiodebug.log_slow_callbacks.enable so that the samples
+        are ready when its on_slow_callback hook runs.
+        """
+        if self._original_run is not None:
+            return
+        # pylint: disable=protected-access
+        original_run = self._original_run = asyncio.events.Handle._run
+        running = self._running
+        last_samples = self._last_samples
+
+        def sampled_run(handle: asyncio.events.Handle) -> Any:
+            thread_id = threading.get_ident()
+            callback = running[thread_id] = _RunningCallback(time.monotonic())
+            try:
+                return original_run(handle)
+            finally:
+                running.pop(thread_id, None)
+                if callback.samples is not None:
+                    last_samples[thread_id] = callback.samples
+
+        self._sampled_run_code = sampled_run.__code__
+        asyncio.events.Handle._run = sampled_run  # type: ignore
+        self._stop.clear()
+        self._watchdog = threading.Thread(
+            target=self._watch, name=type(self).__name__, daemon=True
+        )
+        self._watchdog.start()
+
+    def uninstall(self) -> None:
+        """Stop the watchdog thread and restore asyncio's callback runner.
+
+        Does nothing to the callback runner if another wrapper was installed after this one.
+        """
+        if self._original_run is None:
+            return
+        # pylint: disable=protected-access
+        if asyncio.events.Handle._run.__code__ is self._sampled_run_code:  # type: ignore
+            asyncio.events.Handle._run = self._original_run  # type: ignore
+        self._original_run = None
+        self._stop.set()
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    def fold(self, frame: Optional[FrameType]) -> str:
+        """Return the stack of the callback as a folded stack, outermost frame first."""
+        frames: List[str] = []
+        while frame is not None and len(frames) < self.max_depth:
+            code = frame.f_code
+            # Stop at asyncio's Handle._run, below any wrappers such as aiodebug's
+            if code.co_name == "_run" and code.co_filename == _ASYNCIO_EVENTS_FILE:
+                break
+            if code is self._sampled_run_code:
+                break
+            frames.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+            frame = frame.f_back
+        frames.reverse()
+        return ";".join(frames)
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval_sec):
+            now = time.monotonic()
+            frames = None
+            for thread_id, callback in list(self._running.items()):
+                if now - callback.started_at < self.threshold_sec:
+                    continue
+                samples = callback.samples
+                if samples is None:
+                    samples = callback.samples = Counter()
+                elif sum(samples.values()) >= self.max_samples:
+                    continue
+                if frames is None:
+                    frames = sys._current_frames()  # pylint: disable=protected-access
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[self.fold(frame)] += 1
+
+    def pop_samples(self) -> Optional[str]:
+        """Return the folded stacks of the last slow callback of the current thread, once."""
+        samples = self._last_samples.pop(threading.get_ident(), None)
+        if not samples:
+            return None
+        return format_folded_stacks(samples)
@@ -2,16 +2,208 @@
 
 Import this module to enable trace logging.
 """
+import io
 import logging
-from typing import Mapping, Union
+import operator
+import os
+import sys
+import traceback
+from types import CodeType, FrameType
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple, Union
 
 TRACE = 5
 
 logging.addLevelName(TRACE, "TRACE")
 
+_NOT_EVALUATED = object()
+
+_UNKNOWN_CALLER = ("(unknown file)", 0, "(unknown function)", None)
+
+# Whether each code object belongs to the logging module, keyed by code object
+_is_internal_code: Dict[CodeType, bool] = {}
+
+# The file, line number and function name of each call site, keyed by the
+# caller's code object and the offset of its last instruction
+_call_sites: Dict[Tuple[CodeType, int], Tuple[str, int, str]] = {}
+_MAX_CALL_SITES = 10000
+
+
+class Lazy:
+    """A log message or argument that is only computed when a handler emits the record.
+
+    Lazy(func, *args, **kwargs) calls func(*args, **kwargs) the first time the
+    record's message is formatted, and never if the record is not emitted.
+
+    Usage:
+        logger.trace("State: %s", Lazy(json.dumps, state, indent=2))
+        logger.debug(Lazy(lambda: f"Expensive message {compute()}"))
+    """
+
+    __slots__ = ("_func", "_args", "_kwargs", "_value")
+
+    def __init__(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._value: Any = _NOT_EVALUATED
+
+    @property
+    def value(self) -> Any:
+        """The result of calling the function. It is only called once."""
+        if self._value is _NOT_EVALUATED:
+            self._value = self._func(*self._args, **self._kwargs)
+        return self._value
+
+    def __str__(self) -> str:
+        return str(self.value)
+
+    def __repr__(self) -> str:
+        return repr(self.value)
+
+    def __format__(self, format_spec: str) -> str:
+        return format(self.value, format_spec)
+
+    def __int__(self) -> int:
+        return int(self.value)
+
+    def __index__(self) -> int:
+        return operator.index(self.value)
+
+    def __float__(self) -> float:
+        return float(self.value)
+
+
+def _is_internal_frame(frame: FrameType) -> bool:
+    """Return whether the frame belongs to the logging module, caching the answer per code object."""
+    code = frame.f_code
+    try:
+        return _is_internal_code[code]
+    except KeyError:
+        filename = os.path.normcase(code.co_filename)
+        # pylint: disable=protected-access
+        is_internal = filename == logging._srcfile or (  # type: ignore
+            "importlib" in filename and "_bootstrap" in filename
+        )
+        _is_internal_code[code] = is_internal
+        return is_internal
+
+
+def level_number(level: Union[str, int]) -> int:
+    """Return the number of a level given by name or number, such as "TRACE" or 5.
+
+    Names are case insensitive. Raises ValueError for unknown level names.
+    """
+    if isinstance(level, int):
+        return level
+    number = logging.getLevelName(level.upper())
+    if not isinstance(number, int):
+        raise ValueError(f"Unknown log level {level!r}")
+    return number
+
 
 class TraceLogger(logging.Logger):
-    """A logging.Logger subclass that can log at the trace severity level."""
+    """A logging.Logger subclass that can log at the trace severity level.
+
+    When TRACE is disabled, trace() returns after a single level check.
+    Use Lazy for messages and arguments that are expensive to compute; they
+    are only evaluated when a handler emits the record, at any level.
+
+    Finding the caller's file, line number and function name is faster than
+    with logging.Logger, and can be turned off for records below
+    caller_info_level. See set_caller_info_level.
+    """
+
+    # Only find the caller of records at or above this level
+    caller_info_level: int = logging.NOTSET
+
+    @classmethod
+    def set_caller_info_level(cls, level: Optional[Union[str, int]]) -> None:
+        """Only find the caller's file, line number and function for records at or above level.
+
+        Records below the level get the same "(unknown file)" placeholders as
+        when logging._srcfile is None. None finds the caller of every record.
+        This applies to every TraceLogger; set caller_info_level on a single
+        TraceLogger to change only that logger.
+        """
+        cls.caller_info_level = logging.NOTSET if level is None else level_number(level)
+
+    def findCaller(
+        self, stack_info: bool = False, stacklevel: int = 1
+    ) -> Tuple[str, int, str, Optional[str]]:
+        """Find the caller like logging.Logger.findCaller in Python 3.11+ does.
+
+        Whether a frame belongs to the logging module is cached per code object,
+        and the caller's file, line number and function name are cached per
+        call site. stacklevel counts the same way in every Python version.
+        """
+        # pylint: disable=protected-access
+        frame: Optional[FrameType] = sys._getframe(0)
+        is_internal_code = _is_internal_code
+        while stacklevel > 0 and frame is not None:
+            next_frame = frame.f_back
+            if next_frame is None:
+                break
+            frame = next_frame
+            is_internal = is_internal_code.get(frame.f_code)
+            if is_internal is None:
+                is_internal = _is_internal_frame(frame)
+            if not is_internal:
+                stacklevel -= 1
+        if frame is None:  # pragma: no cover
+            return _UNKNOWN_CALLER
+
+        sinfo = None
+        if stack_info:
+            with io.StringIO() as sio:
+                sio.write("Stack (most recent call last):\n")
+                traceback.print_stack(frame, file=sio)
+                sinfo = sio.getvalue()
+                if sinfo[-1] == "\n":
+                    sinfo = sinfo[:-1]
+        call_site = (frame.f_code, frame.f_lasti)
+        try:
+            pathname, lineno, func = _call_sites[call_site]
+        except KeyError:
+            code = frame.f_code
+            pathname, lineno, func = code.co_filename, frame.f_lineno, code.co_name
+            if len(_call_sites) >= _MAX_CALL_SITES:
+                _call_sites.clear()
+            _call_sites[call_site] = pathname, lineno, func
+        return pathname, lineno, func, sinfo
+
+    def _log(  # pylint: disable=arguments-differ
+        self,
+        level: int,
+        msg: object,
+        args: Any,
+        exc_info: Any = None,
+        extra: Optional[Mapping[str, object]] = None,
+        stack_info: bool = False,
+        stacklevel: int = 1,
+    ) -> None:
+        """Create a LogRecord and handle it, like logging.Logger._log.
+
+        Skips finding the caller for records below caller_info_level.
+        """
+        # pylint: disable=protected-access
+        if logging._srcfile and (  # type: ignore
+            stack_info or level >= self.caller_info_level
+        ):
+            try:
+                pathname, lineno, func, sinfo = self.findCaller(stack_info, stacklevel)
+            except ValueError:  # pragma: no cover
+                pathname, lineno, func, sinfo = _UNKNOWN_CALLER
+        else:
+            pathname, lineno, func, sinfo = _UNKNOWN_CALLER
+        if exc_info:
+            if isinstance(exc_info, BaseException):
+                exc_info = (type(exc_info), exc_info, exc_info.__traceback__)
+            elif not isinstance(exc_info, tuple):
+                exc_info = sys.exc_info()
+        record = self.makeRecord(
+            self.name, level, pathname, lineno, msg, args, exc_info, func, extra, sinfo
+        )
+        self.handle(record)
 
     def trace(
         self,
@@ -26,12 +218,19 @@ class TraceLogger(logging.Logger):
 
         Usage is the same as other logging methods, such as Logger.info.
         """
-        self.log(
-            TRACE,
-            msg,
-            *args,
-            exc_info=exc_info,
-            stack_info=stack_info,
-            stacklevel=stacklevel,
-            extra=extra,
-        )
+        if self.isEnabledFor(TRACE):
+            self._log(
+                TRACE,
+                msg,
+                args,
+                exc_info=exc_info,
+                stack_info=stack_info,
+                stacklevel=stacklevel,
+                extra=extra,
+            )
+
+
+# The frames of these methods are skipped when finding the caller, like the
+# frames of the logging module
+_is_internal_code[TraceLogger.findCaller.__code__] = True
+_is_internal_code[TraceLogger._log.__code__] = True  # pylint: disable=protected-access
@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+
+from powerflex_logging_utilities import benchmark
+from powerflex_logging_utilities.compact_log_record import CompactLogRecord
+
+TEST_RECORDS = 40
+
+
+class Test(unittest.TestCase):
+    def test_run_benchmark(self):
+        results = benchmark.run_benchmark(
+            list(benchmark.SCENARIOS),
+            benchmark.PRODUCERS,
+            records=TEST_RECORDS,
+            threads=3,
+            tasks=3,
+            alloc_records=5,
+        )
+        self.assertEqual(
+            set(results),
+            {
+                f"{scenario}/{producer}"
+                for scenario in benchmark.SCENARIOS
+                for producer in benchmark.PRODUCERS
+            },
+        )
+        for name, metrics in results.items():
+            with self.subTest(run=name):
+                self.assertGreater(metrics["records_per_sec"], 0)
+                self.assertLessEqual(metrics["p50_us"], metrics["p99_us"])
+                self.assertLessEqual(metrics["p99_us"], metrics["p999_us"])
+                self.assertIn("alloc_peak_bytes_per_record", metrics)
+                self.assertIn("retained_blocks_per_record", metrics)
+
+    def test_unknown_producer(self):
+        with self.assertRaisesRegex(ValueError, "Unknown producer"):
+            benchmark.run_producers(lambda i: None, "processes", 1, 1)
+
+    def test_percentile(self):
+        self.assertEqual(benchmark.percentile([], 0.5), 0)
+        self.assertEqual(benchmark.percentile(list(range(100)), 0.99), 99)
+        self.assertEqual(benchmark.percentile(list(range(1000)), 0.999), 999)
+
+    def test_main_save_and_compare(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            baseline_path = os.path.join(tmpdir, "baseline.json")
+            args = [
+                "--scenarios",
+                "json_formatter",
+                "--producers",
+                "single",
+                "--records",
+                str(TEST_RECORDS),
+                "--alloc-records",
+                "5",
+            ]
+
+            with redirect_stdout(StringIO()) as output:
+                self.assertEqual(benchmark.main([*args, "--save", baseline_path]), 0)
+            self.assertIn("json_formatter/single", output.getvalue())
+
+            with open(baseline_path, encoding="utf-8") as baseline_file:
+                baseline = json.load(baseline_file)
+            self.assertIn("json_formatter/single", baseline["results"])
+
+            with redirect_stdout(StringIO()) as output:
+                self.assertEqual(
+                    benchmark.main(
+                        [*args, "--compare", baseline_path, "--tolerance", "1"]
+                    ),
+                    0,
+                )
+            self.assertIn("x", output.getvalue().splitlines()[1])
+
+            baseline["results"]["json_formatter/single"]["records_per_sec"] *= 1000
+            with open(baseline_path, "w", encoding="utf-8") as baseline_file:
+                json.dump(baseline, baseline_file)
+            with redirect_stdout(StringIO()) as output:
+                self.assertEqual(benchmark.main([*args, "--compare", baseline_path]), 1)
+            self.assertIn("Regressions", output.getvalue())
+
+    def test_main_unknown_names(self):
+        for args in [["--scenarios", "unknown"], ["--producers", "unknown"]]:
+            with self.subTest(args=args):
+                with self.assertRaises(SystemExit), redirect_stderr(StringIO()):
+                    benchmark.main(args)
+
+    def test_buffered_memory(self):
+        self.assertLess(
+            benchmark.measure_buffered_memory(CompactLogRecord, records=1000),
+            benchmark.measure_buffered_memory(logging.LogRecord, records=1000),
+        )
@@ -0,0 +1,203 @@
+import datetime
+import io
+import logging
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from unittest.mock import patch
+
+from powerflex_logging_utilities import JsonFormatter, init_loggers
+from powerflex_logging_utilities.binary_log_format import (
+    SEGMENT_HEADER,
+    BinaryRecordEncoder,
+    BinaryRotatingFileHandler,
+    decode_files,
+    main,
+    read_binary_log,
+)
+
+
+def make_logger(name: str, *handlers: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.handlers = list(handlers)
+    logger.setLevel("DEBUG")
+    return logger
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.filename = os.path.join(self.tmpdir.name, "logs", "test.log")
+
+    @staticmethod
+    def segments(filename):
+        """Return the log files, oldest first."""
+        directory = os.path.dirname(filename)
+        rotated = sorted(
+            (int(name.split(".")[2]), name)
+            for name in os.listdir(directory)
+            if name != os.path.basename(filename)
+        )
+        return [os.path.join(directory, name) for _index, name in rotated] + [filename]
+
+    def test_same_json_lines(self):
+        for compression in [None, "gzip"]:
+            with self.subTest(compression=compression):
+                filename = os.path.join(self.tmpdir.name, str(compression), "test.log")
+                handler = BinaryRotatingFileHandler(
+                    filename, max_bytes=300, compression=compression
+                )
+                handler.setFormatter(JsonFormatter())
+                stream = io.StringIO()
+                stream_handler = logging.StreamHandler(stream)
+                stream_handler.setFormatter(JsonFormatter())
+                logger = make_logger(
+                    f"test-binary-{compression}", handler, stream_handler
+                )
+
+                for i in range(10):
+                    logger.info(
+                        "héllo %s",
+                        i,
+                        extra={
+                            "nested": {1: 2.5, None: [1, -3, 2**70], "list": (True,)},
+                            "time": datetime.datetime(2020, 1, 2, 3, 4, 5),
+                        },
+                    )
+                try:
+                    raise ValueError("boom")
+                except ValueError:
+                    logger.exception("failed")
+                logger.info({"dict": "message"})
+                handler.close()
+                handler.wait_for_rotation()
+
+                self.assertGreater(len(self.segments(filename)), 2)
+                output = io.StringIO()
+                decode_files(self.segments(filename), output)
+                self.assertEqual(output.getvalue(), stream.getvalue())
+
+    def test_appending_starts_a_segment(self):
+        for run in range(2):
+            handler = BinaryRotatingFileHandler(self.filename)
+            logger = make_logger("test-binary-append", handler)
+            logger.warning("run %s", run)
+            handler.close()
+        with open(self.filename, "rb") as log_file:
+            self.assertEqual(log_file.read().count(SEGMENT_HEADER), 2)
+            log_file.seek(0)
+            records = list(read_binary_log(log_file))
+        self.assertEqual([record["message"] for record in records], ["run 0", "run 1"])
+        self.assertEqual(records[1]["severity"], "WARNING")
+
+    def test_smaller_than_json(self):
+        formatter = JsonFormatter()
+        encoder = BinaryRecordEncoder(default=formatter.json_default_function)
+        record = logging.LogRecord(
+            "benchmark", logging.DEBUG, __file__, 1, "message %s", (1,), None
+        )
+        log_record = formatter.make_log_record(record)
+        json_size = len(formatter.serialize_log_record(log_record))
+        with self.subTest(test="first record defines the strings"):
+            self.assertLess(len(encoder.encode(log_record)), json_size)
+        with self.subTest(test="next records refer to them"):
+            self.assertLess(len(encoder.encode(log_record)), json_size / 2)
+        with self.subTest(test="values without a default function"):
+            with self.assertRaises(TypeError):
+                BinaryRecordEncoder().encode({"value": object()})
+
+    def test_failed_records(self):
+        handler = BinaryRotatingFileHandler(self.filename)
+        # Truncating would cut the reference cycle
+        handler.setFormatter(JsonFormatter(max_payload_bytes=None))
+        logger = make_logger("test-binary-failed", handler)
+        circular: dict = {}
+        circular["self"] = circular
+        with patch.object(logging, "raiseExceptions", False):
+            logger.info("first", extra={"circular": circular, "new_key": 1})
+            logger.info("second", extra={"new_key": 2})
+        handler.close()
+        with open(self.filename, "rb") as log_file:
+            records = list(read_binary_log(log_file))
+        self.assertEqual(
+            [(record["message"], record["new_key"]) for record in records],
+            [("second", 2)],
+        )
+
+        with self.subTest(test="encoder"):
+            encoder = BinaryRecordEncoder()
+            with self.assertRaises(ValueError):
+                encoder.encode({"key": "value", "circular": circular})
+            self.assertEqual(encoder.string_count, 0)
+            encoder.encode({"key": "value"})
+            self.assertEqual(encoder.string_count, 1)
+            encoder.forget_strings(0)
+            self.assertEqual(encoder.string_count, 0)
+
+    def test_init_loggers_binary(self):
+        loggers = [
+            make_logger("test-binary-init-a"),
+            make_logger("test-binary-init-b"),
+        ]
+        init_loggers.init_loggers(
+            loggers,
+            log_level="CRITICAL",
+            file_log_level="INFO",
+            filename=self.filename,
+            stream=io.StringIO(),
+            file_format="binary",
+        )
+        with self.subTest(test="loggers share one file handler"):
+            self.assertIs(loggers[0].handlers[1], loggers[1].handlers[1])
+            self.assertIsInstance(loggers[0].handlers[1], BinaryRotatingFileHandler)
+        for logger in loggers:
+            logger.info("from %s", logger.name)
+        loggers[0].handlers[1].close()
+
+        with self.subTest(test="command"):
+            stdout = io.StringIO()
+            with redirect_stdout(stdout):
+                self.assertEqual(main([self.filename]), 0)
+            self.assertEqual(
+                [
+                    line.split('"message": ')[1][:25]
+                    for line in stdout.getvalue().splitlines()
+                ],
+                ['"from test-binary-init-a"', '"from test-binary-init-b"'],
+            )
+
+        with self.subTest(test="invalid file format"):
+            with self.assertRaises(ValueError):
+                init_loggers.init_loggers(
+                    [make_logger("test-binary-invalid")],
+                    log_level="INFO",
+                    file_log_level="INFO",
+                    filename=self.filename,
+                    file_format="xml",
+                )
+
+    def test_invalid_files(self):
+        not_binary = os.path.join(self.tmpdir.name, "not-binary.log")
+        with open(not_binary, "w", encoding="utf-8") as log_file:
+            log_file.write('{"message": "json"}\n')
+        truncated = os.path.join(self.tmpdir.name, "truncated.log")
+        with open(truncated, "wb") as log_file:
+            log_file.write(SEGMENT_HEADER + b"\x10\x09")
+        unknown_string = os.path.join(self.tmpdir.name, "unknown-string.log")
+        with open(unknown_string, "wb") as log_file:
+            # A dict with a key referring to the string 5 of an empty table
+            log_file.write(SEGMENT_HEADER + b"\x05\x09\x01\x07\x05\x00")
+        for path, error in [
+            (not_binary, "Not a binary log file"),
+            (truncated, "Truncated binary log record"),
+            (unknown_string, "Invalid binary log record"),
+        ]:
+            with self.subTest(path=path):
+                stderr = io.StringIO()
+                with redirect_stderr(stderr), redirect_stdout(io.StringIO()):
+                    self.assertEqual(main([path]), 1)
+                self.assertIn(error, stderr.getvalue())
@@ -0,0 +1,192 @@
+import copy
+import io
+import json
+import logging
+import pickle
+import unittest
+from unittest.mock import patch
+
+from powerflex_logging_utilities import JsonFormatter, TraceLogger, init_loggers
+from powerflex_logging_utilities.compact_log_record import (
+    _NOT_COMPUTED,
+    STANDARD_ATTRIBUTES,
+    CompactLogRecord,
+)
+from powerflex_logging_utilities.log_context import log_context
+from powerflex_logging_utilities.queue_handler import BackgroundQueueHandler
+from powerflex_logging_utilities.record_snapshot import compact_record, restore_record
+from powerflex_logging_utilities.trace_logger import TRACE
+
+
+def make_records(msg="hello %s", args=("é",), extra=None):
+    records = []
+    for record_class in [logging.LogRecord, CompactLogRecord]:
+        record = record_class(
+            "test-compact", logging.INFO, __file__, 10, msg, args, None, "func"
+        )
+        record.created = 1700000000.5
+        record.msecs = 500.0
+        record.relativeCreated = 1.5
+        record.__dict__.update(extra or {})
+        records.append(record)
+    return records[0], records[1]
+
+
+def make_logger(name, logger_class=logging.Logger):
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    logger = logger_class(name)
+    logger.propagate = False
+    logger.handlers = [handler]
+    logger.setLevel(TRACE)
+    return logger, handler, stream
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(logging.setLogRecordFactory, logging.getLogRecordFactory())
+
+    def test_attributes(self):
+        record, compact = make_records(extra={"request_id": "abc"})
+        self.assertEqual(dict(compact.__dict__), record.__dict__)
+        self.assertEqual(list(compact.__dict__), list(record.__dict__))
+        self.assertEqual(compact.__dict__.overflow, {"request_id": "abc"})
+        for name in STANDARD_ATTRIBUTES:
+            with self.subTest(name=name):
+                self.assertEqual(getattr(compact, name), getattr(record, name))
+
+        with self.subTest(test="no instance dict without extra attributes"):
+            _record, compact = make_records()
+            self.assertEqual(compact.__dict__.overflow, {})
+            compact.getMessage()
+            self.assertEqual(compact.__dict__.overflow, {})
+
+        with self.subTest(test="mapping"):
+            attributes = compact.__dict__
+            attributes["message"] = "set"
+            self.assertEqual(compact.message, "set")  # type: ignore
+            self.assertIn("message", attributes)
+            del attributes["message"]
+            self.assertNotIn("message", attributes)
+            with self.assertRaises(KeyError):
+                attributes["message"]  # pylint: disable=pointless-statement
+            with self.assertRaises(KeyError):
+                attributes["missing"]  # pylint: disable=pointless-statement
+            self.assertIsNone(attributes.get("asctime"))
+            self.assertEqual(len(attributes), len(STANDARD_ATTRIBUTES))
+
+    def test_lazy_attributes(self):
+        record = CompactLogRecord(
+            "test-compact", logging.INFO, __file__, 10, "hello", None, None
+        )
+        # Not computed yet
+        # pylint: disable=protected-access
+        self.assertEqual(record._relative_created, record._process_name)
+        self.assertGreater(record.relativeCreated, 0)
+        self.assertEqual(record.processName, "MainProcess")
+        self.assertEqual(record.msecs, int(record.msecs))
+        with patch.object(logging, "logMultiprocessing", False):
+            record.processName = None
+            self.assertIsNone(record.processName)
+
+    def test_json_formatter(self):
+        formatters = [
+            JsonFormatter(),
+            JsonFormatter(fmt="%(message)s %(request_id)s %(relativeCreated)s"),
+            JsonFormatter(reserved_attrs=[]),
+            JsonFormatter(rename_fields={"name": "logger"}),
+            logging.Formatter("%(asctime)s %(processName)s %(message)s"),
+        ]
+        try:
+            formatters.append(JsonFormatter(serializer="orjson"))
+        except ImportError:
+            pass
+        for formatter in formatters:
+            for extra in [{}, {"request_id": "abc", 1: "key"}]:
+                with self.subTest(formatter=formatter, extra=extra):
+                    record, compact = make_records(extra=extra)
+                    self.assertEqual(
+                        formatter.format(compact), formatter.format(record)
+                    )
+
+        with self.subTest(test="dict messages"):
+            formatter = JsonFormatter()
+            record, compact = make_records(msg={"event": "started"}, args=None)
+            self.assertEqual(formatter.format(compact), formatter.format(record))
+
+        with self.subTest(test="log context"):
+            formatter = JsonFormatter()
+            with log_context(request_id="context"):
+                record, compact = make_records()
+                self.assertEqual(formatter.format(compact), formatter.format(record))
+
+    def test_loggers(self):
+        logging.setLogRecordFactory(CompactLogRecord)
+        for logger_class in [logging.Logger, TraceLogger]:
+            with self.subTest(logger_class=logger_class):
+                logger, _handler, stream = make_logger("test-compact", logger_class)
+                logger.info("hello %s", "world", extra={"request_id": "abc"})
+                if isinstance(logger, TraceLogger):
+                    logger.trace("traced")
+                line = json.loads(stream.getvalue().splitlines()[0])
+                self.assertEqual(line["message"], "hello world")
+                self.assertEqual(line["request_id"], "abc")
+                self.assertEqual(line["funcName"], "test_loggers")
+
+                with self.assertRaisesRegex(KeyError, "Attempt to overwrite 'name'"):
+                    logger.info("hello", extra={"name": "other"})
+
+    def test_copies(self):
+        _record, compact = make_records(extra={"request_id": "abc"})
+        compact.message = compact.getMessage()
+        for copied in [copy.copy(compact), pickle.loads(pickle.dumps(compact))]:
+            with self.subTest(copied=copied):
+                self.assertIsInstance(copied, CompactLogRecord)
+                self.assertEqual(dict(copied.__dict__), dict(compact.__dict__))
+                copied.request_id = "changed"
+                self.assertEqual(compact.request_id, "abc")  # type: ignore
+
+        with self.subTest(test="lazy attributes are not computed"):
+            _record, lazy = make_records()
+            # pylint: disable=protected-access
+            lazy._relative_created = lazy._process_name = _NOT_COMPUTED
+            for copied in [copy.copy(lazy), pickle.loads(pickle.dumps(lazy))]:
+                self.assertIs(copied._relative_created, _NOT_COMPUTED)
+                self.assertIs(copied._process_name, _NOT_COMPUTED)
+                self.assertEqual(copied.processName, "MainProcess")
+                self.assertIsInstance(copied.relativeCreated, float)
+            self.assertIs(lazy._relative_created, _NOT_COMPUTED)
+            self.assertIs(lazy._process_name, _NOT_COMPUTED)
+
+        with self.subTest(test="flight recorder records"):
+            restored = restore_record(compact_record(compact))
+            self.assertEqual(restored.getMessage(), "hello é")
+            self.assertEqual(restored.request_id, "abc")  # type: ignore
+
+    def test_queue_handler(self):
+        logging.setLogRecordFactory(CompactLogRecord)
+        logger, stream_handler, stream = make_logger("test-compact-queue")
+        handler = BackgroundQueueHandler([stream_handler])
+        logger.handlers = [handler]
+        with log_context(request_id="context"):
+            logger.info("hello %s", "world", extra={"count": 1})
+        handler.close()
+        line = json.loads(stream.getvalue())
+        self.assertEqual(line["message"], "hello world")
+        self.assertEqual(line["request_id"], "context")
+        self.assertEqual(line["count"], 1)
+
+    def test_init_loggers(self):
+        logging.setLogRecordFactory(logging.LogRecord)
+        logger = logging.getLogger("test-compact-init")
+        logger.propagate = False
+        self.addCleanup(logger.handlers.clear)
+        init_loggers.init_loggers(
+            [logger], "INFO", None, None, stream=io.StringIO(), compact_records=True
+        )
+        self.assertIs(logging.getLogRecordFactory(), CompactLogRecord)
+        self.assertIsInstance(
+            logger.makeRecord("test", logging.INFO, __file__, 1, "", (), None),
+            CompactLogRecord,
+        )
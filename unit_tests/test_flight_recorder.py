@@ -0,0 +1,170 @@
+import json
+import logging
+import unittest
+from io import StringIO
+from unittest.mock import Mock
+
+from powerflex_logging_utilities import (
+    TRACE,
+    JsonFormatter,
+    Lazy,
+    TraceLogger,
+    init_loggers,
+)
+from powerflex_logging_utilities.flight_recorder import FlightRecorderHandler
+from powerflex_logging_utilities.log_level_listener import (
+    BaseAsyncLogLevelListener,
+    LogLevelListenerConfig,
+)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self, level: int = logging.NOTSET):
+        super().__init__(level)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_logger(name: str, handler: logging.Handler) -> TraceLogger:
+    logger = TraceLogger(name)
+    logger.addHandler(handler)
+    logger.setLevel(TRACE)
+    return logger
+
+
+class Test(unittest.TestCase):
+    def test_dump_on_error(self):
+        info_handler = ListHandler(logging.INFO)
+        debug_handler = ListHandler(logging.DEBUG)
+        flight_recorder = FlightRecorderHandler([info_handler, debug_handler])
+        logger = make_logger("test-flight-recorder", flight_recorder)
+
+        logger.trace("trace %s", 1, extra={"field": [1]})
+        logger.debug("debug %s", 2)
+        logger.info("info %s", 3)
+        self.assertEqual([r.getMessage() for r in info_handler.records], ["info 3"])
+        self.assertEqual(
+            [r.getMessage() for r in debug_handler.records], ["debug 2", "info 3"]
+        )
+        self.assertEqual(flight_recorder.recorded_count, 2)
+
+        try:
+            raise RuntimeError("oops")
+        except RuntimeError:
+            logger.exception("error")
+
+        self.assertEqual(
+            [r.getMessage() for r in info_handler.records],
+            ["info 3", "trace 1", "debug 2", "error"],
+        )
+        self.assertEqual(
+            [r.getMessage() for r in debug_handler.records],
+            ["debug 2", "info 3", "trace 1", "error"],
+        )
+        replayed = info_handler.records[1]
+        self.assertTrue(replayed.flight_recorder)
+        self.assertEqual(replayed.field, [1])
+        self.assertEqual(replayed.levelname, "TRACE")
+        self.assertEqual(replayed.funcName, "test_dump_on_error")
+        self.assertEqual(flight_recorder.recorded_count, 0)
+        self.assertEqual(flight_recorder.recorded_bytes, 0)
+
+        with self.subTest(test="explicit dump"):
+            logger.debug("debug again")
+            flight_recorder.dump()
+            self.assertEqual(info_handler.records[-1].getMessage(), "debug again")
+            flight_recorder.dump()
+            self.assertEqual(len(info_handler.records), 5)
+
+    def test_messages_are_rendered_when_written(self):
+        handler = ListHandler(logging.INFO)
+        flight_recorder = FlightRecorderHandler([handler])
+        logger = make_logger("test-flight-recorder-lazy", flight_recorder)
+        state = Mock(return_value="computed")
+        items = [1]
+
+        logger.trace("state %s", Lazy(state))
+        logger.debug(Lazy(state))
+        logger.debug("items %s", items)
+        items.append(2)
+        state.assert_not_called()
+
+        logger.error("error")
+        self.assertEqual(
+            [record.getMessage() for record in handler.records],
+            ["state computed", "computed", "items [1]", "error"],
+        )
+        self.assertEqual(state.call_count, 2)
+
+        with self.subTest(test="forgotten records"):
+            state.reset_mock()
+            flight_recorder.capacity = 1
+            for _ in range(3):
+                logger.trace("state %s", Lazy(state))
+            state.assert_not_called()
+            flight_recorder.close()
+            state.assert_not_called()
+
+    def test_limits(self):
+        all_messages = [str(i) for i in range(10)]
+        for capacity, max_bytes, expected_count in [
+            (3, 10**6, 3),
+            # Each record takes more than 500 bytes
+            (100, 4000, range(1, 8)),
+            (100, 10, 0),
+        ]:
+            with self.subTest(capacity=capacity, max_bytes=max_bytes):
+                handler = ListHandler(logging.INFO)
+                flight_recorder = FlightRecorderHandler(
+                    [handler], capacity=capacity, max_bytes=max_bytes
+                )
+                logger = make_logger("test-flight-recorder-limits", flight_recorder)
+                for i in range(10):
+                    logger.debug("%s", i, extra={"padding": "x" * 50})
+                self.assertLessEqual(flight_recorder.recorded_bytes, max_bytes)
+                flight_recorder.dump()
+                messages = [r.getMessage() for r in handler.records]
+                if isinstance(expected_count, int):
+                    self.assertEqual(len(messages), expected_count)
+                else:
+                    self.assertIn(len(messages), expected_count)
+                # The oldest records are forgotten first
+                self.assertEqual(
+                    messages, all_messages[len(all_messages) - len(messages) :]
+                )
+
+    def test_init_loggers_with_flight_recorder(self):
+        fake_stdout = StringIO()
+        logger = logging.getLogger("test-flight-recorder-init-loggers")
+        init_loggers.init_loggers(
+            [logger],
+            log_level="INFO",
+            file_log_level=None,
+            filename=None,
+            formatter=JsonFormatter,
+            stream=fake_stdout,
+            use_queue=True,
+            flight_recorder_level=TRACE,
+        )
+        self.assertEqual(logger.level, TRACE)
+
+        with self.subTest(test="log level listener finds the stdout handler"):
+            listener = BaseAsyncLogLevelListener(logger, LogLevelListenerConfig())
+            # pylint: disable=protected-access
+            self.assertEqual(listener._get_stdout_handler_or_logger().name, "stdout")
+
+        logger.log(TRACE, "trace")
+        logger.info("info")
+        logger.error("error")
+        queue_handler = logger.handlers[-1]
+        queue_handler.flush()
+
+        lines = [json.loads(line) for line in fake_stdout.getvalue().splitlines()]
+        self.assertEqual(
+            [(line["message"], line["severity"]) for line in lines],
+            [("info", "INFO"), ("trace", "TRACE"), ("error", "ERROR")],
+        )
+        self.assertTrue(lines[1]["flight_recorder"])
+        queue_handler.close()
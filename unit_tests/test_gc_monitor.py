@@ -0,0 +1,87 @@
+import gc
+import sys
+import unittest
+from unittest.mock import Mock
+
+from powerflex_logging_utilities.gc_monitor import GcMonitor, get_rss_bytes
+
+
+class Test(unittest.TestCase):
+    def test_gc_pauses(self):
+        logger = Mock()
+        # Check manually instead of on the background thread
+        monitor = GcMonitor(logger, pause_threshold_sec=0, check_interval_sec=60)
+        # Only count the collections below, not automatic ones
+        gc.disable()
+        monitor.start()
+        try:
+            gc.collect(1)
+            gc.collect()
+        finally:
+            monitor.stop()
+            gc.enable()
+        # pylint: disable=protected-access
+        self.assertNotIn(monitor._on_gc, gc.callbacks)
+
+        with self.subTest(test="pauses above the threshold"):
+            monitor.check()
+            self.assertEqual(logger.warning.call_count, 2)
+            extras = [call.kwargs["extra"] for call in logger.warning.call_args_list]
+            self.assertEqual([extra["gc_generation"] for extra in extras], [1, 2])
+            for extra in extras:
+                self.assertGreaterEqual(extra["gc_pause"], 0)
+                self.assertGreaterEqual(extra["gc_collected"], 0)
+
+        with self.subTest(test="summary"):
+            monitor.log_summary()
+            extra = logger.info.call_args.kwargs["extra"]
+            self.assertEqual(extra["gc_count"], 2)
+            self.assertEqual(set(extra["gc_pauses"]), {"1", "2"})
+            self.assertEqual(extra["gc_pauses"]["2"]["count"], 1)
+            monitor.log_summary()
+            logger.info.assert_called_once()
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "reads /proc")
+    def test_rss_limit(self):
+        self.assertGreater(get_rss_bytes(), 0)
+        logger = Mock()
+        monitor = GcMonitor(logger, rss_limit_bytes=1)
+        monitor.check_memory()
+        monitor.check_memory()
+        logger.warning.assert_called_once()
+        extra = logger.warning.call_args.kwargs["extra"]
+        self.assertGreater(extra["rss"], 1)
+        self.assertIsNone(extra["top_allocations"])
+
+        with self.subTest(test="logged again after going below the limit"):
+            monitor.rss_limit_bytes = 2**60
+            monitor.check_memory()
+            monitor.rss_limit_bytes = 1
+            monitor.check_memory()
+            self.assertEqual(logger.warning.call_count, 2)
+
+    def test_traced_memory_limit(self):
+        logger = Mock()
+        monitor = GcMonitor(
+            logger,
+            check_interval_sec=60,
+            trace_allocations=True,
+            traced_memory_limit_bytes=10**6,
+            top_n=3,
+        )
+        monitor.start()
+        try:
+            monitor.check_memory()
+            logger.warning.assert_not_called()
+            allocated = [str(i) for i in range(100000)]
+            monitor.check_memory()
+        finally:
+            monitor.stop()
+        del allocated
+
+        logger.warning.assert_called_once()
+        extra = logger.warning.call_args.kwargs["extra"]
+        self.assertGreater(extra["traced_memory"], 10**6)
+        top_allocations = extra["top_allocations"]
+        self.assertEqual(len(top_allocations), 3)
+        self.assertIn(__file__, top_allocations[0]["location"])
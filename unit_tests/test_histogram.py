@@ -0,0 +1,38 @@
+import random
+import unittest
+
+from powerflex_logging_utilities.histogram import Histogram
+
+
+class Test(unittest.TestCase):
+    def test_percentiles(self):
+        values = [random.expovariate(100) for _ in range(10000)]
+        histogram = Histogram()
+        for value in values:
+            histogram.record(value)
+
+        values.sort()
+        for fraction in [0.5, 0.95, 0.99, 1]:
+            with self.subTest(fraction=fraction):
+                expected = values[int(fraction * len(values)) - 1]
+                self.assertAlmostEqual(
+                    histogram.percentile(fraction), expected, delta=expected / 16 + 1e-6
+                )
+        summary = histogram.summary()
+        self.assertEqual(summary["count"], 10000)
+        self.assertEqual(summary["max"], values[-1])
+        self.assertAlmostEqual(summary["mean"], sum(values) / len(values))
+
+    def test_merge_and_reset(self):
+        first, second = Histogram(scale=1), Histogram(scale=1)
+        for value in range(100):
+            first.record(value)
+            second.record(value + 100)
+        first.merge(second)
+        self.assertEqual(first.count, 200)
+        self.assertEqual(first.max, 199)
+        self.assertAlmostEqual(first.percentile(0.5), 99, delta=99 / 16)
+
+        first.reset()
+        self.assertEqual(first.summary()["count"], 0)
+        self.assertEqual(first.percentile(0.99), 0)
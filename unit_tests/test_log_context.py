@@ -0,0 +1,156 @@
+import asyncio
+import io
+import json
+import logging
+import threading
+import unittest
+
+from powerflex_logging_utilities import JsonFormatter
+from powerflex_logging_utilities.log_context import (
+    bind_log_context,
+    create_task_with_log_context,
+    get_log_context,
+    log_context,
+    reset_log_context,
+)
+from powerflex_logging_utilities.queue_handler import BackgroundQueueHandler
+from powerflex_logging_utilities.record_snapshot import compact_record, restore_record
+
+
+def make_record(**extra) -> logging.LogRecord:
+    record = logging.LogRecord(
+        "test-context", logging.INFO, __file__, 1, "hello %s", ("é",), None
+    )
+    record.created = 1700000000.5
+    record.msecs = 500
+    record.__dict__.update(extra)
+    return record
+
+
+class Test(unittest.TestCase):
+    def test_scopes(self):
+        self.assertEqual(dict(get_log_context()), {})
+        with log_context(request_id="a", site_id=1) as fields:
+            self.assertEqual(dict(fields), {"request_id": "a", "site_id": 1})
+            with log_context(request_id="b"):
+                self.assertEqual(
+                    dict(get_log_context()), {"request_id": "b", "site_id": 1}
+                )
+            self.assertEqual(dict(get_log_context()), {"request_id": "a", "site_id": 1})
+        self.assertEqual(dict(get_log_context()), {})
+
+        with self.subTest(test="bind and reset"):
+            token = bind_log_context(user="x")
+            self.assertEqual(dict(get_log_context()), {"user": "x"})
+            reset_log_context(token)
+            self.assertEqual(dict(get_log_context()), {})
+
+    def test_asyncio_tasks(self):
+        async def log_fields(delay):
+            await asyncio.sleep(delay)
+            return dict(get_log_context())
+
+        async def main():
+            with log_context(site_id=1):
+                tasks = [
+                    create_task_with_log_context(log_fields(0.02), request_id="a"),
+                    create_task_with_log_context(log_fields(0.01), request_id="b"),
+                ]
+                caller_fields = dict(get_log_context())
+                return caller_fields, await asyncio.gather(*tasks)
+
+        caller_fields, task_fields = asyncio.run(main())
+        self.assertEqual(caller_fields, {"site_id": 1})
+        self.assertEqual(
+            task_fields,
+            [{"site_id": 1, "request_id": "a"}, {"site_id": 1, "request_id": "b"}],
+        )
+
+    def test_same_output_as_extra(self):
+        fields = {"request_id": "abc", "site": {"id": 1, "name": "é"}, "count": 3}
+        expected = json.loads(JsonFormatter().format(make_record(**fields)))
+
+        for serializer in ["json", "orjson"]:
+            for kwargs in [{}, {"json_indent": 2}, {"prefix": "log: "}]:
+                with self.subTest(serializer=serializer, kwargs=kwargs):
+                    try:
+                        formatter = JsonFormatter(
+                            serializer=serializer, **kwargs  # type: ignore
+                        )
+                    except ImportError:
+                        continue
+                    prefix = kwargs.get("prefix", "")
+                    with log_context(**fields):
+                        text = formatter.format(make_record())
+                        data = formatter.format_bytes(make_record())
+                        log_record = formatter.log_record_dict(make_record())
+                    self.assertTrue(text.startswith(prefix))
+                    self.assertEqual(json.loads(text[len(prefix) :]), expected)
+                    self.assertEqual(
+                        json.loads(data[len(prefix) :].decode("utf-8")), expected
+                    )
+                    self.assertEqual(log_record, expected)
+                    self.assertEqual(
+                        json.dumps(log_record),
+                        json.dumps(json.loads(text[len(prefix) :])),
+                    )
+
+        with self.subTest(test="compact orjson output"):
+            try:
+                formatter = JsonFormatter(serializer="orjson")
+            except ImportError:
+                return
+            with log_context(request_id="abc"):
+                self.assertTrue(
+                    formatter.format(make_record()).endswith(',"request_id":"abc"}')
+                )
+
+    def test_record_fields_win(self):
+        formatter = JsonFormatter()
+        with log_context(request_id="context", name="context", other=1):
+            output = json.loads(formatter.format(make_record(request_id="record")))
+        self.assertEqual(output["request_id"], "record")
+        self.assertEqual(output["name"], "test-context")
+        self.assertEqual(output["other"], 1)
+
+        with self.subTest(test="dict messages"):
+            record = make_record()
+            record.msg = {"event": "started"}
+            record.args = None
+            with log_context(request_id="context"):
+                output = json.loads(formatter.format(record))
+            self.assertEqual(output["event"], "started")
+            self.assertEqual(output["request_id"], "context")
+
+    def test_deferred_handlers(self):
+        stream = io.StringIO()
+        stream_handler = logging.StreamHandler(stream)
+        stream_handler.setFormatter(JsonFormatter())
+        handler = BackgroundQueueHandler([stream_handler])
+        logger = logging.getLogger("test-context-queue")
+        logger.propagate = False
+        logger.handlers = [handler]
+
+        def log_in_thread(number):
+            with log_context(thread=number):
+                logger.warning("from %s", number)
+
+        threads = [
+            threading.Thread(target=log_in_thread, args=(number,))
+            for number in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        handler.close()
+
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(len(lines), 4)
+        for line in lines:
+            self.assertEqual(line["message"], f"from {line['thread']}")
+
+        with self.subTest(test="flight recorder records"):
+            with log_context(request_id="abc"):
+                compact = compact_record(make_record())
+            self.assertEqual(restore_record(compact).request_id, "abc")  # type: ignore
@@ -0,0 +1,284 @@
+import gzip
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from powerflex_logging_utilities import JsonFormatter, init_loggers
+from powerflex_logging_utilities.log_index import (
+    IndexedRotatingFileHandler,
+    SegmentIndex,
+    find_segments,
+    main,
+    parse_timestamp,
+    query_logs,
+    record_time,
+    remove_stale_indexes,
+)
+from powerflex_logging_utilities.rotating_file_handler import (
+    BackgroundRotatingFileHandler,
+)
+
+# 2024-05-01 10:00:00 in local time
+START_TIME = parse_timestamp("2024-05-01 10:00:00")
+
+
+def make_record(number: int, level: int, name: str) -> logging.LogRecord:
+    record = logging.LogRecord(name, level, __file__, 1, "message %s", (number,), None)
+    record.created = START_TIME + number
+    record.msecs = 0
+    record.request_id = f"request-{number % 10}"
+    return record
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.filename = os.path.join(self.tmpdir.name, "app.log")
+
+    def write_logs(self, numbers, max_bytes=0):
+        handler = BackgroundRotatingFileHandler(self.filename, max_bytes=max_bytes)
+        handler.setFormatter(JsonFormatter())
+        for number in numbers:
+            level = logging.WARNING if number % 50 == 0 else logging.INFO
+            name = "app.db" if number % 2 else "app.web"
+            handler.handle(make_record(number, level, name))
+        handler.close()
+
+    @staticmethod
+    def messages(lines):
+        return [json.loads(line)["message"] for line in lines]
+
+    def test_query(self):
+        self.write_logs(range(1000), max_bytes=50000)
+        segments = find_segments(self.filename)
+        self.assertGreater(len(segments), 2)
+
+        with self.subTest(test="time range"):
+            self.assertEqual(
+                self.messages(
+                    query_logs(
+                        segments,
+                        since="2024-05-01 10:05:00",
+                        until="2024-05-01T10:05:02",
+                        block_bytes=1000,
+                    )
+                ),
+                ["message 300", "message 301", "message 302"],
+            )
+        with self.subTest(test="severity, logger and fields"):
+            self.assertEqual(
+                self.messages(
+                    query_logs(
+                        segments,
+                        level="WARNING",
+                        logger_names=["app.web"],
+                        fields={"request_id": "request-0"},
+                    )
+                ),
+                [f"message {number}" for number in range(0, 1000, 50)],
+            )
+        with self.subTest(test="no match"):
+            self.assertEqual(
+                list(query_logs(segments, logger_names=["app"], level="ERROR")), []
+            )
+
+    def test_only_reads_matching_blocks(self):
+        self.write_logs(range(1000))
+        index = SegmentIndex(self.filename, block_bytes=1000)
+        index.update()
+        self.assertGreater(len(index.blocks), 100)
+
+        read_sizes = []
+        real_loads = json.loads
+
+        def counting_loads(line, *args, **kwargs):
+            read_sizes.append(len(line))
+            return real_loads(line, *args, **kwargs)
+
+        with patch("powerflex_logging_utilities.log_index.json.loads", counting_loads):
+            lines = list(
+                query_logs(
+                    [self.filename], since=START_TIME + 500, until=START_TIME + 501
+                )
+            )
+        self.assertEqual(self.messages(lines), ["message 500", "message 501"])
+        self.assertLess(len(read_sizes), 20)
+
+    def test_incremental_update(self):
+        self.write_logs(range(10))
+        index = SegmentIndex(self.filename, block_bytes=100000)
+        self.assertTrue(index.update())
+        self.assertEqual(len(index.blocks), 1)
+        self.assertFalse(SegmentIndex(self.filename).update())
+
+        with self.subTest(test="appended lines are new blocks"):
+            self.write_logs(range(10, 20))
+            with open(self.filename, "ab") as log_file:
+                log_file.write(b'{"message": "being written')
+            index = SegmentIndex(self.filename)
+            self.assertTrue(index.update())
+            self.assertEqual(len(index.blocks), 2)
+            self.assertEqual(index.blocks[1]["min_time"], START_TIME + 10)
+            self.assertLess(index.indexed_bytes, os.path.getsize(self.filename))
+
+        with self.subTest(test="replaced files are indexed again"):
+            os.remove(self.filename)
+            self.write_logs(range(100, 105))
+            index = SegmentIndex(self.filename)
+            self.assertTrue(index.update())
+            self.assertEqual(len(index.blocks), 1)
+            self.assertEqual(index.blocks[0]["min_time"], START_TIME + 100)
+
+    def test_compressed_and_unindexed_segments(self):
+        self.write_logs(range(100))
+        compressed = self.filename + ".1.gz"
+        with open(self.filename, "rb") as source, gzip.open(
+            compressed, "wb"
+        ) as destination:
+            shutil.copyfileobj(source, destination)
+        os.remove(self.filename)
+
+        for update_index in [False, True]:
+            with self.subTest(update_index=update_index):
+                self.assertEqual(
+                    self.messages(
+                        query_logs(
+                            [compressed],
+                            since=START_TIME + 98,
+                            update_index=update_index,
+                        )
+                    ),
+                    ["message 98", "message 99"],
+                )
+        self.assertTrue(os.path.exists(compressed + ".idx"))
+
+        with self.subTest(test="stale indexes"):
+            os.remove(compressed)
+            self.assertEqual(remove_stale_indexes(self.filename), [compressed + ".idx"])
+
+    def test_index_on_rotation(self):
+        for compression in [None, "gzip", "zstd"]:
+            with self.subTest(compression=compression):
+                for name in os.listdir(self.tmpdir.name):
+                    os.remove(os.path.join(self.tmpdir.name, name))
+                handler = IndexedRotatingFileHandler(
+                    self.filename,
+                    max_bytes=5000,
+                    backup_count=3,
+                    compression=compression,  # type: ignore
+                    block_bytes=1000,
+                )
+                handler.setFormatter(JsonFormatter())
+                for number in range(200):
+                    handler.handle(make_record(number, logging.INFO, "app"))
+                handler.close()
+
+                segments = find_segments(self.filename)
+                self.assertEqual(len(segments), 4)
+                for segment in segments[:-1]:
+                    self.assertTrue(os.path.exists(segment + ".idx"), segment)
+                    # Indexed when rotated, not at query time
+                    self.assertFalse(SegmentIndex(segment).update())
+                indexes = [
+                    name
+                    for name in os.listdir(self.tmpdir.name)
+                    if name.endswith(".idx")
+                ]
+                # The indexes of deleted segments are deleted
+                self.assertEqual(len(indexes), 3)
+
+                oldest = json.loads(next(query_logs(segments[:1])))["message"]
+                number = int(oldest.split()[1])
+                self.assertEqual(
+                    self.messages(
+                        query_logs(
+                            segments,
+                            since=START_TIME + number,
+                            until=START_TIME + number + 1,
+                            update_index=False,
+                        )
+                    ),
+                    [f"message {number}", f"message {number + 1}"],
+                )
+
+    def test_init_loggers(self):
+        logger = logging.getLogger("test-log-index-init")
+        logger.propagate = False
+        self.addCleanup(logger.handlers.clear)
+        init_loggers.init_loggers(
+            [logger],
+            "INFO",
+            "INFO",
+            self.filename,
+            stream=io.StringIO(),
+            index_files=True,
+        )
+        handlers = [
+            handler
+            for handler in logger.handlers
+            if isinstance(handler, IndexedRotatingFileHandler)
+        ]
+        self.assertEqual(len(handlers), 1)
+        self.addCleanup(handlers[0].close)
+
+        with self.assertRaisesRegex(ValueError, "index_files"):
+            init_loggers.init_loggers(
+                [logger],
+                "INFO",
+                "INFO",
+                self.filename,
+                file_format="binary",
+                index_files=True,
+            )
+
+    def test_non_ascii_field_values(self):
+        handler = BackgroundRotatingFileHandler(self.filename)
+        for ensure_ascii in [True, False]:
+            handler.setFormatter(JsonFormatter(json_ensure_ascii=ensure_ascii))
+            record = make_record(int(ensure_ascii), logging.INFO, "app")
+            record.user = "café"
+            handler.handle(record)
+            handler.handle(make_record(2, logging.INFO, "app"))
+        handler.close()
+        self.assertEqual(
+            self.messages(query_logs([self.filename], fields={"user": "café"})),
+            ["message 1", "message 0"],
+        )
+
+    def test_time_formats(self):
+        for time_format in ["default", "cached", "rfc3339", "epoch_ns"]:
+            with self.subTest(time_format=time_format):
+                formatter = JsonFormatter(time_format=time_format)  # type: ignore
+                output = json.loads(
+                    formatter.format(make_record(5, logging.INFO, "app"))
+                )
+                self.assertEqual(record_time(output), START_TIME + 5)
+
+    def test_command(self):
+        self.write_logs(range(100))
+        output = io.BytesIO()
+        stdout = io.TextIOWrapper(output)
+        with patch("sys.stdout", stdout):
+            self.assertEqual(
+                main(
+                    [
+                        self.filename,
+                        "--level",
+                        "warning",
+                        "--field",
+                        "request_id=request-0",
+                    ]
+                ),
+                0,
+            )
+        self.assertEqual(
+            self.messages(output.getvalue().splitlines()),
+            ["message 0", "message 50"],
+        )
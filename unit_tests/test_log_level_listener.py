@@ -4,19 +4,29 @@ import logging
 import os
 import sys
 import unittest
+from io import StringIO
 from unittest.mock import AsyncMock, Mock, patch
 
 from nats.aio.msg import Msg
 from pydantic import ValidationError
 
-from powerflex_logging_utilities.log_level_listener import LogLevelRequestMessage
+from powerflex_logging_utilities.log_level_listener import (
+    BaseAsyncLogLevelListener,
+    LogLevelListenerConfig,
+    LogLevelRequestMessage,
+)
 from powerflex_logging_utilities.log_level_listener.format_exception import (
     format_exception,
 )
+from powerflex_logging_utilities.log_level_listener.logger_levels import (
+    LoggerIndex,
+    LoggerLevelFilter,
+)
 from powerflex_logging_utilities.log_level_listener.nats import (
     AsyncNatsLogLevelListener,
     NatsLogLevelListenerConfig,
 )
+from powerflex_logging_utilities.log_stats import LogStats, LogStatsFilter
 
 TEST_DELAY = float(os.environ.get("TEST_DELAY", 0.05))
 
@@ -198,3 +208,265 @@ class Test(unittest.IsolatedAsyncioTestCase):
             self.assertEqual(listener.logger.level, logging.DEBUG)
             await asyncio.sleep(TEST_DELAY * 1.2)
             self.assertEqual(listener.logger.level, logging.INFO)
+
+    async def test_targeted_log_level(self):
+        stream = StringIO()
+        logger = logging.getLogger("targeted")
+        logger.setLevel(logging.DEBUG)
+        log_handler = logging.StreamHandler(stream=stream)
+        log_handler.set_name("stdout")
+        log_handler.setLevel(logging.INFO)
+        log_handler.setFormatter(logging.Formatter("%(name)s %(message)s"))
+        logger.addHandler(log_handler)
+        db_logger = logging.getLogger("targeted.db.pool")
+        db_logger.setLevel(logging.WARNING)
+        http_logger = logging.getLogger("targeted.http")
+
+        listener = BaseAsyncLogLevelListener(logger, LogLevelListenerConfig())
+        request = await listener.handle_log_level_change_message(
+            json.dumps(
+                {"level": "DEBUG", "duration": TEST_DELAY, "loggers": ["targeted.db.*"]}
+            )
+        )
+        self.assertEqual(request.loggers, ["targeted.db.*"])
+
+        with self.subTest(test="only the targeted loggers are changed"):
+            self.assertEqual(db_logger.level, logging.DEBUG)
+            # Loggers are not created to match the pattern
+            self.assertIsInstance(
+                logging.Logger.manager.loggerDict["targeted.db"], logging.PlaceHolder
+            )
+            self.assertEqual(log_handler.level, logging.DEBUG)
+            db_logger.debug("db debug")
+            http_logger.debug("http debug")
+            http_logger.info("http info")
+            self.assertEqual(
+                stream.getvalue().splitlines()[-2:],
+                ["targeted.db.pool db debug", "targeted.http http info"],
+            )
+
+        with self.subTest(test="untargeted changes keep the targeted levels"):
+            listener.set_log_level("WARNING", duration=0)
+            self.assertEqual(log_handler.level, logging.DEBUG)
+            self.assertFalse(
+                log_handler.filter(
+                    http_logger.makeRecord(
+                        "targeted.http", logging.INFO, "", 0, "", (), None
+                    )
+                )
+            )
+            listener.set_log_level("INFO", duration=0)
+
+        with self.subTest(test="reset"):
+            await asyncio.sleep(TEST_DELAY * 1.2)
+            self.assertEqual(db_logger.level, logging.WARNING)
+            self.assertEqual(db_logger.getEffectiveLevel(), logging.WARNING)
+            self.assertEqual(log_handler.level, logging.INFO)
+            db_logger.info("db info")
+            self.assertNotIn("db info", stream.getvalue())
+
+    def test_logger_index(self):
+        for name in [
+            "index",
+            "index.a",
+            "index.a.sql",
+            "index.b.sql",
+            "index.b.http",
+            "indexed",
+        ]:
+            logging.getLogger(name)
+        index = LoggerIndex()
+        for pattern, expected in [
+            (
+                "index",
+                ["index", "index.a", "index.a.sql", "index.b.http", "index.b.sql"],
+            ),
+            ("index.a.*", ["index.a", "index.a.sql"]),
+            ("index.*.sql", ["index.a.sql", "index.b.sql"]),
+            ("index.b.h?tp", ["index.b.http"]),
+            ("missing", []),
+        ]:
+            with self.subTest(pattern=pattern):
+                self.assertEqual(
+                    [logger.name for logger in index.find(pattern)], expected
+                )
+
+        with self.subTest(test="set and reset levels"):
+            index.set_levels(["index.*.sql"], logging.DEBUG)
+            self.assertTrue(
+                logging.getLogger("index.b.sql").isEnabledFor(logging.DEBUG)
+            )
+            index.reset_levels(["index.*.sql"])
+            self.assertEqual(logging.getLogger("index.b.sql").level, logging.NOTSET)
+
+        with self.subTest(test="overlapping patterns"):
+            index_logger = logging.getLogger("index")
+            sql_logger = logging.getLogger("index.a.sql")
+            sql_logger.setLevel(logging.WARNING)
+            for first, second in [("index", "index.a"), ("index.a", "index")]:
+                levels = {first: logging.DEBUG, second: logging.ERROR}
+                index.set_levels([first], levels[first])
+                index.set_levels([second], levels[second])
+                # The longest pattern wins
+                self.assertEqual(sql_logger.level, levels["index.a"])
+                self.assertEqual(index_logger.level, levels["index"])
+                index.reset_levels([second])
+                self.assertEqual(sql_logger.level, levels[first])
+                index.reset_levels([first])
+                self.assertEqual(sql_logger.level, logging.WARNING)
+                self.assertEqual(index_logger.level, logging.NOTSET)
+
+            index.set_levels(["index"], logging.DEBUG)
+            index.set_levels(["index.a"], logging.ERROR)
+            index.reset_levels(["index"])
+            self.assertEqual(sql_logger.level, logging.ERROR)
+            self.assertEqual(index_logger.level, logging.NOTSET)
+            index.reset_levels(["index.a"])
+            self.assertEqual(sql_logger.level, logging.WARNING)
+
+            index.set_levels(["index"], logging.DEBUG)
+            index.set_levels(["index.a"], logging.ERROR)
+            index.forget_levels(["index.a"])
+            index.reset_levels(["index"])
+            self.assertEqual(sql_logger.level, logging.ERROR)
+            self.assertEqual(index_logger.level, logging.NOTSET)
+            sql_logger.setLevel(logging.NOTSET)
+
+        with self.subTest(test="loggers are not created"):
+            index.set_levels(["index.c"], logging.DEBUG)
+            self.assertNotIn("index.c", logging.Logger.manager.loggerDict)
+            index.reset_levels(["index.c"])
+
+        with self.subTest(test="the longest pattern wins"):
+            level_filter = LoggerLevelFilter(logging.INFO)
+            level_filter.set_levels({"index": logging.DEBUG, "index.b": logging.ERROR})
+            self.assertEqual(level_filter.min_level, logging.DEBUG)
+            self.assertEqual(level_filter.get_level("index.a"), logging.DEBUG)
+            self.assertEqual(level_filter.get_level("index.b.sql"), logging.ERROR)
+            self.assertEqual(level_filter.get_level("other"), logging.INFO)
+
+    async def test_reset_scheduler(self):
+        logger = logging.getLogger("scheduled")
+        log_handler = logging.StreamHandler(stream=StringIO())
+        log_handler.set_name("stdout")
+        log_handler.setLevel(logging.INFO)
+        logger.addHandler(log_handler)
+        db_logger = logging.getLogger("scheduled.db")
+        db_logger.setLevel(logging.WARNING)
+        listener = BaseAsyncLogLevelListener(logger, LogLevelListenerConfig())
+
+        with self.subTest(test="newer requests replace the pending reset"):
+            listener.set_log_level("DEBUG", duration=TEST_DELAY)
+            listener.set_logger_levels("DEBUG", ["scheduled.db"], duration=TEST_DELAY)
+            await asyncio.sleep(TEST_DELAY / 2)
+            listener.set_log_level("DEBUG", duration=TEST_DELAY)
+            listener.set_logger_levels("INFO", ["scheduled.db"], duration=TEST_DELAY)
+            # pylint: disable=protected-access
+            self.assertEqual(len(listener._pending_resets), 2)
+            await asyncio.sleep(TEST_DELAY * 0.7)
+            self.assertEqual(log_handler.level, logging.DEBUG)
+            self.assertEqual(db_logger.level, logging.INFO)
+            await asyncio.sleep(TEST_DELAY)
+            self.assertEqual(log_handler.level, logging.INFO)
+            # The level from before the first request is restored
+            self.assertEqual(db_logger.level, logging.WARNING)
+            self.assertIsNone(listener._reset_timer)
+
+        with self.subTest(test="requests without a duration cancel the pending reset"):
+            listener.set_log_level("DEBUG", duration=TEST_DELAY)
+            listener.set_log_level("WARNING", duration=0)
+            await asyncio.sleep(TEST_DELAY * 1.2)
+            self.assertEqual(log_handler.level, logging.WARNING)
+
+        with self.subTest(test="close cancels the pending resets"):
+            listener.set_log_level("DEBUG", duration=TEST_DELAY)
+            listener.close()
+            await asyncio.sleep(TEST_DELAY * 1.2)
+            self.assertEqual(log_handler.level, logging.DEBUG)
+
+    def test_set_log_level_without_loop(self):
+        logger = logging.getLogger("without-loop")
+        log_handler = logging.StreamHandler(stream=StringIO())
+        log_handler.set_name("stdout")
+        log_handler.setLevel(logging.INFO)
+        logger.addHandler(log_handler)
+        self.addCleanup(logger.removeHandler, log_handler)
+        listener = BaseAsyncLogLevelListener(logger, LogLevelListenerConfig())
+
+        with self.assertRaisesRegex(RuntimeError, "running event loop"):
+            listener.set_log_level("DEBUG", duration=TEST_DELAY)
+        with self.assertRaisesRegex(RuntimeError, "running event loop"):
+            listener.set_logger_levels("DEBUG", ["without-loop.db"], TEST_DELAY)
+        self.assertEqual(log_handler.level, logging.INFO)
+        self.assertEqual(log_handler.filters, [])
+
+        with self.subTest(test="without a duration"):
+            listener.set_log_level("WARNING", duration=0)
+            self.assertEqual(log_handler.level, logging.WARNING)
+
+        with self.subTest(test="from another thread"):
+
+            async def set_from_thread():
+                listener.set_log_level("INFO", duration=0)
+                # The listener ran on this loop
+                listener.set_log_level("ERROR", duration=TEST_DELAY)
+                await asyncio.to_thread(listener.set_log_level, "DEBUG", TEST_DELAY)
+                self.assertEqual(log_handler.level, logging.DEBUG)
+                await asyncio.sleep(TEST_DELAY * 1.5)
+
+            listener.config.FALLBACK_LOG_LEVEL = "WARNING"
+            asyncio.run(set_from_thread())
+            self.assertEqual(log_handler.level, logging.WARNING)
+
+    async def test_log_stats_subject(self):
+        logger = logging.getLogger("stats")
+        logger.setLevel(logging.INFO)
+        log_handler = logging.StreamHandler(stream=StringIO())
+        log_handler.set_name("stdout")
+        log_handler.setLevel(logging.WARNING)
+        log_stats = LogStats()
+        log_handler.addFilter(LogStatsFilter(log_stats))
+        logger.addHandler(log_handler)
+
+        mock_nats = AsyncMock()
+        mock_nats.subscribe = AsyncMock()
+        mock_nats.publish = AsyncMock()
+        config = NatsLogLevelListenerConfig(
+            NATS_LOG_LEVEL_LISTENER_SUBJECT=TEST_SUBJECT,
+            NATS_LOG_STATS_SUBJECT="test-stats-subject",
+        )
+        listener = await AsyncNatsLogLevelListener.create(
+            nats_client=mock_nats, logger=logger, config=config, log_stats=log_stats
+        )
+        self.assertEqual(
+            [call.kwargs["subject"] for call in mock_nats.subscribe.call_args_list],
+            [TEST_SUBJECT, "test-stats-subject"],
+        )
+
+        logging.getLogger("stats.db").error("error")
+        await listener.handle_log_stats_nats_message(
+            make_nats_msg(subject="test-stats-subject", data=b"", reply="reply")
+        )
+        response = json.loads(mock_nats.publish.call_args.args[1])
+        self.assertEqual(response["records"], {"stats.db": {"ERROR": 1}})
+        self.assertEqual(response["levels"], {"stats": "INFO", "stats.db": "INFO"})
+        self.assertEqual(response["stdout_handler_level"], "WARNING")
+        self.assertEqual(response["dropped"], {})
+        self.assertIn("records_per_second", response)
+
+        with self.subTest(test="errors"):
+            with patch.object(
+                listener, "get_log_stats", side_effect=ValueError("broken")
+            ):
+                await listener.handle_log_stats_nats_message(
+                    make_nats_msg(subject="test-stats-subject", data=b"", reply="reply")
+                )
+            response = json.loads(mock_nats.publish.call_args.args[1])
+            self.assertIn("broken", response["error"])
+
+            mock_nats.publish.side_effect = ConnectionError("disconnected")
+            with self.assertLogs(logger, logging.WARNING) as logs:
+                await listener.handle_log_stats_nats_message(
+                    make_nats_msg(subject="test-stats-subject", data=b"", reply="reply")
+                )
+            self.assertIn("Could not reply", logs.output[0])
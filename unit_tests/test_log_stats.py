@@ -0,0 +1,139 @@
+import logging
+import threading
+import unittest
+from io import StringIO
+
+from powerflex_logging_utilities import JsonFormatter, init_loggers
+from powerflex_logging_utilities.log_stats import (
+    LogStats,
+    LogStatsFilter,
+    find_dropped_counts,
+)
+from powerflex_logging_utilities.sampling_filter import SamplingFilter
+
+
+class Test(unittest.TestCase):
+    def test_count_records_and_bytes(self):
+        stats = LogStats()
+        formatter = JsonFormatter()
+        stream = StringIO()
+        logger = logging.getLogger("test-log-stats")
+        init_loggers.init_logger(
+            "INFO",
+            file_log_level=None,
+            filename=None,
+            logger_instance=logger,
+            stream=stream,
+            formatter=formatter,
+            filters=[LogStatsFilter(stats, formatter)],
+        )
+        logger.info("one")
+        logger.info("two")
+        logger.warning("three")
+        logger.debug("not logged")
+
+        snapshot = stats.snapshot()
+        self.assertEqual(
+            snapshot["records"], {"test-log-stats": {"INFO": 2, "WARNING": 1}}
+        )
+        # The size of the formatted records, without the newlines
+        self.assertEqual(
+            sum(snapshot["bytes"]["test-log-stats"].values()),
+            len(stream.getvalue()) - 3,
+        )
+
+        with self.subTest(test="without a formatter"):
+            stats = LogStats()
+            LogStatsFilter(stats).filter(
+                logging.makeLogRecord(
+                    {"name": "a", "levelname": "INFO", "msg": "%s", "args": ("12",)}
+                )
+            )
+            self.assertEqual(stats.bytes, {("a", "INFO"): 2})
+
+    def test_count_where_records_are_written(self):
+        stats = LogStats()
+        formatter = JsonFormatter()
+        threads = []
+        format_bytes = formatter.format_bytes
+
+        def record_thread(record):
+            threads.append(threading.current_thread())
+            return format_bytes(record)
+
+        formatter.format_bytes = record_thread  # type: ignore
+        stream = StringIO()
+        logger = logging.getLogger("test-log-stats-queue")
+        self.addCleanup(logger.handlers.clear)
+        log_stats_filter = LogStatsFilter(stats, formatter)
+        sampling_filter = SamplingFilter({"DEBUG": 0})
+        init_loggers.init_logger(
+            "DEBUG",
+            file_log_level=None,
+            filename=None,
+            logger_instance=logger,
+            stream=stream,
+            formatter=formatter,
+            filters=[log_stats_filter, sampling_filter],
+            use_queue=True,
+        )
+        queue_handler = logger.handlers[0]
+        self.assertEqual(queue_handler.filters, [sampling_filter])
+        self.assertEqual(queue_handler.handlers[0].filters, [log_stats_filter])
+
+        logger.info("written")
+        logger.debug("sampled out")
+        queue_handler.flush()
+        self.assertEqual(stats.records, {("test-log-stats-queue", "INFO"): 1})
+        self.assertEqual(len(stream.getvalue().splitlines()), 1)
+        # Formatted once, on the thread of the queue
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+        with self.subTest(test="without a queue, after the other filters"):
+            init_loggers.init_logger(
+                "DEBUG",
+                file_log_level=None,
+                filename=None,
+                logger_instance=logger,
+                stream=stream,
+                formatter=formatter,
+                filters=[log_stats_filter, sampling_filter],
+            )
+            self.assertEqual(
+                logger.handlers[-1].filters, [sampling_filter, log_stats_filter]
+            )
+
+    def test_records_per_second(self):
+        stats = LogStats(rate_window_sec=2)
+        for created in [100.5, 101.1, 101.2, 102.3, 102.4, 102.5, 103.0]:
+            stats.count("a", "INFO", 1, created)
+        self.assertEqual(stats.records_per_second(now=103.5), 2.5)
+        self.assertEqual(stats.records_per_second(now=110), 0)
+
+        with self.subTest(test="records counted late"):
+            stats = LogStats(rate_window_sec=3)
+            for created in [100.5, 102.1, 103.1, 102.5, 101.5, 101.6, 99.5, 90.0]:
+                stats.count("a", "INFO", 1, created)
+            self.assertEqual(stats.records_per_second(now=103.5), 5 / 3)
+            self.assertEqual(stats.records_per_second(now=104.5), 5 / 3)
+
+            stats = LogStats(rate_window_sec=3)
+            for created in [100.5, 102.1, 103.1, 104.1, 101.5, 101.6, 100.6]:
+                stats.count("a", "INFO", 1, created)
+            self.assertEqual(stats.records_per_second(now=104.5), 4 / 3)
+
+    def test_find_dropped_counts(self):
+        sampling_filter = SamplingFilter({"DEBUG": 0})
+        handler = logging.StreamHandler(StringIO())
+        handler.set_name("stdout")
+        handler.addFilter(sampling_filter)
+        logger = logging.getLogger("test-log-stats-dropped")
+        logger.setLevel(logging.DEBUG)
+        logger.handlers = [handler]
+        logger.propagate = False
+        for _ in range(3):
+            logger.debug("dropped")
+        self.assertEqual(
+            find_dropped_counts(logger.handlers), {"filter SamplingFilter": 3}
+        )
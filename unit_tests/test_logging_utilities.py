@@ -1,24 +1,32 @@
 import asyncio
+import functools
+import gc
 import itertools
 import json
 import logging
 import os
+import pickle
 import sys
+import tempfile
 import time
 import unittest
+import weakref
 from io import StringIO
 from typing import List, Optional, Union
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 from powerflex_logging_utilities import (
     DEFAULT_LOG_FORMAT,
     TRACE,
     JsonFormatter,
+    Lazy,
     TraceLogger,
     forbid_toplevel_logging,
     init_loggers,
     log_slow_callbacks,
 )
+from powerflex_logging_utilities.log_context import log_context
+from powerflex_logging_utilities.trace_logger import level_number
 
 DEFAULT_LOG_METHODS = [
     "debug",
@@ -65,6 +73,174 @@ class Test(unittest.TestCase):
             exc_info=True,
         )
 
+    def test_json_formatter_output_is_unchanged(self):
+        # pylint: disable=import-outside-toplevel
+        from pythonjsonlogger import jsonlogger  # type: ignore
+
+        logger = logging.getLogger("test-json-formatter-output")
+
+        def make_record(msg, args=(), extra=None, exc_info=None, stack_info=False):
+            record = logger.makeRecord(
+                logger.name,
+                logging.INFO,
+                __file__,
+                1,
+                msg,
+                args,
+                exc_info,
+                "function",
+                extra,
+                "stack" if stack_info else None,
+            )
+            record.created = 0
+            record.msecs = 0
+            return record
+
+        exc_info = None
+        try:
+            raise ValueError("oops")
+        except ValueError:
+            exc_info = sys.exc_info()
+
+        records = {
+            "simple": lambda: make_record("hello %s", ("world",)),
+            "extra": lambda: make_record(
+                "hello",
+                extra={"b": [1, 2], "a": {"nested": True}, "_private": 1},
+            ),
+            "non-str keys": lambda: make_record(
+                "hello",
+                extra={1: "one", "1": "string one", None: "none", "severity": "x"},
+            ),
+            "exception and stack": lambda: make_record(
+                "hello", exc_info=exc_info, stack_info=True
+            ),
+            "non-JSON values": lambda: make_record(
+                "hello", extra={"object": object, "error": ValueError("x")}
+            ),
+            "dict message": lambda: make_record({"message_dict": True}),
+        }
+        formatters = {
+            "default": JsonFormatter,
+            "static fields": lambda: JsonFormatter(static_fields={"static": 1}),
+            "custom fmt": lambda: JsonFormatter(fmt="%(message)s %(levelname)s"),
+            "prefix": lambda: JsonFormatter(prefix="prefix: "),
+            "renamed fields": lambda: JsonFormatter(rename_fields={"name": "logger"}),
+            "json_default": lambda: JsonFormatter(json_default=repr),
+            "json_indent": lambda: JsonFormatter(json_indent=2),
+            # Not json.dumps itself, which JsonFormatter replaces with a reused encoder
+            "json_serializer": lambda: JsonFormatter(
+                json_serializer=functools.partial(json.dumps)
+            ),
+        }
+        for (formatter_name, make_formatter), (
+            record_name,
+            record,
+        ) in itertools.product(formatters.items(), records.items()):
+            with self.subTest(formatter=formatter_name, record=record_name):
+                formatter = make_formatter()
+                expected = jsonlogger.JsonFormatter.format(formatter, record())
+                self.assertEqual(formatter.format(record()), expected)
+                self.assertEqual(
+                    formatter.format_bytes(record()), expected.encode("utf-8")
+                )
+
+    def test_json_formatter_serializers(self):
+        record = logging.LogRecord(
+            "test", logging.INFO, __file__, 1, "hello %s", ("é",), None
+        )
+        record.__dict__.update({"data": [1, {"a": None}], 2: "two", "t": object})
+        expected = json.loads(JsonFormatter().format(record))
+
+        for serializer in ["json", "orjson", "ujson", "auto"]:
+            with self.subTest(serializer=serializer):
+                try:
+                    formatter = JsonFormatter(serializer=serializer)  # type: ignore
+                except ImportError:
+                    continue
+                self.assertIn(formatter.serializer, serializer + "json orjson ujson")
+                self.assertEqual(json.loads(formatter.format(record)), expected)
+                self.assertEqual(json.loads(formatter.format_bytes(record)), expected)
+                self.assertEqual(
+                    json.loads(formatter.jsonify_log_record({1: "a"})), {"1": "a"}
+                )
+
+        with self.assertRaisesRegex(ValueError, "serializer must be"):
+            JsonFormatter(serializer="xml")  # type: ignore
+
+    def test_json_formatter_constant_fields(self):
+        def record(extra=None):
+            log_record = logging.LogRecord(
+                "test", logging.INFO, __file__, 1, "hello", None, None
+            )
+            log_record.created = 0
+            log_record.msecs = 0
+            log_record.__dict__.update(extra or {})
+            return log_record
+
+        constant_fields = {"service": "api", "pid": 123, 1: "non str key"}
+        expected = json.loads(JsonFormatter().format(record(constant_fields)))
+        for serializer in ["json", "orjson"]:
+            for kwargs in [{}, {"json_indent": 2}]:
+                with self.subTest(serializer=serializer, kwargs=kwargs):
+                    try:
+                        formatter = JsonFormatter(
+                            serializer=serializer,  # type: ignore
+                            constant_fields=constant_fields,
+                            **kwargs,
+                        )
+                    except ImportError:
+                        continue
+                    self.assertEqual(json.loads(formatter.format(record())), expected)
+                    self.assertEqual(
+                        json.loads(formatter.format_bytes(record())), expected
+                    )
+                    self.assertEqual(formatter.log_record_dict(record()), expected)
+
+        formatter = JsonFormatter(constant_fields={"service": "api", "pid": 123})
+        with self.subTest(test="record fields win"):
+            self.assertEqual(
+                json.loads(formatter.format(record({"service": "worker"})))["service"],
+                "worker",
+            )
+        with self.subTest(test="log context"):
+            with log_context(pid=1, request_id="abc"):
+                output = json.loads(formatter.format(record()))
+            self.assertEqual(output["pid"], 1)
+            self.assertEqual(output["request_id"], "abc")
+            self.assertEqual(output["service"], "api")
+
+    def test_json_formatter_time_format(self):
+        record = logging.LogRecord(
+            "test", logging.INFO, __file__, 1, "hello", None, None
+        )
+
+        for datefmt in [None, "%d/%m/%Y %H:%M:%S"]:
+            with self.subTest(time_format="cached", datefmt=datefmt):
+                formatter = JsonFormatter(time_format="cached", datefmt=datefmt)
+                expected = JsonFormatter(datefmt=datefmt)
+                for created in [1700000000.25, 1700000000.5, 1700000001.75]:
+                    record.created = created
+                    record.msecs = (created % 1) * 1000
+                    self.assertEqual(
+                        formatter.formatTime(record, datefmt),
+                        expected.formatTime(record, datefmt),
+                    )
+
+        record.created = 1700000000.25
+        record.msecs = 250
+        for time_format, asctime in [
+            ("rfc3339", "2023-11-14T22:13:20.250Z"),
+            ("epoch_ns", 1700000000250000000),
+        ]:
+            with self.subTest(time_format=time_format):
+                formatter = JsonFormatter(time_format=time_format)  # type: ignore
+                output = json.loads(formatter.format(record))
+                self.assertEqual(output["asctime"], asctime)
+
+        with self.assertRaisesRegex(ValueError, "time_format must be"):
+            JsonFormatter(time_format="iso")  # type: ignore
+
     def test_async_log_slow_callbacks(self):
         # This won't work in a subclass of unittest.IsolatedAsyncioTestCase
         # Must use asyncio.run manually
@@ -87,6 +263,142 @@ class Test(unittest.TestCase):
         first_arg = logger.log.call_args_list[0].args[0]
         self.assertEqual(first_arg, logging.WARN)
 
+    def test_async_log_slow_callbacks_summary(self):
+        logger = Mock()
+        very_slow_async_task_threshold_sec = 4 * TEST_DELAY
+        stats = log_slow_callbacks.log_slow_callbacks(
+            logger,
+            slow_async_task_threshold_sec=TEST_DELAY / 2,
+            very_slow_async_task_threshold_sec=very_slow_async_task_threshold_sec,
+            summary_interval_sec=60,
+            top_n=1,
+        )
+
+        async def slow_coroutine(delay):
+            time.sleep(delay)
+
+        def slow_function():
+            time.sleep(TEST_DELAY)
+
+        async def main():
+            asyncio.get_running_loop().call_soon(slow_function)
+            await asyncio.gather(
+                slow_coroutine(TEST_DELAY),
+                slow_coroutine(TEST_DELAY),
+                slow_coroutine(1.1 * very_slow_async_task_threshold_sec),
+            )
+            stats.log_summary()
+
+        asyncio.run(main())
+
+        with self.subTest(test="very slow callbacks are logged right away"):
+            logger.log.assert_called_once()
+            self.assertEqual(logger.log.call_args.args[0], logging.WARN)
+
+        with self.subTest(test="summary"):
+            logger.info.assert_called_once()
+            extra = logger.info.call_args.kwargs["extra"]
+            self.assertEqual(extra["slow_callback_count"], 4)
+            (top,) = extra["slow_callbacks"]
+            self.assertTrue(top["callback"].endswith(".slow_coroutine"))
+            self.assertEqual(top["count"], 3)
+            self.assertGreater(top["max"], very_slow_async_task_threshold_sec)
+            self.assertLessEqual(top["p50"], top["p99"])
+            self.assertEqual(stats.histograms, {})
+
+        with self.subTest(test="callback names"):
+            self.assertEqual(
+                log_slow_callbacks.get_callback_name(
+                    "<Task pending name='Task-2' coro=<slow() running at /a.py:6>>"
+                ),
+                "slow",
+            )
+            self.assertEqual(
+                log_slow_callbacks.get_callback_name(
+                    "<TimerHandle when=12.5 Foo.cb(1, 2) at /a.py:8>"
+                ),
+                "Foo.cb",
+            )
+
+    def test_async_log_slow_callbacks_stack_samples(self):
+        logger = Mock()
+        very_slow_async_task_threshold_sec = 4 * TEST_DELAY
+        # Remove the sampler from asyncio after the test, as it writes to tmpdir
+        # pylint: disable=protected-access
+        with tempfile.TemporaryDirectory() as tmpdir, patch.object(
+            asyncio.events.Handle, "_run", asyncio.events.Handle._run
+        ):
+            log_slow_callbacks.log_slow_callbacks(
+                logger,
+                slow_async_task_threshold_sec=TEST_DELAY / 2,
+                very_slow_async_task_threshold_sec=very_slow_async_task_threshold_sec,
+                sample_stacks=True,
+                stack_sample_interval_sec=TEST_DELAY / 10,
+                stack_samples_dir=tmpdir,
+            )
+
+            def blocking_function(delay):
+                time.sleep(delay)
+
+            async def main():
+                blocking_function(2 * TEST_DELAY)
+                await asyncio.sleep(0)
+                blocking_function(1.1 * very_slow_async_task_threshold_sec)
+
+            asyncio.run(main())
+
+            slow, very_slow = [
+                call.kwargs["extra"] for call in logger.log.call_args_list
+            ]
+            with self.subTest(test="slow callback"):
+                self.assertIn(";blocking_function (", slow["stack_samples"])
+
+            with self.subTest(test="very slow callback"):
+                self.assertNotIn("stack_samples", very_slow)
+                with open(very_slow["stack_samples_file"], encoding="utf-8") as file:
+                    self.assertIn(";blocking_function (", file.read())
+
+    def test_monitor_loop_lag(self):
+        logger = Mock()
+
+        async def main():
+            monitor = log_slow_callbacks.monitor_loop_lag(
+                logger,
+                heartbeat_interval_sec=TEST_DELAY / 5,
+                lag_threshold_sec=TEST_DELAY,
+            )
+            await asyncio.sleep(TEST_DELAY)
+            # Many short callbacks keep the ready queue busy
+            loop = asyncio.get_running_loop()
+
+            def busy(remaining):
+                time.sleep(TEST_DELAY / 1000)
+                if remaining:
+                    loop.call_soon(busy, remaining - 1)
+
+            for _ in range(100):
+                loop.call_soon(busy, 10)
+            await asyncio.sleep(TEST_DELAY)
+            # One callback blocking the loop
+            time.sleep(2 * TEST_DELAY)
+            await asyncio.sleep(TEST_DELAY)
+            monitor.stop()
+            monitor.log_summary()
+
+        asyncio.run(main())
+
+        with self.subTest(test="lag above the threshold is logged right away"):
+            logger.warning.assert_called()
+            extra = logger.warning.call_args.kwargs["extra"]
+            self.assertGreaterEqual(extra["loop_lag"], TEST_DELAY)
+
+        with self.subTest(test="summary"):
+            logger.info.assert_called_once()
+            extra = logger.info.call_args.kwargs["extra"]
+            self.assertGreater(extra["loop_lag"]["count"], 5)
+            self.assertGreaterEqual(extra["loop_lag"]["max"], 1.5 * TEST_DELAY)
+            self.assertGreater(extra["ready_queue_depth"]["max"], 50)
+
     def _test_logger_output(
         self,
         logger: Union[logging.Logger, str],
@@ -190,6 +502,112 @@ class Test(unittest.TestCase):
                     log_methods=DEFAULT_LOG_METHODS,
                 )
 
+    def test_init_loggers_formats_each_record_once(self):
+        fake_stdout = StringIO()
+        parent_logger = logging.getLogger("test-format-once")
+        child_logger = logging.getLogger("test-format-once.child")
+        init_loggers.init_loggers(
+            [parent_logger, child_logger],
+            log_level="DEBUG",
+            file_log_level="DEBUG",
+            filename="./logs/unit-test-format-once.log",
+            formatter=JsonFormatter,
+            stream=fake_stdout,
+        )
+        handler_formatters = {
+            id(handler.formatter)
+            for logger_instance in [parent_logger, child_logger]
+            for handler in logger_instance.handlers
+        }
+        self.assertEqual(len(handler_formatters), 1)
+
+        make_log_record = JsonFormatter.make_log_record
+        with patch.object(
+            JsonFormatter,
+            "make_log_record",
+            autospec=True,
+            side_effect=make_log_record,
+        ) as mock_make_log_record:
+            child_logger.info("formatted once")
+        mock_make_log_record.assert_called_once()
+
+        lines = fake_stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0], lines[1])
+        self.assertEqual(json.loads(lines[0])["message"], "formatted once")
+
+        for serializer in ["json", "auto"]:
+            with self.subTest(
+                test="format and format_bytes reuse the cached output",
+                serializer=serializer,
+            ):
+                formatter = JsonFormatter(serializer=serializer)  # type: ignore
+                record = logging.LogRecord("test", logging.INFO, "", 1, "msg", (), None)
+                self.assertEqual(
+                    formatter.format_bytes(record), formatter.format(record).encode()
+                )
+                record = logging.LogRecord("test", logging.INFO, "", 1, "msg", (), None)
+                self.assertEqual(
+                    formatter.format(record), formatter.format_bytes(record).decode()
+                )
+
+    def test_json_formatter_cached_output(self):
+        formatter = JsonFormatter()
+
+        class RedactFilter(logging.Filter):
+            def filter(self, record):
+                record.password = "***"
+                return True
+
+        streams = [StringIO(), StringIO(), StringIO()]
+        handlers = [logging.StreamHandler(stream) for stream in streams]
+        handlers[1].addFilter(RedactFilter())
+        logger = logging.getLogger("test-cached-output")
+        logger.propagate = False
+        logger.handlers = handlers
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        logger.warning("login", extra={"password": "secret"})
+        self.assertEqual(
+            [json.loads(stream.getvalue())["password"] for stream in streams],
+            ["secret", "***", "***"],
+        )
+
+        with self.subTest(test="records are only copied by shared formatters"):
+            single = JsonFormatter()
+            with patch(
+                "powerflex_logging_utilities.json_formatter._record_state"
+            ) as record_state:
+                for i in range(3):
+                    single.format(
+                        logging.LogRecord("test", logging.INFO, "", 1, "%s", (i,), None)
+                    )
+                record_state.assert_not_called()
+            self.assertFalse(single.shared)
+            self.assertTrue(formatter.shared)
+
+        with self.subTest(test="records and exceptions are not kept alive"):
+            error_record = logging.LogRecord(
+                "test", logging.ERROR, "", 1, "msg", (), None
+            )
+            try:
+                raise RuntimeError("oops")
+            except RuntimeError:
+                error_record.exc_info = sys.exc_info()
+            formatter.format(error_record)
+            record_ref = weakref.ref(error_record)
+            del error_record
+            gc.collect()
+            self.assertIsNone(record_ref())
+
+        with self.subTest(test="formatted records can be pickled"):
+            record = logging.LogRecord("test", logging.INFO, "", 1, "msg", (), None)
+            formatter.format(record)
+            restored = logging.makeLogRecord(
+                pickle.loads(pickle.dumps(record.__dict__))
+            )
+            self.assertEqual(json.loads(formatter.format(restored))["message"], "msg")
+
     def test_trace_logger(self):
         logger = TraceLogger("test")
         logger.setLevel(TRACE)
@@ -203,6 +621,146 @@ class Test(unittest.TestCase):
             log_methods=DEFAULT_LOG_METHODS + ["trace"],
         )
 
+    def test_level_number(self):
+        for level, number in [
+            ("trace", TRACE),
+            ("WARNING", logging.WARNING),
+            (logging.ERROR, logging.ERROR),
+        ]:
+            with self.subTest(level=level):
+                self.assertEqual(level_number(level), number)
+        with self.assertRaisesRegex(ValueError, "Unknown log level 'LOUD'"):
+            level_number("LOUD")
+
+    def test_trace_logger_lazy_arguments(self):
+        # Use a separate manager so that setLevel clears the logger's level cache
+        manager = logging.Manager(logging.getLogger())
+        manager.setLoggerClass(TraceLogger)
+        logger = manager.getLogger("test-lazy")
+        logger.propagate = False
+        fake_stdout = StringIO()
+        add_stdout_handler(logger, fake_stdout, "INFO")
+        log_handler = logger.handlers[0]
+        log_handler.setFormatter(logging.Formatter("%(funcName)s %(message)s"))
+        calls = []
+
+        def expensive(value):
+            calls.append(value)
+            return value
+
+        with self.subTest(test="logger level disables the call"):
+            logger.setLevel("INFO")
+            with patch.object(logger, "_log") as mock_log:
+                logger.trace("%s", Lazy(expensive, "disabled"))
+            mock_log.assert_not_called()
+            logger.debug("%s", Lazy(expensive, "disabled"))
+
+        with self.subTest(test="handler level filters out the record"):
+            logger.setLevel(TRACE)
+            logger.trace("%s", Lazy(expensive, "filtered"))
+            logger.debug(Lazy(expensive, "filtered"))
+
+        self.assertEqual(calls, [])
+        self.assertEqual(fake_stdout.getvalue(), "")
+
+        with self.subTest(test="arguments are evaluated once when emitted"):
+            log_handler.setLevel(TRACE)
+            logger.trace(
+                "%s %d %.1f %r %x",
+                Lazy(expensive, "emitted"),
+                Lazy(expensive, 1),
+                Lazy(expensive, 2),
+                Lazy(expensive, "repr"),
+                Lazy(expensive, 255),
+            )
+            logger.info(Lazy(lambda: f"{Lazy(expensive, 'message'):>10}"))
+            self.assertEqual(calls, ["emitted", 1, 2, "repr", 255, "message"])
+            self.assertEqual(
+                fake_stdout.getvalue().splitlines(),
+                [
+                    "test_trace_logger_lazy_arguments emitted 1 2.0 'repr' ff",
+                    "test_trace_logger_lazy_arguments    message",
+                ],
+            )
+
+            lazy_argument = Lazy(expensive, "once")
+            self.assertEqual(str(lazy_argument), "once")
+            self.assertEqual(lazy_argument.value, "once")
+            self.assertEqual(calls.count("once"), 1)
+
+    def test_trace_logger_caller_info(self):
+        logger = TraceLogger("test-caller-info")
+        logger.setLevel(TRACE)
+        stdlib_logger = logging.Logger("test-caller-info-stdlib")
+        fake_stdout = StringIO()
+        for logger_instance in [logger, stdlib_logger]:
+            add_stdout_handler(logger_instance, fake_stdout, TRACE)
+            logger_instance.handlers[0].setFormatter(
+                logging.Formatter("%(filename)s %(funcName)s %(lineno)d %(message)s")
+            )
+
+        def log_helper(logger_instance):
+            logger_instance.info("helper", stacklevel=2)
+
+        with self.subTest(test="same caller info as logging.Logger"):
+            for logger_instance in [logger, stdlib_logger]:
+                logger_instance.info("info")
+                log_helper(logger_instance)
+                logger_instance.log(logging.INFO, "log")
+            logger.trace("trace")
+            lines = fake_stdout.getvalue().splitlines()
+            self.assertEqual(lines[:3], lines[3:6])
+            self.assertRegex(
+                lines[0],
+                r"^test_logging_utilities.py test_trace_logger_caller_info \d+ info$",
+            )
+            self.assertNotEqual(lines[0].split()[2], lines[1].split()[2])
+            self.assertRegex(lines[6], r" test_trace_logger_caller_info \d+ trace$")
+
+        with self.subTest(test="cached per call site"):
+            outputs = []
+            for logger_instance in [logger, stdlib_logger]:
+                fake_stdout.truncate(0)
+                fake_stdout.seek(0)
+                for _ in range(3):
+                    logger_instance.info("first")
+                    logger_instance.info("second")
+                    log_helper(logger_instance)
+                outputs.append(fake_stdout.getvalue().splitlines())
+            self.assertEqual(outputs[0], outputs[1])
+            self.assertEqual(outputs[0][:3] * 3, outputs[0])
+            self.assertEqual(len({line.split()[2] for line in outputs[0]}), 3)
+
+        with self.subTest(test="disabled below caller_info_level"):
+            logger.caller_info_level = logging.INFO
+            fake_stdout.truncate(0)
+            fake_stdout.seek(0)
+            logger.debug("debug")
+            logger.info("info")
+            logger.debug("stack", stack_info=True)
+            lines = fake_stdout.getvalue().splitlines()
+            self.assertEqual(lines[0], "(unknown file) (unknown function) 0 debug")
+            self.assertRegex(lines[1], r" test_trace_logger_caller_info \d+ info$")
+            self.assertRegex(lines[2], r" test_trace_logger_caller_info \d+ stack$")
+            self.assertEqual(lines[3], "Stack (most recent call last):")
+            self.assertIn("test_trace_logger_caller_info", lines[-2])
+
+        with self.subTest(test="init_loggers sets the level of every TraceLogger"):
+            with patch.object(TraceLogger, "caller_info_level", logging.NOTSET):
+                init_loggers.init_loggers(
+                    [],
+                    log_level="INFO",
+                    file_log_level=None,
+                    filename=None,
+                    caller_info_level="WARNING",
+                )
+                self.assertEqual(TraceLogger.caller_info_level, logging.WARNING)
+                self.assertEqual(
+                    TraceLogger("test-caller-info-new").caller_info_level,
+                    logging.WARNING,
+                )
+            self.assertEqual(TraceLogger.caller_info_level, logging.NOTSET)
+
     def test_forbid_toplevel_logging(self):
         with self.subTest(
             test="does not raise exception when calling logging.info before forbidding it."
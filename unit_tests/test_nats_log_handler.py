@@ -0,0 +1,163 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import unittest
+from typing import List, Tuple
+from unittest.mock import patch
+
+from powerflex_logging_utilities import Lazy
+from powerflex_logging_utilities.nats_log_handler import (
+    NatsLogHandler,
+    NatsLogHandlerConfig,
+)
+
+TEST_DELAY = float(os.environ.get("TEST_DELAY", 0.05))
+
+TEST_SUBJECT = "test-logs"
+
+
+class FakeNatsClient:
+    def __init__(self) -> None:
+        self.published: List[Tuple[str, bytes]] = []
+        self.fail = False
+
+    async def publish(self, subject: str, payload: bytes = b"") -> None:
+        await asyncio.sleep(0)
+        if self.fail:
+            raise ConnectionError("disconnected")
+        self.published.append((subject, payload))
+
+    def batches(self) -> List[List[str]]:
+        return [
+            [json.loads(line)["message"] for line in payload.splitlines()]
+            for _subject, payload in self.published
+        ]
+
+
+def make_config(**kwargs) -> NatsLogHandlerConfig:
+    return NatsLogHandlerConfig(NATS_LOG_HANDLER_SUBJECT=TEST_SUBJECT, **kwargs)
+
+
+def make_logger(name: str, handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.handlers = [handler]
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+class Test(unittest.IsolatedAsyncioTestCase):
+    async def test_batches(self):
+        client = FakeNatsClient()
+        handler = NatsLogHandler(
+            client,
+            make_config(
+                NATS_LOG_HANDLER_BATCH_MAX_COUNT=3,
+                NATS_LOG_HANDLER_FLUSH_INTERVAL_SEC=TEST_DELAY,
+            ),
+        )
+        logger = make_logger("test-nats-batches", handler)
+
+        with self.subTest(test="full batches are published right away"):
+            for i in range(7):
+                logger.info("%s", i)
+            for _ in range(10):
+                await asyncio.sleep(0)
+            self.assertEqual(client.batches(), [["0", "1", "2"], ["3", "4", "5"]])
+            self.assertEqual(
+                {subject for subject, _ in client.published}, {TEST_SUBJECT}
+            )
+
+        with self.subTest(test="other records are published after the interval"):
+            await asyncio.sleep(TEST_DELAY * 1.5)
+            self.assertEqual(client.batches()[-1], ["6"])
+            self.assertEqual(handler.published_count, 7)
+
+        with self.subTest(test="batches are limited in bytes"):
+            handler.config = make_config(NATS_LOG_HANDLER_BATCH_MAX_BYTES=1)
+            logger.info("a")
+            logger.info("b")
+            await handler.aflush()
+            self.assertEqual(client.batches()[-2:], [["a"], ["b"]])
+        handler.close()
+
+    async def test_dropped_records(self):
+        client = FakeNatsClient()
+        handler = NatsLogHandler(
+            client, make_config(NATS_LOG_HANDLER_BUFFER_MAX_RECORDS=2)
+        )
+        logger = make_logger("test-nats-dropped", handler)
+
+        with self.subTest(test="buffer full"):
+            formatted = []
+            for i in range(5):
+                logger.info("%s", Lazy(formatted.append, i))
+            self.assertEqual(handler.dropped_count, 3)
+            # The dropped records are not formatted
+            self.assertEqual(formatted, [0, 1])
+            await handler.aflush()
+            self.assertEqual(len(client.published), 1)
+            _subject, payload = client.published[0]
+            report, *lines = [json.loads(line) for line in payload.splitlines()]
+            self.assertEqual(report["severity"], "WARNING")
+            self.assertEqual(report["dropped_count"], 3)
+            self.assertEqual([line["message"] for line in lines], ["None", "None"])
+            self.assertEqual(handler.published_count, 2)
+
+        with self.subTest(test="publishing failed"):
+            client.fail = True
+            logger.info("lost")
+            await handler.aflush()
+            self.assertEqual(handler.dropped_count, 4)
+            client.fail = False
+            await handler.aflush()
+            self.assertIn("Dropped 1 log records", client.batches()[-1][0])
+
+        with self.subTest(test="publishing the report failed"):
+            client.fail = True
+            logger.info("lost")
+            await handler.aflush()
+            logger.info("lost again")
+            await handler.aflush()
+            # The reports are not counted as dropped records
+            self.assertEqual(handler.dropped_count, 6)
+            client.fail = False
+            logger.info("published")
+            await handler.aflush()
+            report, message = client.batches()[-1]
+            self.assertIn("Dropped 2 log records", report)
+            self.assertEqual(message, "published")
+        handler.close()
+
+    async def test_close_from_another_thread(self):
+        client = FakeNatsClient()
+        handler = NatsLogHandler(client, make_config())
+        logger = make_logger("test-nats-close", handler)
+
+        def log_and_close():
+            for i in range(3):
+                logger.info("%s", i)
+            handler.close()
+
+        thread = threading.Thread(target=log_and_close)
+        thread.start()
+        while thread.is_alive():
+            await asyncio.sleep(TEST_DELAY / 10)
+        self.assertEqual(client.batches(), [["0", "1", "2"]])
+        self.assertEqual(handler.dropped_count, 0)
+
+    async def test_config_from_environment(self):
+        with patch.dict(
+            os.environ,
+            {
+                "NATS_LOG_HANDLER_SUBJECT": TEST_SUBJECT,
+                "NATS_LOG_HANDLER_BATCH_MAX_COUNT": "5",
+            },
+            clear=True,
+        ):
+            handler = NatsLogHandler(FakeNatsClient())
+        self.assertEqual(handler.config.NATS_LOG_HANDLER_SUBJECT, TEST_SUBJECT)
+        self.assertEqual(handler.config.NATS_LOG_HANDLER_BATCH_MAX_COUNT, 5)
+        handler.close()
@@ -0,0 +1,197 @@
+import dataclasses
+import datetime
+import enum
+import json
+import logging
+import unittest
+from io import StringIO
+from typing import List, Optional, Tuple
+from unittest.mock import Mock
+
+import pydantic
+
+try:
+    from pydantic import v1 as pydantic_v1
+except ImportError:
+    # pydantic 1 is installed
+    pydantic_v1 = pydantic  # type: ignore
+from powerflex_logging_utilities import JsonFormatter, Lazy
+from powerflex_logging_utilities.payload_encoder import (
+    TRUNCATED,
+    PayloadEncoder,
+    find_encoder,
+    register_encoder,
+)
+
+
+class Color(enum.Enum):
+    RED = "red"
+
+
+@dataclasses.dataclass
+class Point:
+    x: int
+    y: int
+    color: Color = Color.RED
+
+
+class Model(pydantic.BaseModel):
+    name: str
+    points: List[Point]
+    created: datetime.datetime
+
+
+class ModelV1(pydantic_v1.BaseModel):
+    name: str
+    parent: Optional["ModelV1"] = None
+
+
+ModelV1.update_forward_refs()
+
+
+class Celsius:
+    def __init__(self, degrees: float) -> None:
+        self.degrees = degrees
+
+
+class ColdCelsius(Celsius):
+    pass
+
+
+register_encoder(Celsius, lambda value: f"{value.degrees} C")
+
+
+def make_logger(name: str, formatter: JsonFormatter) -> Tuple[logging.Logger, StringIO]:
+    stream = StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(formatter)
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.handlers = [handler]
+    logger.setLevel("INFO")
+    return logger, stream
+
+
+class Test(unittest.TestCase):
+    def test_encoders(self):
+        encoder = PayloadEncoder(max_bytes=None)
+        created = datetime.datetime(2024, 5, 1, 10, 0, 0)
+        for value, expected in [
+            (Point(1, 2), {"x": 1, "y": 2, "color": "red"}),
+            (
+                Model(name="a", points=[Point(1, 2)], created=created),
+                {
+                    "name": "a",
+                    "points": [{"x": 1, "y": 2, "color": "red"}],
+                    "created": "2024-05-01T10:00:00",
+                },
+            ),
+            (
+                ModelV1(name="child", parent=ModelV1(name="parent")),
+                {"name": "child", "parent": {"name": "parent", "parent": None}},
+            ),
+            (Color.RED, "red"),
+            (datetime.date(2024, 5, 1), "2024-05-01"),
+            (
+                Lazy(lambda: {"computed": Point(0, 0)}),
+                {"computed": {"x": 0, "y": 0, "color": "red"}},
+            ),
+            (ColdCelsius(-5), "-5 C"),
+        ]:
+            with self.subTest(value=value):
+                self.assertEqual(
+                    json.loads(json.dumps(value, default=encoder)), expected
+                )
+        with self.subTest(test="field lists are cached per type"):
+            self.assertIs(find_encoder(Point), find_encoder(Point))
+        with self.subTest(test="values without an encoder"):
+            with self.assertRaises(TypeError):
+                encoder(object())
+            self.assertEqual(PayloadEncoder(repr)(None.__class__), "<class 'NoneType'>")
+
+    def test_truncation(self):
+        encoder = PayloadEncoder(fallback=str, max_bytes=1000)
+        for value in [
+            Lazy(lambda: list(range(100000))),
+            Lazy(lambda: {str(i): "x" * 100 for i in range(1000)}),
+            Lazy(lambda: "x" * 100000),
+            Model(
+                name="a" * 5000,
+                points=[Point(i, i) for i in range(1000)],
+                created=datetime.datetime.now(),
+            ),
+        ]:
+            with self.subTest(value=type(value)):
+                output = json.dumps(value, default=encoder)
+                self.assertLess(len(output), 1500)
+                self.assertIn(TRUNCATED, output)
+
+        with self.subTest(test="converts the payload until it is full"):
+            points = Mock(side_effect=lambda: [Point(i, i) for i in range(10)])
+            encoder(Lazy(lambda: [Lazy(points) for _ in range(1000)]))
+            self.assertLess(points.call_count, 100)
+
+        with self.subTest(test="reference cycles"):
+            cycle: List[object] = []
+            cycle.append(Lazy(lambda: cycle))
+            self.assertIn(TRUNCATED, json.dumps(cycle, default=encoder))
+
+    def test_json_formatter(self):
+        payload = Mock(side_effect=lambda: {"state": [Point(1, 2)]})
+        for serializer in ["json", "orjson"]:
+            with self.subTest(serializer=serializer):
+                try:
+                    formatter = JsonFormatter(serializer=serializer)  # type: ignore
+                except ImportError:
+                    continue
+                payload.reset_mock()
+                logger, stream = make_logger(f"test-payload-{serializer}", formatter)
+                logger.debug("not emitted", extra={"payload": Lazy(payload)})
+                payload.assert_not_called()
+
+                logger.info(
+                    "emitted",
+                    extra={"payload": Lazy(payload), "point": Point(3, 4)},
+                )
+                payload.assert_called_once()
+                output = json.loads(stream.getvalue())
+                self.assertEqual(
+                    output["payload"], {"state": [{"x": 1, "y": 2, "color": "red"}]}
+                )
+                self.assertEqual(output["point"], {"x": 3, "y": 4, "color": "red"})
+
+        with self.subTest(test="max_payload_bytes"):
+            record = logging.LogRecord(
+                "test", logging.INFO, __file__, 1, "hello", None, None
+            )
+            record.payload = Lazy(lambda: "x" * 100000)
+            self.assertLess(
+                len(JsonFormatter(max_payload_bytes=100).format(record)), 500
+            )
+            self.assertGreater(
+                len(JsonFormatter(max_payload_bytes=None).format(record)), 100000
+            )
+
+        with self.subTest(test="plain extra values"):
+            record = logging.LogRecord(
+                "test", logging.INFO, __file__, 1, "hello", None, None
+            )
+            record.payload = {str(i): "x" * 100 for i in range(10000)}
+            record.lines = ["x" * 100] * 10000
+            record.text = "x" * 100000
+            record.small = {"count": 1, "names": ["a", "b"]}
+            record.number = 10**30
+            for formatter in [
+                JsonFormatter(max_payload_bytes=1000),
+                JsonFormatter(max_payload_bytes=1000, rename_fields={"text": "body"}),
+            ]:
+                output = formatter.format(record)
+                self.assertLess(len(output), 5000)
+                fields = json.loads(output)
+                self.assertIn(TRUNCATED, fields["payload"])
+                self.assertIn(TRUNCATED, fields["lines"][-1])
+                self.assertTrue(
+                    fields.get("text", fields.get("body")).endswith(TRUNCATED)
+                )
+                self.assertEqual(fields["small"], record.small)
+                self.assertEqual(fields["number"], 10**30)
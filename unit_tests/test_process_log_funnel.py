@@ -0,0 +1,130 @@
+import logging
+import multiprocessing
+import pickle
+import queue
+import threading
+import unittest
+from io import StringIO
+
+from powerflex_logging_utilities import JsonFormatter
+from powerflex_logging_utilities.process_log_funnel import (
+    LogFunnel,
+    ProcessFunnelHandler,
+    init_worker_logging,
+)
+
+WORKER_LOGGER_NAME = "test-process-funnel-worker"
+
+
+def log_in_worker(number: int) -> int:
+    logger = logging.getLogger(WORKER_LOGGER_NAME)
+    logger.info("task %s", number, extra={"task": number})
+    logger.debug("not logged")
+    return number
+
+
+class ListHandler(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.records = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
+
+class Unpicklable:
+    def __reduce__(self):
+        raise TypeError("can't pickle")
+
+    def __repr__(self) -> str:
+        return "<Unpicklable>"
+
+
+class Test(unittest.TestCase):
+    def test_handler_batches(self):
+        record_queue: queue.Queue = queue.Queue()
+        handler = ProcessFunnelHandler(
+            record_queue, batch_max_count=2, flush_interval_sec=60
+        )
+        logger = logging.getLogger("test-process-funnel-batches")
+        logger.propagate = False
+        logger.handlers = [handler]
+        logger.setLevel(logging.INFO)
+
+        funnel_stream = StringIO()
+        funnel_handler = logging.StreamHandler(funnel_stream)
+        funnel_handler.setFormatter(JsonFormatter())
+        funnel = LogFunnel([funnel_handler])
+        # Read the batches of the thread queue
+        funnel.queue = record_queue
+
+        with self.subTest(test="full batches are sent"):
+            for i in range(3):
+                logger.info("%s", i)
+            self.assertEqual(record_queue.qsize(), 1)
+            self.assertEqual(handler.sent_count, 2)
+
+        with self.subTest(test="close sends the rest"):
+            logger.info("with extra", extra={"value": Unpicklable(), "ok": 1})
+            handler.close()
+            self.assertEqual(handler.sent_count, 4)
+
+        with funnel:
+            pass
+        lines = funnel_stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertIn('"message": "2"', lines[2])
+        with self.subTest(test="unpicklable extras are sent as text"):
+            self.assertIn('"value": "<Unpicklable>"', lines[3])
+            self.assertIn('"ok": "1"', lines[3])
+
+    def test_flush_interval(self):
+        record_queue: queue.Queue = queue.Queue()
+        handler = ProcessFunnelHandler(record_queue, flush_interval_sec=0.01)
+        handler.handle(logging.makeLogRecord({"msg": "one"}))
+        batch = pickle.loads(record_queue.get(timeout=1))
+        self.assertEqual(len(batch), 1)
+        handler.close()
+
+    def test_pool_workers(self):
+        handler = ListHandler()
+        logger = logging.getLogger(WORKER_LOGGER_NAME)
+        logger.propagate = False
+        logger.handlers = [handler]
+
+        context = multiprocessing.get_context("spawn")
+        with LogFunnel(max_batches=2, context=context) as funnel:
+            with context.Pool(
+                2,
+                initializer=init_worker_logging,
+                initargs=(funnel.queue, [WORKER_LOGGER_NAME], "INFO", 2),
+            ) as pool:
+                self.assertEqual(pool.map(log_in_worker, range(10)), list(range(10)))
+                pool.close()
+                pool.join()
+        self.assertEqual(funnel.received_count, 10)
+
+        records = handler.records
+        self.assertEqual(
+            sorted(record.getMessage() for record in records),
+            sorted(f"task {number}" for number in range(10)),
+        )
+        with self.subTest(test="records keep the worker process and extras"):
+            self.assertEqual(sorted(record.task for record in records), list(range(10)))
+            self.assertNotIn(
+                multiprocessing.current_process().pid,
+                {record.process for record in records},
+            )
+
+    def test_stop_waits_for_the_writer(self):
+        handler = logging.StreamHandler(StringIO())
+        funnel = LogFunnel([handler], context=multiprocessing.get_context("spawn"))
+        funnel.start()
+        worker_handler = ProcessFunnelHandler(funnel.queue)
+        worker_handler.handle(logging.makeLogRecord({"msg": "last"}))
+        worker_handler.close()
+        thread = threading.Thread(target=funnel.stop)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(funnel.received_count, 1)
@@ -0,0 +1,238 @@
+import json
+import logging
+import threading
+import time
+import unittest
+from io import StringIO
+
+from powerflex_logging_utilities import JsonFormatter, Lazy, init_loggers
+from powerflex_logging_utilities.log_level_listener import (
+    BaseAsyncLogLevelListener,
+    LogLevelListenerConfig,
+)
+from powerflex_logging_utilities.queue_handler import (
+    DROPPED_RECORDS_MESSAGE,
+    BackgroundQueueHandler,
+)
+
+
+class ListHandler(logging.Handler):
+    """Keep the records it handles. Waits for `unblocked` before handling each record."""
+
+    def __init__(self, level: int = logging.NOTSET):
+        super().__init__(level)
+        self.records = []
+        self.unblocked = threading.Event()
+        self.unblocked.set()
+
+    def emit(self, record):
+        self.unblocked.wait()
+        self.records.append(record)
+
+
+class SlowHandler(ListHandler):
+    """Slower than the producers, so the queue never empties while they log."""
+
+    def emit(self, record):
+        time.sleep(0.001)
+        super().emit(record)
+
+
+def make_logger(name: str, handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.handlers = [handler]
+    logger.setLevel("DEBUG")
+    return logger
+
+
+class Test(unittest.TestCase):
+    def test_block(self):
+        inner = ListHandler()
+        handler = BackgroundQueueHandler([inner], max_size=2)
+        logger = make_logger("test-queue-block", handler)
+
+        for i in range(100):
+            logger.info("message %s", i)
+        handler.flush()
+
+        self.assertEqual(
+            [record.getMessage() for record in inner.records],
+            [f"message {i}" for i in range(100)],
+        )
+        self.assertEqual(handler.dropped_count, 0)
+        handler.close()
+
+    def test_flush_with_sustained_producers(self):
+        inner = SlowHandler()
+        handler = BackgroundQueueHandler([inner], max_size=10)
+        logger = make_logger("test-queue-flush", handler)
+        logger.info("before flush")
+        stopped = threading.Event()
+
+        def produce():
+            while not stopped.is_set():
+                logger.info("during flush")
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        flusher = threading.Thread(target=handler.flush)
+        flusher.start()
+        flusher.join(timeout=10)
+        flushed = not flusher.is_alive()
+        stopped.set()
+        producer.join()
+        handler.close()
+
+        self.assertTrue(flushed)
+        self.assertEqual(inner.records[0].getMessage(), "before flush")
+
+        with self.subTest(test="flush markers dropped by drop_oldest"):
+            inner = ListHandler()
+            inner.unblocked.clear()
+            handler = BackgroundQueueHandler(
+                [inner], max_size=2, overflow_policy="drop_oldest"
+            )
+            logger = make_logger("test-queue-flush-drop-oldest", handler)
+            flusher = threading.Thread(target=handler.flush)
+            flusher.start()
+            for i in range(5):
+                logger.info("message %s", i)
+            inner.unblocked.set()
+            flusher.join(timeout=10)
+            self.assertFalse(flusher.is_alive())
+            handler.close()
+
+    def test_drop_policies(self):
+        for policy, expected_kept in [
+            ("drop_newest", ["message 0", "message 1", "message 2"]),
+            ("drop_oldest", ["message 0", "message 8", "message 9"]),
+        ]:
+            with self.subTest(policy=policy):
+                inner = ListHandler()
+                inner.unblocked.clear()
+                handler = BackgroundQueueHandler(
+                    [inner], max_size=2, overflow_policy=policy
+                )
+                logger = make_logger(f"test-queue-{policy}", handler)
+
+                logger.info("message %s", 0)
+                # Wait for the writer thread to take the first record off the queue
+                while not handler.record_queue.empty():
+                    pass
+                for i in range(1, 10):
+                    logger.info("message %s", i)
+                inner.unblocked.set()
+                handler.close()
+
+                messages = [record.getMessage() for record in inner.records]
+                self.assertEqual(handler.dropped_count, 7)
+                self.assertEqual(
+                    [message for message in messages if "Dropped" not in message],
+                    expected_kept,
+                )
+                dropped_record = inner.records[1]
+                self.assertEqual(dropped_record.msg, DROPPED_RECORDS_MESSAGE)
+                self.assertEqual(dropped_record.dropped_count, 7)
+                self.assertEqual(dropped_record.levelno, logging.WARNING)
+
+    def test_close(self):
+        for policy in ["block", "drop_newest", "drop_oldest"]:
+            with self.subTest(policy=policy):
+                inner = SlowHandler()
+                handler = BackgroundQueueHandler(
+                    [inner], max_size=2, overflow_policy=policy
+                )
+                logger = make_logger(f"test-queue-close-{policy}", handler)
+                stopped = threading.Event()
+
+                def produce():
+                    while not stopped.is_set():
+                        logger.info("during close")
+
+                producers = [threading.Thread(target=produce) for _ in range(4)]
+                for producer in producers:
+                    producer.start()
+                time.sleep(0.01)
+                closer = threading.Thread(target=handler.close)
+                closer.start()
+                closer.join(timeout=10)
+                closed = not closer.is_alive()
+                stopped.set()
+                for producer in producers:
+                    producer.join()
+                self.assertTrue(closed)
+
+                with self.subTest(test="records logged after close are dropped"):
+                    written = len(inner.records)
+                    dropped_count = handler.dropped_count
+                    for _ in range(5):
+                        logger.info("after close")
+                    self.assertEqual(len(inner.records), written)
+                    self.assertEqual(handler.dropped_count, dropped_count + 5)
+
+    def test_invalid_overflow_policy(self):
+        with self.assertRaisesRegex(ValueError, "overflow_policy"):
+            BackgroundQueueHandler([], overflow_policy="drop_everything")  # type: ignore
+
+    def test_handler_levels_and_exceptions(self):
+        info_handler = ListHandler(logging.INFO)
+        debug_handler = ListHandler(logging.DEBUG)
+        handler = BackgroundQueueHandler([info_handler, debug_handler])
+        logger = make_logger("test-queue-levels", handler)
+
+        logger.debug("debug")
+        try:
+            raise RuntimeError("oops")
+        except RuntimeError:
+            logger.exception("error")
+        handler.close()
+        # Closing twice does nothing
+        handler.close()
+
+        self.assertEqual([r.msg for r in info_handler.records], ["error"])
+        self.assertEqual([r.msg for r in debug_handler.records], ["debug", "error"])
+        self.assertIsNone(info_handler.records[0].exc_info)
+        self.assertIn("RuntimeError: oops", info_handler.records[0].exc_text)
+
+    def test_records_no_handler_writes_are_not_queued(self):
+        inner = ListHandler(logging.INFO)
+        handler = BackgroundQueueHandler([inner])
+        logger = make_logger("test-queue-skipped", handler)
+
+        logger.debug("%s", Lazy(self.fail, "Lazy argument should not be evaluated"))
+        logger.info("%s", Lazy(str, "written"))
+        handler.close()
+
+        self.assertEqual([r.getMessage() for r in inner.records], ["written"])
+
+    def test_init_loggers_with_queue(self):
+        fake_stdout = StringIO()
+        logger = logging.getLogger("test-queue-init-loggers")
+        init_loggers.init_loggers(
+            [logger],
+            log_level="DEBUG",
+            file_log_level=None,
+            filename=None,
+            formatter=JsonFormatter,
+            stream=fake_stdout,
+            use_queue=True,
+            queue_max_size=10,
+            queue_overflow_policy="drop_oldest",
+        )
+        queue_handler = logger.handlers[-1]
+        self.assertIsInstance(queue_handler, BackgroundQueueHandler)
+
+        with self.subTest(test="log level listener finds the stdout handler"):
+            listener = BaseAsyncLogLevelListener(logger, LogLevelListenerConfig())
+            # pylint: disable=protected-access
+            self.assertEqual(listener._get_stdout_handler_or_logger().name, "stdout")
+
+        logger.info("hello %s", "world", extra={"field": 1})
+        queue_handler.flush()
+
+        output = json.loads(fake_stdout.getvalue().splitlines()[-1])
+        self.assertEqual(output["message"], "hello world")
+        self.assertEqual(output["severity"], "INFO")
+        self.assertEqual(output["field"], 1)
+        queue_handler.close()
@@ -0,0 +1,147 @@
+import json
+import logging
+import unittest
+from io import StringIO
+from unittest.mock import patch
+
+from powerflex_logging_utilities import JsonFormatter, init_loggers
+from powerflex_logging_utilities.rate_limit_filter import (
+    REPEATED_MESSAGE,
+    RateLimitFilter,
+)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_logger(name: str, *handlers: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.handlers = list(handlers)
+    logger.setLevel("DEBUG")
+    return logger
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        patcher = patch("time.monotonic", return_value=1000.0)
+        self.mock_monotonic = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rate_limit_and_summary(self):
+        rate_limit_filter = RateLimitFilter(rate_per_second=2, burst=3)
+        handler = ListHandler()
+        handler.addFilter(rate_limit_filter)
+        logger = make_logger("test-rate-limit", handler)
+
+        def flood(count):
+            for i in range(count):
+                logger.warning("flapping %s", i)
+
+        with self.subTest(test="burst then suppression"):
+            flood(10)
+            logger.info("another call site")
+            self.assertEqual(
+                [r.getMessage() for r in handler.records],
+                ["flapping 0", "flapping 1", "flapping 2", "another call site"],
+            )
+            self.assertEqual(rate_limit_filter.suppressed_total, 7)
+
+        with self.subTest(test="tokens refill over time"):
+            handler.records.clear()
+            self.mock_monotonic.return_value += 1
+            flood(10)
+            self.assertEqual(
+                [r.getMessage() for r in handler.records], ["flapping 0", "flapping 1"]
+            )
+
+        with self.subTest(test="summary"):
+            handler.records.clear()
+            rate_limit_filter.flush_summaries()
+            self.assertEqual(len(handler.records), 1)
+            summary = handler.records[0]
+            self.assertEqual(summary.msg, REPEATED_MESSAGE)
+            self.assertEqual(
+                summary.getMessage(), "Previous message repeated 15 times: flapping 9"
+            )
+            self.assertEqual(summary.suppressed_count, 15)
+            self.assertEqual(summary.levelno, logging.WARNING)
+            self.assertEqual(summary.name, logger.name)
+            self.assertEqual(summary.funcName, "flood")
+
+            handler.records.clear()
+            rate_limit_filter.flush_summaries()
+            self.assertEqual(handler.records, [])
+
+    def test_periodic_summary_and_eviction(self):
+        rate_limit_filter = RateLimitFilter(
+            rate_per_second=1, burst=1, max_call_sites=2, summary_interval_seconds=5
+        )
+        handler = ListHandler()
+        handler.addFilter(rate_limit_filter)
+        logger = make_logger("test-rate-limit-periodic", handler)
+
+        for _ in range(3):
+            logger.info("first")
+        self.mock_monotonic.return_value += 0.5
+        for _ in range(3):
+            logger.info("second")
+        self.assertEqual([r.msg for r in handler.records], ["first", "second"])
+
+        with self.subTest(test="evicting a call site logs its summary"):
+            logger.info("third")
+            self.assertEqual(
+                [r.getMessage() for r in handler.records[2:]],
+                ["Previous message repeated 2 times: first", "third"],
+            )
+
+        with self.subTest(test="summaries are logged every summary_interval_seconds"):
+            self.mock_monotonic.return_value += 5
+            logger.info("fourth")
+            self.assertEqual(
+                [r.getMessage() for r in handler.records[4:]],
+                ["Previous message repeated 2 times: second", "fourth"],
+            )
+
+    def test_init_loggers_shares_filter_between_handlers(self):
+        fake_stdout = StringIO()
+        file_handler = ListHandler()
+        rate_limit_filter = RateLimitFilter(rate_per_second=1, burst=2)
+        logger = logging.getLogger("test-rate-limit-init-loggers")
+        init_loggers.init_loggers(
+            [logger],
+            log_level="DEBUG",
+            file_log_level=None,
+            filename=None,
+            formatter=JsonFormatter,
+            stream=fake_stdout,
+            filters=[rate_limit_filter],
+        )
+        file_handler.addFilter(rate_limit_filter)
+        logger.addHandler(file_handler)
+        child_logger = logging.getLogger("test-rate-limit-init-loggers.child")
+
+        for i in range(5):
+            child_logger.error("error %s", i)
+        rate_limit_filter.flush_summaries()
+
+        lines = [json.loads(line) for line in fake_stdout.getvalue().splitlines()]
+        self.assertEqual(
+            [line["message"] for line in lines],
+            [
+                "error 0",
+                "error 1",
+                "Previous message repeated 3 times: error 4",
+            ],
+        )
+        self.assertEqual(lines[-1]["suppressed_count"], 3)
+        self.assertEqual(lines[-1]["name"], child_logger.name)
+        self.assertEqual(lines[-1]["severity"], "ERROR")
+        self.assertEqual(len(file_handler.records), 3)
+        self.assertEqual(rate_limit_filter.suppressed_total, 3)
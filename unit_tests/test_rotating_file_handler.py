@@ -0,0 +1,178 @@
+import gzip
+import json
+import logging
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+from powerflex_logging_utilities import JsonFormatter, init_loggers
+from powerflex_logging_utilities.rotating_file_handler import (
+    BackgroundRotatingFileHandler,
+)
+
+
+def make_logger(name: str, handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.handlers = [handler]
+    logger.setLevel("DEBUG")
+    return logger
+
+
+def read_segment(path: str) -> bytes:
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as compressed:
+            return compressed.read()
+    if path.endswith(".zst"):
+        with open(path, "rb") as compressed:
+            return zstandard.ZstdDecompressor().stream_reader(compressed).read()
+    with open(path, "rb") as segment:
+        return segment.read()
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.filename = os.path.join(self.tmpdir.name, "logs", "test.log")
+
+    def test_size_rotation(self):
+        for compression, suffix in [(None, ""), ("gzip", ".gz"), ("zstd", ".zst")]:
+            with self.subTest(compression=compression):
+                if compression == "zstd" and zstandard is None:
+                    continue
+                filename = f"{self.filename}.{compression}"
+                handler = BackgroundRotatingFileHandler(
+                    filename, max_bytes=20, compression=compression
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger = make_logger(f"test-rotation-{compression}", handler)
+
+                for i in range(5):
+                    logger.info("message number %s", i)
+                handler.wait_for_rotation()
+
+                for index in range(1, 5):
+                    self.assertEqual(
+                        read_segment(f"{filename}.{index}{suffix}"),
+                        f"message number {index - 1}\n".encode(),
+                    )
+                    self.assertFalse(
+                        compression and os.path.exists(f"{filename}.{index}")
+                    )
+                handler.close()
+                with open(filename, "rb") as current:
+                    self.assertEqual(current.read(), b"message number 4\n")
+
+    def test_backup_count_and_existing_segments(self):
+        os.makedirs(os.path.dirname(self.filename))
+        for index in [3, 7]:
+            with open(f"{self.filename}.{index}", "wb"):
+                pass
+        handler = BackgroundRotatingFileHandler(
+            self.filename, max_bytes=1, backup_count=3, compression="gzip"
+        )
+        logger = make_logger("test-rotation-backup-count", handler)
+
+        for i in range(5):
+            logger.info("message %s", i)
+        handler.close()
+
+        self.assertEqual(
+            sorted(os.listdir(os.path.dirname(self.filename))),
+            ["test.log", "test.log.10.gz", "test.log.11.gz", "test.log.9.gz"],
+        )
+        self.assertEqual(read_segment(f"{self.filename}.11.gz"), b"message 3\n")
+
+    def test_time_rotation(self):
+        with patch("time.time", return_value=1000.0) as mock_time:
+            handler = BackgroundRotatingFileHandler(self.filename, interval_seconds=60)
+            logger = make_logger("test-rotation-time", handler)
+
+            logger.info("first")
+            mock_time.return_value = 1059.0
+            logger.info("second")
+            mock_time.return_value = 1060.0
+            logger.info("third")
+            mock_time.return_value = 1200.0
+            logger.info("fourth")
+            handler.do_rollover()
+            # Empty files are not rotated
+            handler.do_rollover()
+            handler.close()
+
+        self.assertEqual(read_segment(f"{self.filename}.1"), b"first\nsecond\n")
+        self.assertEqual(read_segment(f"{self.filename}.2"), b"third\n")
+        self.assertEqual(read_segment(f"{self.filename}.3"), b"fourth\n")
+        self.assertEqual(read_segment(self.filename), b"")
+        self.assertFalse(os.path.exists(f"{self.filename}.4"))
+
+    def test_invalid_compression(self):
+        with self.assertRaisesRegex(ValueError, "compression"):
+            BackgroundRotatingFileHandler(self.filename, compression="zip")  # type: ignore
+
+    def test_init_loggers_with_background_rotation(self):
+        logger = logging.getLogger("test-rotation-init-loggers")
+        init_loggers.init_loggers(
+            [logger],
+            log_level="CRITICAL",
+            file_log_level="DEBUG",
+            filename=self.filename,
+            max_bytes=100,
+            formatter=JsonFormatter,
+            compression="gzip",
+        )
+        handler = logger.handlers[-1]
+        self.assertIsInstance(handler, BackgroundRotatingFileHandler)
+
+        logger.info("hello", extra={"padding": "x" * 100})
+        logger.info("world")
+        handler.wait_for_rotation()
+        handler.close()
+
+        self.assertIn(b'"message": "hello"', read_segment(f"{self.filename}.1.gz"))
+        self.assertIn(b'"message": "world"', read_segment(self.filename))
+
+    def test_init_loggers_shares_the_handler(self):
+        loggers = [logging.getLogger(f"test-rotation-shared-{i}") for i in range(3)]
+        for logger in loggers:
+            self.addCleanup(logger.handlers.clear)
+        init_loggers.init_loggers(
+            loggers,
+            log_level="CRITICAL",
+            file_log_level="DEBUG",
+            filename=self.filename,
+            max_bytes=200,
+            backup_count=100,
+            formatter=JsonFormatter,
+            background_rotation=True,
+        )
+        handler = loggers[0].handlers[-1]
+        self.assertIsInstance(handler, BackgroundRotatingFileHandler)
+        for logger in loggers:
+            self.assertIs(logger.handlers[-1], handler)
+
+        for i in range(30):
+            for logger in loggers:
+                logger.info("message %s", i)
+        handler.wait_for_rotation()
+        handler.close()
+
+        names = os.listdir(os.path.dirname(self.filename))
+        self.assertGreater(len(names), 10)
+        lines = b"".join(
+            read_segment(os.path.join(os.path.dirname(self.filename), name))
+            for name in names
+        ).splitlines()
+        self.assertEqual(len(lines), 90)
+        self.assertEqual(
+            sorted(json.loads(line)["message"] for line in lines),
+            sorted(f"message {i}" for i in range(30) for _logger in loggers),
+        )
@@ -0,0 +1,97 @@
+import logging
+import random
+import unittest
+from contextvars import ContextVar
+from unittest.mock import patch
+
+from powerflex_logging_utilities import TRACE, TraceLogger
+from powerflex_logging_utilities.sampling_filter import SamplingFilter
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_logger(name: str, *handlers: logging.Handler) -> TraceLogger:
+    logger = TraceLogger(name)
+    logger.handlers = list(handlers)
+    logger.setLevel(TRACE)
+    return logger
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+
+    def test_fixed_rates(self):
+        sampling_filter = SamplingFilter({"TRACE": 0.1, logging.DEBUG: 0.5})
+        handler = ListHandler()
+        handler.addFilter(sampling_filter)
+        logger = make_logger("test-sampling-rates", handler)
+
+        for _ in range(2000):
+            logger.trace("trace")
+            logger.debug("debug")
+            logger.info("info")
+
+        counts = {
+            level: sum(1 for r in handler.records if r.levelno == level)
+            for level in [TRACE, logging.DEBUG, logging.INFO]
+        }
+        self.assertAlmostEqual(counts[TRACE], 200, delta=50)
+        self.assertAlmostEqual(counts[logging.DEBUG], 1000, delta=100)
+        self.assertEqual(counts[logging.INFO], 2000)
+        self.assertEqual(
+            sampling_filter.dropped_total, 4000 - sum(counts.values()) + 2000
+        )
+        self.assertEqual(
+            {getattr(r, "sample_rate", None) for r in handler.records}, {0.1, 0.5, None}
+        )
+
+    def test_sample_by(self):
+        request_id: ContextVar[str] = ContextVar("request_id")
+        for sample_by in ["request_id", request_id]:
+            with self.subTest(sample_by=sample_by):
+                handler = ListHandler()
+                handler.addFilter(SamplingFilter({"DEBUG": 0.3}, sample_by=sample_by))
+                logger = make_logger("test-sampling-by", handler)
+
+                for i in range(200):
+                    request_id.set(str(i))
+                    for _ in range(5):
+                        logger.debug("debug", extra={"request_id": str(i)})
+
+                kept_ids = [r.request_id for r in handler.records]
+                self.assertAlmostEqual(len(set(kept_ids)), 60, delta=20)
+                for kept_id in set(kept_ids):
+                    self.assertEqual(kept_ids.count(kept_id), 5)
+
+    def test_adaptive_rate(self):
+        sampling_filter = SamplingFilter({"DEBUG": 1}, max_records_per_second=10)
+        first_handler, second_handler = ListHandler(), ListHandler()
+        first_handler.addFilter(sampling_filter)
+        second_handler.addFilter(sampling_filter)
+        logger = make_logger("test-sampling-adaptive", first_handler, second_handler)
+
+        with patch("time.monotonic", return_value=1e9):
+            for _ in range(100):
+                logger.debug("debug")
+            self.assertEqual(len(first_handler.records), 10)
+            self.assertEqual(first_handler.records, second_handler.records)
+            self.assertEqual(sampling_filter.sample_rate_factor, 1)
+
+        with patch("time.monotonic", return_value=1e9 + 1):
+            for _ in range(100):
+                logger.debug("debug")
+            self.assertAlmostEqual(sampling_filter.sample_rate_factor, 0.1)
+            self.assertLessEqual(len(first_handler.records), 20)
+            self.assertEqual(first_handler.records[-1].sample_rate, 0.1)
+
+    def test_invalid_level(self):
+        with self.assertRaisesRegex(ValueError, "Unknown log level"):
+            SamplingFilter({"VERBOSE": 0.1})
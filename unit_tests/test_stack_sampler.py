@@ -0,0 +1,57 @@
+import asyncio
+import os
+import time
+import unittest
+
+from powerflex_logging_utilities.stack_sampler import StackSampler
+
+TEST_DELAY = float(os.environ.get("TEST_DELAY", 0.05))
+
+
+def blocking_function(delay):
+    time.sleep(delay)
+
+
+class Test(unittest.TestCase):
+    def test_sample_slow_callbacks(self):
+        sampler = StackSampler(TEST_DELAY, interval_sec=TEST_DELAY / 10, max_samples=5)
+        sampler.install()
+        popped = []
+
+        def callback(delay):
+            blocking_function(delay)
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            for delay in [TEST_DELAY / 10, 3 * TEST_DELAY]:
+                loop.call_soon(callback, delay)
+                await asyncio.sleep(0)
+                await asyncio.sleep(0)
+                popped.append(sampler.pop_samples())
+
+        try:
+            asyncio.run(main())
+        finally:
+            sampler.uninstall()
+
+        fast, slow = popped[0], popped[1]
+        with self.subTest(test="fast callbacks are not sampled"):
+            self.assertIsNone(fast)
+
+        with self.subTest(test="folded stacks"):
+            lines = slow.splitlines()
+            counts = [int(line.rsplit(" ", 1)[1]) for line in lines]
+            self.assertGreater(sum(counts), 0)
+            self.assertLessEqual(sum(counts), 5)
+            frames = lines[0].rsplit(" ", 1)[0].split(";")
+            self.assertTrue(frames[0].startswith("callback ("))
+            self.assertTrue(frames[1].startswith("blocking_function ("))
+
+        with self.subTest(test="samples are popped once"):
+            self.assertIsNone(sampler.pop_samples())
+
+        with self.subTest(test="uninstall"):
+            # pylint: disable=protected-access
+            self.assertIsNot(
+                asyncio.events.Handle._run.__code__, sampler._sampled_run_code
+            )